@@ -0,0 +1,8 @@
+"""Benchmarks for the Journi backend (run with `python -m benchmarks.<name>`)."""
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of samples."""
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
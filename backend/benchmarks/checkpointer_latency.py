@@ -0,0 +1,107 @@
+"""
+Per-turn persistence latency by checkpointer mode.
+
+Runs the real Journi graph with a stub LLM, so each turn is the usual
+process -> tools -> respond supersteps and the time measured is graph
+overhead plus checkpoint persistence.
+
+Usage:
+    python -m benchmarks.checkpointer_latency --turns 200
+    SUPABASE_DB_URL=postgresql://... python -m benchmarks.checkpointer_latency
+
+Postgres is only benchmarked when SUPABASE_DB_URL is set.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks import percentile
+from benchmarks.stub_llm import install_stub_llm
+
+
+async def make_checkpointer(mode: str, tmpdir: str, commit_interval_ms: float):
+    """Create a checkpointer for the given mode. Returns (saver, closer)."""
+    if mode == "memory":
+        from langgraph.checkpoint.memory import InMemorySaver
+        return InMemorySaver(), None
+
+    if mode.startswith("sqlite"):
+        from sqlite_checkpointer import create_sqlite_checkpointer
+        interval = 0 if mode == "sqlite-unbatched" else commit_interval_ms
+        path = os.path.join(tmpdir, f"{mode}.sqlite")
+        saver = await create_sqlite_checkpointer(path, commit_interval_ms=interval)
+        return saver, saver.aclose
+
+    if mode == "postgres":
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+        from psycopg_pool import AsyncConnectionPool
+
+        pool = AsyncConnectionPool(conninfo=os.environ["SUPABASE_DB_URL"], max_size=10, min_size=1, open=False)
+        await pool.open()
+        saver = AsyncPostgresSaver(pool)
+        await saver.setup()
+        return saver, pool.close
+
+    raise ValueError(f"Unknown mode: {mode}")
+
+
+async def run_mode(mode: str, turns: int, tmpdir: str, commit_interval_ms: float) -> dict:
+    from graph import build_graph_builder
+
+    saver, closer = await make_checkpointer(mode, tmpdir, commit_interval_ms)
+    agent = build_graph_builder().compile(checkpointer=saver)
+    config = {"configurable": {"thread_id": f"bench-{mode}-{time.time_ns()}"}}
+
+    latencies = []
+    for i in range(turns):
+        # Alternate expense turns (3 supersteps) and chat turns (1 superstep)
+        content = f"[juan]: Pagué {10 + i} por el taxi" if i % 2 == 0 else "[maria]: ¿cuánto debo?"
+        start = time.perf_counter()
+        await agent.ainvoke(
+            {"messages": [{"role": "user", "content": content}],
+             "session_context": {"current_user": "juan", "trip_id": None, "pending_uploads": []}},
+            config=config
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    state = await agent.aget_state(config)
+    if closer:
+        await closer()
+
+    return {
+        "mode": mode,
+        "turns": turns,
+        "expenses": len(state.values.get("expenses", [])),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.mean(latencies),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--commit-interval-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    install_stub_llm()
+
+    modes = ["memory", "sqlite", "sqlite-unbatched"]
+    if os.getenv("SUPABASE_DB_URL"):
+        modes.append("postgres")
+    else:
+        print("(SUPABASE_DB_URL not set - skipping postgres)")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f"{'mode':<18}{'turns':>7}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+        for mode in modes:
+            r = await run_mode(mode, args.turns, tmpdir, args.commit_interval_ms)
+            print(f"{r['mode']:<18}{r['turns']:>7}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['mean_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
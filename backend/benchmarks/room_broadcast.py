@@ -0,0 +1,158 @@
+"""
+Broadcast throughput across many concurrent rooms.
+
+Every room has its own producer broadcasting bot_chunk frames (like an
+agent streaming a reply) while clients join and leave other rooms. Sockets
+are in-memory fakes, so the numbers are RoomManager overhead only: encoding,
+history, fan-out into per-connection queues and the writer tasks.
+
+A few rooms (--slow-rooms) have one client whose sends take --slow-ms, like
+a phone on a bad connection. The baseline models one lock shared by every
+room with each send awaited while holding it, so that client stalls every
+room; with per-room locks and send queues it only delays itself.
+
+Usage:
+    python -m benchmarks.room_broadcast --rooms 1000 --clients 5 --messages 50
+    python -m benchmarks.room_broadcast --global-lock   # old single-lock behavior
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks import percentile
+from fast_json import dumps
+from room_manager import RoomManager, EPHEMERAL_TYPES
+
+
+class NullWebSocket:
+    """Accepts frames and discards them."""
+
+    def __init__(self):
+        self.frames = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.frames += 1
+
+    async def close(self, code=1000):
+        pass
+
+
+class SlowWebSocket(NullWebSocket):
+    """A client whose every send takes `delay` seconds."""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    async def send_text(self, text):
+        await asyncio.sleep(self.delay)
+        self.frames += 1
+
+
+class GlobalLockRoomManager(RoomManager):
+    """Baseline: one lock for every room, held while each socket is sent to."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.global_lock = asyncio.Lock()
+        self._room_lock = lambda thread_id: self.global_lock
+
+    async def deliver(self, thread_id, message):
+        async with self.global_lock:
+            if thread_id not in self.active_connections:
+                return
+            encoded = dumps(message)
+            if message.get("type") not in EPHEMERAL_TYPES:
+                self._append_history(thread_id, message, len(encoded))
+            for websocket in self.active_connections[thread_id]:
+                try:
+                    await websocket.send_text(encoded)
+                except Exception:
+                    pass
+
+
+async def run(
+    rooms: int,
+    clients: int,
+    messages: int,
+    global_lock: bool,
+    slow_rooms: int = 0,
+    slow_ms: float = 0.0
+) -> dict:
+    manager = (GlobalLockRoomManager if global_lock else RoomManager)(send_queue_size=messages + 16)
+    sockets = []
+    # Spread the slow clients evenly over the rooms
+    slow_every = rooms // slow_rooms if slow_rooms else 0
+    for r in range(rooms):
+        for c in range(clients):
+            slow = slow_every and c == 0 and r % slow_every == 0
+            ws = SlowWebSocket(slow_ms / 1000) if slow else NullWebSocket()
+            sockets.append(ws)
+            await manager.connect(f"ROOM{r:04d}", f"user{c}", ws)
+
+    latencies = []
+
+    async def producer(thread_id: str):
+        for i in range(messages):
+            start = time.perf_counter()
+            await manager.broadcast(thread_id, {"type": "bot_chunk", "content": f"token {i} "})
+            latencies.append((time.perf_counter() - start) * 1e6)
+            # Let writers and other rooms run, like a real token stream
+            await asyncio.sleep(0)
+
+    async def churn():
+        # Clients joining and leaving an unrelated room the whole time
+        for i in range(messages):
+            ws = NullWebSocket()
+            await manager.connect("CHURN", f"guest{i}", ws)
+            await manager.disconnect("CHURN", f"guest{i}", ws)
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(churn(), *(producer(f"ROOM{r:04d}") for r in range(rooms)))
+    for connection in list(manager.connections.values()):
+        await connection.flush(timeout=60)
+    elapsed = time.perf_counter() - start
+
+    frames = sum(ws.frames for ws in sockets)
+    for connection in list(manager.connections.values()):
+        connection.close()
+
+    return {
+        "mode": "global-lock" if global_lock else "per-room",
+        "broadcasts_per_s": rooms * messages / elapsed,
+        "frames_per_s": frames / elapsed,
+        "frames": frames,
+        "p50_us": percentile(latencies, 50),
+        "p99_us": percentile(latencies, 99),
+        "mean_us": statistics.mean(latencies),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--slow-rooms", type=int, default=20, help="rooms with one slow client")
+    parser.add_argument("--slow-ms", type=float, default=5.0, help="milliseconds per send to a slow client")
+    parser.add_argument("--global-lock", action="store_true", help="only run the single-lock baseline")
+    args = parser.parse_args()
+
+    modes = [True] if args.global_lock else [True, False]
+    print(f"{args.rooms} rooms x {args.clients} clients x {args.messages} broadcasts, "
+          f"{args.slow_rooms} slow client(s) at {args.slow_ms:g}ms/send")
+    print(f"{'mode':<14}{'bcast/s':>12}{'frames/s':>12}{'p50 us':>10}{'p99 us':>10}")
+    for global_lock in modes:
+        r = await run(args.rooms, args.clients, args.messages, global_lock, args.slow_rooms, args.slow_ms)
+        print(f"{r['mode']:<14}{r['broadcasts_per_s']:>12.0f}{r['frames_per_s']:>12.0f}"
+              f"{r['p50_us']:>10.1f}{r['p99_us']:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""
+Stub LLM for benchmarks
+
+Deterministic stand-in for LLMWithFallback so benchmarks measure the
+backend (checkpointing, rooms, fan-out) instead of provider latency.
+Responses stream token by token through LangChain callbacks, so
+`graph.astream(stream_mode="messages")` behaves like with a real model.
+"""
+
+from typing import Any, AsyncIterator, Iterator, List, Optional
+import asyncio
+import json
+import re
+import uuid
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# "[juan]: Pagué 50 por el taxi" -> ("juan", 50, "taxi")
+EXPENSE_PATTERN = re.compile(r"^\[([^\]]+)\]:.*?(\d+(?:\.\d+)?)\s+(?:por|del|de la|de)\s+(?:el |la |los |las )?(.+)$", re.I)
+
+
+class StubChatModel(BaseChatModel):
+    """Chat model that replies with a fixed message, optionally slowly."""
+
+    response: AIMessage
+    token_delay: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "journi-stub"
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self.response)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        for chunk in self._chunks():
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        for chunk in self._chunks():
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            if run_manager and chunk.message.content:
+                await run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+            yield chunk
+
+    def _chunks(self) -> Iterator[ChatGenerationChunk]:
+        if self.response.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": tc["name"], "args": json.dumps(tc["args"]), "id": tc["id"], "index": i}
+                    for i, tc in enumerate(self.response.tool_calls)
+                ]
+            ))
+            return
+        for token in re.findall(r"\S+\s*", self.response.content):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class StubLLMManager:
+    """Drop-in replacement for `graph.llm_manager`."""
+
+    def __init__(self, token_delay: float = 0.0, reply_words: int = 20):
+        self.token_delay = token_delay
+        self.reply_words = reply_words
+        self.calls = 0
+
+    def _last_human_text(self, messages: List[Any]) -> str:
+        for msg in reversed(messages):
+            if isinstance(msg, HumanMessage):
+                content = msg.content
+                if isinstance(content, list):
+                    content = " ".join(b.get("text", "") for b in content if isinstance(b, dict))
+                return content
+        return ""
+
+    def _respond(self, messages: List[Any], with_tools: bool) -> AIMessage:
+        text = self._last_human_text(messages)
+        match = EXPENSE_PATTERN.match(text.strip())
+        if with_tools and match:
+            return AIMessage(content="", tool_calls=[{
+                "name": "register_expense",
+                "args": {
+                    "amount": float(match.group(2)),
+                    "description": match.group(3).strip(),
+                    "paid_by": match.group(1)
+                },
+                "id": f"call_{uuid.uuid4().hex[:12]}"
+            }])
+        words = " ".join(["listo"] * self.reply_words)
+        return AIMessage(content=f"¡Anotado! {words}.")
+
+    async def ainvoke(self, messages, with_tools: bool = True):
+        self.calls += 1
+        model = StubChatModel(response=self._respond(messages, with_tools), token_delay=self.token_delay)
+        return await model.ainvoke(messages)
+
+
+def install_stub_llm(token_delay: float = 0.0, reply_words: int = 20) -> StubLLMManager:
+    """Replace the graph's LLM manager with a stub and return it."""
+    import graph as graph_module
+
+    stub = StubLLMManager(token_delay=token_delay, reply_words=reply_words)
+    graph_module.llm_manager = stub
+    return stub
@@ -0,0 +1,103 @@
+"""
+Trip creation latency: create_trip_with_creator RPC vs separate requests.
+
+Runs `session_service.create_trip` against a fake PostgREST that answers
+after a fixed round-trip time, once with the RPC from migration 009 and
+once as a database without it (generate_session_code, insert trip, insert
+participant). Only network round trips are simulated, so the difference is
+what each extra RTT to Supabase costs a request.
+
+Usage:
+    python -m benchmarks.trip_creation --trips 200 --rtt 20
+    python -m benchmarks.trip_creation --rtt 80 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import date
+
+import httpx
+
+from benchmarks import percentile
+
+TRIP = {
+    "id": 1, "name": "Cusco", "session_code": "ABC123", "creator_id": "u1",
+    "start_date": "2026-01-01", "end_date": "2026-01-05", "status": "active",
+}
+MEMBERSHIP = {"id": 3, "trip_id": 1, "user_id": "u1", "role": "admin"}
+
+
+def fake_postgrest(rtt: float, with_rpc: bool):
+    """MockTransport handler answering the trip-creation requests after `rtt` seconds."""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(rtt)
+        path = request.url.path
+        if path.endswith("/rpc/create_trip_with_creator"):
+            if not with_rpc:
+                return httpx.Response(404, json={"code": "PGRST202", "details": None, "hint": None,
+                                                 "message": "Could not find the function"})
+            return httpx.Response(200, json={"trip": TRIP, "membership": MEMBERSHIP})
+        if path.endswith("/rpc/generate_session_code"):
+            return httpx.Response(200, json="ABC123")
+        if path.endswith("/trips"):
+            return httpx.Response(201, json=[TRIP])
+        return httpx.Response(201, json=[MEMBERSHIP])
+    return handler
+
+
+async def run_mode(with_rpc: bool, trips: int, rtt: float, concurrency: int) -> dict:
+    from services import session_service, supabase_client
+
+    transport = httpx.MockTransport(fake_postgrest(rtt, with_rpc))
+    supabase_client._async_client = supabase_client.create_async_client("http://db.bench", "bench", transport)
+    session_service._create_rpc_missing = False
+
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def create():
+        async with slots:
+            start = time.perf_counter()
+            await session_service.create_trip("u1", "Cusco", date(2026, 1, 1), date(2026, 1, 5))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    # The first call finds out whether the RPC exists; keep it out of the samples
+    await create()
+    latencies.clear()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(create() for _ in range(trips)))
+    elapsed = time.perf_counter() - start
+    await supabase_client.close_async_client()
+
+    return {
+        "mode": "rpc" if with_rpc else "separate",
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.mean(latencies),
+        "trips_per_s": trips / elapsed,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trips", type=int, default=200)
+    parser.add_argument("--rtt", type=float, default=20, help="simulated round trip to Supabase, in ms")
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault("SUPABASE_URL", "http://db.bench")
+    os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench")
+
+    print(f"rtt {args.rtt:.0f} ms, {args.trips} trips, concurrency {args.concurrency}")
+    print(f"{'mode':<12}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'trips/s':>10}")
+    for with_rpc in (False, True):
+        r = await run_mode(with_rpc, args.trips, args.rtt / 1000, args.concurrency)
+        print(f"{r['mode']:<12}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['mean_ms']:>10.2f}{r['trips_per_s']:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,222 @@
+"""
+WebSocket room load test against the real app.
+
+Starts `main.app` under uvicorn inside this process, with the stub LLM and
+an in-memory checkpointer, then opens N rooms x M clients on
+`/ws/{thread_id}/{user_id}`. In every room the clients take turns sending a
+scripted expense conversation and wait for the agent before the next line.
+
+Reports:
+- connect latency: socket open until the room_snapshot arrives
+- time to first chunk: message sent until the sender's first bot_chunk
+- bot_complete latency: message sent until the sender's bot_complete
+- frames/s received across all clients, and process RSS
+
+Clients run in the same process and event loop as the server, so the
+numbers are a floor for what one worker can serve. Trip persistence is off
+(Supabase env vars are cleared) so only this process is measured.
+
+Usage:
+    python -m benchmarks.ws_load --rooms 50 --clients 4 --turns 6
+    python -m benchmarks.ws_load --rooms 200 --clients 5 --token-delay 0.01
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import socket
+import statistics
+import time
+
+from benchmarks import percentile
+from benchmarks.stub_llm import install_stub_llm
+
+# Lines the stub LLM turns into register_expense calls, plus a question
+SCRIPT = [
+    "Pagué 45 por el taxi del aeropuerto",
+    "Yo puse 120 por la cena",
+    "¿Cómo vamos con las cuentas?",
+    "Pagué 30 de las entradas al museo",
+    "Puse 18.5 por el desayuno",
+    "¿Quién le debe a quién?",
+]
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (peak RSS where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LoadClient:
+    """One chat participant: counts frames and timestamps agent replies."""
+
+    def __init__(self, ws, user_id: str):
+        self.ws = ws
+        self.user_id = user_id
+        self.frames = 0
+        self.first_chunk = None
+        self.complete = None
+        self.snapshot = asyncio.get_running_loop().create_future()
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for raw in self.ws:
+                self.frames += 1
+                frame_type = json.loads(raw).get("type")
+                now = time.perf_counter()
+                if frame_type == "room_snapshot" and not self.snapshot.done():
+                    self.snapshot.set_result(now)
+                elif frame_type == "ping":
+                    await self.ws.send('{"type":"pong"}')
+                elif frame_type == "bot_chunk" and self.first_chunk and not self.first_chunk.done():
+                    self.first_chunk.set_result(now)
+                elif frame_type == "bot_complete" and self.complete and not self.complete.done():
+                    self.complete.set_result(now)
+        except Exception:
+            pass
+
+    async def say(self, content: str, timeout: float) -> tuple:
+        """Send a message. Returns (time to first chunk or None, time to bot_complete)."""
+        loop = asyncio.get_running_loop()
+        self.first_chunk, self.complete = loop.create_future(), loop.create_future()
+        start = time.perf_counter()
+        await self.ws.send(json.dumps({"content": content}))
+        done = await asyncio.wait_for(self.complete, timeout)
+        ttfc = self.first_chunk.result() - start if self.first_chunk.done() else None
+        return ttfc, done - start
+
+    async def close(self):
+        await self.ws.close()
+        await self.reader
+
+
+async def run(rooms: int, clients: int, turns: int, token_delay: float,
+              connect_concurrency: int, timeout: float) -> dict:
+    import websockets
+    import uvicorn
+
+    os.environ["CHECKPOINTER"] = "memory"
+    for var in ("SUPABASE_URL", "SUPABASE_DB_URL", "ROOM_PUBSUB"):
+        os.environ[var] = ""
+    install_stub_llm(token_delay=token_delay)
+    import main
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    rss_start = rss_mb()
+
+    connect_latencies, ttfc, complete_latencies = [], [], []
+    errors = 0
+    gate = asyncio.Semaphore(connect_concurrency)
+
+    async def open_client(thread_id: str, user_id: str) -> LoadClient:
+        async with gate:
+            start = time.perf_counter()
+            ws = await websockets.connect(
+                f"ws://127.0.0.1:{port}/ws/{thread_id}/{user_id}", max_size=None, ping_interval=None
+            )
+            client = LoadClient(ws, user_id)
+            connect_latencies.append((await asyncio.wait_for(client.snapshot, timeout) - start) * 1000)
+            return client
+
+    start = time.perf_counter()
+    room_clients = await asyncio.gather(*(
+        asyncio.gather(*(open_client(f"LOAD{r:04d}", f"user{c}") for c in range(clients)))
+        for r in range(rooms)
+    ))
+    connect_elapsed = time.perf_counter() - start
+    rss_connected = rss_mb()
+
+    async def converse(members):
+        nonlocal errors
+        for i in range(turns):
+            speaker = members[i % len(members)]
+            try:
+                first, done = await speaker.say(SCRIPT[i % len(SCRIPT)], timeout)
+            except asyncio.TimeoutError:
+                errors += 1
+                continue
+            complete_latencies.append(done * 1000)
+            if first is not None:
+                ttfc.append(first * 1000)
+
+    frames_before = sum(c.frames for members in room_clients for c in members)
+    start = time.perf_counter()
+    await asyncio.gather(*(converse(members) for members in room_clients))
+    elapsed = time.perf_counter() - start
+    frames = sum(c.frames for members in room_clients for c in members) - frames_before
+    rss_end = rss_mb()
+
+    await asyncio.gather(*(c.close() for members in room_clients for c in members))
+    server.should_exit = True
+    await server_task
+
+    return {
+        "sockets": rooms * clients,
+        "connect_s": connect_elapsed,
+        "connect_p50": percentile(connect_latencies, 50),
+        "connect_p99": percentile(connect_latencies, 99),
+        "ttfc_p50": percentile(ttfc, 50) if ttfc else None,
+        "ttfc_p99": percentile(ttfc, 99) if ttfc else None,
+        "complete_p50": percentile(complete_latencies, 50) if complete_latencies else None,
+        "complete_p99": percentile(complete_latencies, 99) if complete_latencies else None,
+        "complete_mean": statistics.mean(complete_latencies) if complete_latencies else None,
+        "turns": len(complete_latencies),
+        "turns_per_s": len(complete_latencies) / elapsed,
+        "frames_per_s": frames / elapsed,
+        "errors": errors,
+        "rss_start_mb": rss_start,
+        "rss_connected_mb": rss_connected,
+        "rss_end_mb": rss_end,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=4, help="clients per room")
+    parser.add_argument("--turns", type=int, default=len(SCRIPT), help="scripted messages per room")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="stub LLM seconds per token")
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for a reply")
+    parser.add_argument("--verbose", action="store_true", help="keep the server's logs")
+    args = parser.parse_args()
+
+    print(f"{args.rooms} rooms x {args.clients} clients x {args.turns} turns")
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with logs:
+        r = await run(args.rooms, args.clients, args.turns, args.token_delay,
+                      args.connect_concurrency, args.timeout)
+
+    def ms(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    print(f"sockets             {r['sockets']} (connected in {r['connect_s']:.2f}s)")
+    print(f"connect ms          p50 {ms(r['connect_p50'])}  p99 {ms(r['connect_p99'])}")
+    print(f"first chunk ms      p50 {ms(r['ttfc_p50'])}  p99 {ms(r['ttfc_p99'])}")
+    print(f"bot_complete ms     p50 {ms(r['complete_p50'])}  p99 {ms(r['complete_p99'])}  mean {ms(r['complete_mean'])}")
+    print(f"turns               {r['turns']} ({r['turns_per_s']:.1f}/s), {r['errors']} timed out")
+    print(f"frames/s            {r['frames_per_s']:.0f}")
+    print(f"RSS MB              start {r['rss_start_mb']:.0f}  connected {r['rss_connected_mb']:.0f}  "
+          f"end {r['rss_end_mb']:.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
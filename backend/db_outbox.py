@@ -0,0 +1,440 @@
+"""
+Write-behind Outbox for Agent Database Writes
+
+`create_milestone` and `register_photo` used to await their Supabase
+inserts inside the agent turn: every turn paid the network latency, and a
+failed insert was only logged. Now the tools append the rows to a local
+SQLite outbox (one local commit per turn) and a background worker drains
+it to Supabase:
+
+- batching: each drain writes all due milestones in one upsert, then all
+  due photos in one upsert
+- retries: failed ops back off exponentially; after OUTBOX_MAX_ATTEMPTS
+  they are kept as "dead" for inspection instead of being dropped
+- idempotency: every op carries a key, stored as `idempotency_key` on the
+  row (migration 012), so retrying a batch whose response was lost
+  updates the rows instead of duplicating them
+
+Photos reference their milestone by its key, since the milestone may not
+be written yet. The worker resolves keys from what it already wrote, then
+from the database; a photo whose milestone never shows up is written
+unlinked on its last attempt.
+
+Ledger ops carry a full snapshot of a trip's expenses and payments for the
+SQL mirror (services/ledger_service.py). Only the newest snapshot per trip
+in a batch is written; older ones are superseded by it.
+
+Every worker on a host shares the outbox file. A drain claims its batch
+with one `UPDATE ... RETURNING` that pushes the rows' next_attempt out
+by OUTBOX_CLAIM_TIMEOUT, so other workers skip them while they are being
+written. A worker that dies mid-batch leaves the claim to expire, and the
+rows are picked up again.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+import time
+
+import aiosqlite
+
+# Outbox database file (kept across restarts: pending writes survive them)
+OUTBOX_PATH = os.getenv("DB_OUTBOX_PATH", "journi_outbox.sqlite")
+# Max ops written per drain
+OUTBOX_BATCH_SIZE = int(os.getenv("DB_OUTBOX_BATCH_SIZE", "100"))
+# Seconds between drains when nothing new is enqueued (picks up retries)
+OUTBOX_POLL_INTERVAL = float(os.getenv("DB_OUTBOX_POLL_INTERVAL", "1"))
+# Attempts before an op is marked dead
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("DB_OUTBOX_MAX_ATTEMPTS", "8"))
+# First retry delay in seconds, doubled per attempt up to OUTBOX_MAX_BACKOFF
+OUTBOX_RETRY_BASE = float(os.getenv("DB_OUTBOX_RETRY_BASE", "1"))
+OUTBOX_MAX_BACKOFF = 300.0
+# Seconds a claimed batch is hidden from other workers sharing the file (must outlast a drain)
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv("DB_OUTBOX_CLAIM_TIMEOUT", "120"))
+# Seconds written milestone keys are remembered locally (older ones are looked up)
+OUTBOX_KEY_RETENTION = 7 * 24 * 3600
+
+MILESTONE = "milestone"
+PHOTO = "photo"
+LEDGER = "ledger"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(dead, next_attempt, id);
+CREATE TABLE IF NOT EXISTS written_milestones (
+    key TEXT PRIMARY KEY,
+    db_id INTEGER NOT NULL,
+    written_at REAL NOT NULL
+);
+"""
+
+
+def ledger_op(trip_id: int, expenses: List[dict], payments: List[dict]) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Outbox op carrying a snapshot of a trip's ledger for the SQL mirror.
+
+    Args:
+        trip_id: Trip the ledger belongs to
+        expenses: State expenses
+        payments: State payments
+
+    Returns:
+        (LEDGER, key, row); the version (enqueue time in microseconds) orders
+        snapshots, so the database keeps the newest one
+    """
+    from services.ledger_service import ledger_entries
+    version = time.time_ns() // 1000
+    return (LEDGER, f"ledger:{trip_id}:{version}", {
+        "trip_id": trip_id,
+        "version": version,
+        "entries": ledger_entries(expenses, payments)
+    })
+
+
+class DBOutbox:
+    """Durable queue of milestone/photo rows and ledger snapshots, drained to Supabase in batches."""
+
+    def __init__(
+        self,
+        path: str = OUTBOX_PATH,
+        writer=None,
+        ledger_writer=None,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        retry_base: float = OUTBOX_RETRY_BASE,
+        claim_timeout: float = OUTBOX_CLAIM_TIMEOUT
+    ):
+        self.path = path
+        # Object with upsert_milestones/upsert_photos/get_milestone_ids (default: SupabaseDB)
+        self._writer = writer
+        # Object with sync_trip_ledger (default: services.ledger_service)
+        self._ledger_writer = ledger_writer
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.claim_timeout = claim_timeout
+        self.conn: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._drain_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._closed = False
+        # Task running run(), awaited by close() before the database closes
+        self._worker: Optional[asyncio.Task] = None
+        # Stats
+        self.pending = 0
+        self.dead = 0
+        self.enqueued = 0
+        self.written = 0
+        self.retries = 0
+        self.batches = 0
+
+    @property
+    def writer(self):
+        if self._writer is None:
+            from services import get_db
+            self._writer = get_db()
+        return self._writer
+
+    @property
+    def ledger_writer(self):
+        if self._ledger_writer is None:
+            from services import ledger_service
+            self._ledger_writer = ledger_service
+        return self._ledger_writer
+
+    async def open(self):
+        """Open (or create) the outbox database. Safe to call repeatedly."""
+        async with self._open_lock:
+            if self.conn is not None:
+                return
+            if self._closed:
+                raise RuntimeError("Outbox is closed")
+            conn = await aiosqlite.connect(self.path)
+            # Same settings as the SQLite checkpointer: WAL, durable across app crashes
+            await conn.execute("PRAGMA journal_mode=WAL")
+            await conn.execute("PRAGMA synchronous=NORMAL")
+            await conn.executescript(SCHEMA)
+            await conn.execute(
+                "DELETE FROM written_milestones WHERE written_at < ?",
+                (time.time() - OUTBOX_KEY_RETENTION,)
+            )
+            await conn.commit()
+            self.conn = conn
+            await self._count()
+            if self.pending:
+                print(f"📮 Outbox has {self.pending} pending write(s) from a previous run or another worker")
+
+    # ============== PRODUCERS ==============
+
+    async def enqueue(self, ops: List[Tuple[str, str, Dict[str, Any]]]):
+        """
+        Durably queue writes, in order, in one local transaction.
+
+        Args:
+            ops: (kind, idempotency key, row) tuples; kind is MILESTONE,
+                PHOTO or LEDGER. A photo row may carry `milestone_key`
+                instead of `milestone_id`; a ledger row is {trip_id,
+                version, entries}. Re-enqueuing a key is ignored.
+        """
+        if not ops:
+            return
+        await self.open()
+        now = time.time()
+        cursor = await self.conn.executemany(
+            "INSERT OR IGNORE INTO outbox (kind, key, payload, created_at) VALUES (?, ?, ?, ?)",
+            [(kind, key, json.dumps(row), now) for kind, key, row in ops]
+        )
+        await self.conn.commit()
+        added = max(cursor.rowcount, 0)
+        self.pending += added
+        self.enqueued += added
+        self._wake.set()
+
+    # ============== WORKER ==============
+
+    async def run(self):
+        """Drain until close(): right after enqueues, and every poll_interval for retries."""
+        if self._closed:
+            return
+        self._worker = asyncio.current_task()
+        await self.open()
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                while not self._closed and await self.drain_once():
+                    pass
+            except Exception as e:
+                print(f"⚠️ Outbox drain failed: {e}")
+
+    async def drain_once(self) -> int:
+        """
+        Write one batch of due ops.
+
+        Returns:
+            Number of ops written (0 when nothing was due or the batch failed)
+        """
+        await self.open()
+        async with self._drain_lock:
+            due = await self._claim()
+            if not due:
+                return 0
+
+            milestones = [op for op in due if op[1] == MILESTONE]
+            photos = [op for op in due if op[1] == PHOTO]
+            ledgers = [op for op in due if op[1] == LEDGER]
+            written = 0
+
+            if milestones:
+                written += await self._write_milestones(milestones)
+            if photos:
+                written += await self._write_photos(photos)
+            if ledgers:
+                written += await self._write_ledgers(ledgers)
+
+            await self.conn.commit()
+            # Other workers sharing the file enqueue and write too
+            await self._count()
+            self.batches += 1
+            return written
+
+    async def _claim(self) -> list:
+        """
+        Atomically take the due ops of one batch.
+
+        Their next_attempt moves claim_timeout ahead, so other workers
+        sharing the file skip them; _done() or _failed() settle each one.
+        """
+        now = time.time()
+        async with self.conn.execute(
+            "UPDATE outbox SET next_attempt = ? WHERE id IN ("
+            "SELECT id FROM outbox WHERE dead = 0 AND next_attempt <= ? ORDER BY id LIMIT ?"
+            ") RETURNING id, kind, key, payload, attempts",
+            (now + self.claim_timeout, now, self.batch_size)
+        ) as cur:
+            claimed = await cur.fetchall()
+        # Visible to the other workers before any row is written
+        await self.conn.commit()
+        # RETURNING has no defined order
+        return sorted(claimed)
+
+    async def _count(self):
+        """Reload the pending/dead counters from the file."""
+        async with self.conn.execute("SELECT dead, COUNT(*) FROM outbox GROUP BY dead") as cur:
+            counts = dict(await cur.fetchall())
+        self.pending, self.dead = counts.get(0, 0), counts.get(1, 0)
+
+    async def _write_milestones(self, ops: list) -> int:
+        rows = [dict(json.loads(payload), idempotency_key=key) for _, _, key, payload, _ in ops]
+        try:
+            records = await self.writer.upsert_milestones(rows)
+        except Exception as e:
+            await self._failed(ops, e)
+            return 0
+
+        now = time.time()
+        await self.conn.executemany(
+            "INSERT OR REPLACE INTO written_milestones (key, db_id, written_at) VALUES (?, ?, ?)",
+            [(r["idempotency_key"], r["id"], now) for r in records]
+        )
+        await self._done(ops)
+        return len(ops)
+
+    async def _write_photos(self, ops: list) -> int:
+        rows = [dict(json.loads(payload), idempotency_key=key) for _, _, key, payload, _ in ops]
+        try:
+            milestone_ids = await self._resolve_milestones(
+                {row["milestone_key"] for row in rows if row.get("milestone_key")}
+            )
+        except Exception as e:
+            await self._failed(ops, e)
+            return 0
+
+        ready, ready_rows, waiting = [], [], []
+        for op, row in zip(ops, rows):
+            milestone_key = row.pop("milestone_key", None)
+            if milestone_key:
+                row["milestone_id"] = milestone_ids.get(milestone_key)
+                if row["milestone_id"] is None and op[4] + 1 < self.max_attempts:
+                    waiting.append(op)
+                    continue
+            ready.append(op)
+            ready_rows.append(row)
+
+        if waiting:
+            await self._failed(waiting, "milestone not written yet")
+        if not ready:
+            return 0
+
+        try:
+            await self.writer.upsert_photos(ready_rows)
+        except Exception as e:
+            await self._failed(ready, e)
+            return 0
+
+        await self._done(ready)
+        return len(ready)
+
+    async def _write_ledgers(self, ops: list) -> int:
+        """Sync the newest snapshot of each trip; older ones in the batch are superseded."""
+        latest: Dict[int, tuple] = {}
+        superseded = []
+        for op in ops:
+            payload = json.loads(op[3])
+            previous = latest.get(payload["trip_id"])
+            if previous:
+                superseded.append(previous[0])
+            latest[payload["trip_id"]] = (op, payload)
+
+        if superseded:
+            await self._done(superseded)
+        written = len(superseded)
+        for op, payload in latest.values():
+            try:
+                await self.ledger_writer.sync_trip_ledger(
+                    payload["trip_id"], payload["version"], payload["entries"]
+                )
+            except Exception as e:
+                await self._failed([op], e)
+                continue
+            await self._done([op])
+            written += 1
+        return written
+
+    async def _resolve_milestones(self, keys: set) -> Dict[str, int]:
+        """db_id for each milestone key written by this outbox or found in the database."""
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        async with self.conn.execute(
+            f"SELECT key, db_id FROM written_milestones WHERE key IN ({placeholders})", tuple(keys)
+        ) as cur:
+            found = dict(await cur.fetchall())
+        missing = [key for key in keys if key not in found]
+        if missing:
+            # Written by another worker, or before the local record was pruned
+            found.update(await self.writer.get_milestone_ids(missing))
+        return found
+
+    async def _done(self, ops: list):
+        await self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(op[0],) for op in ops])
+        self.written += len(ops)
+
+    async def _failed(self, ops: list, error):
+        """Schedule a retry with backoff, or mark dead after max_attempts."""
+        now = time.time()
+        updates = []
+        retrying = 0
+        for op_id, kind, key, _, attempts in ops:
+            attempts += 1
+            dead = attempts >= self.max_attempts
+            delay = min(self.retry_base * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF)
+            updates.append((attempts, now + delay, str(error)[:500], int(dead), op_id))
+            if dead:
+                print(f"❌ Outbox gave up on {kind} {key} after {attempts} attempts: {error}")
+            else:
+                retrying += 1
+        await self.conn.executemany(
+            "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ?, dead = ? WHERE id = ?",
+            updates
+        )
+        if retrying:
+            self.retries += retrying
+            print(f"⚠️ Outbox write of {retrying} {ops[0][1]}(s) failed, will retry: {error}")
+
+    async def close(self, drain_timeout: float = 5.0):
+        """
+        Stop the worker, try a last drain, and close the database.
+
+        The worker finishes its current batch first; after this, open() and
+        drain_once() raise instead of reopening the database.
+        """
+        self._closed = True
+        self._wake.set()
+        worker, self._worker = self._worker, None
+        if worker is not None and worker is not asyncio.current_task():
+            try:
+                await asyncio.wait_for(worker, timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                print("⚠️ Outbox worker did not stop in time, cancelled")
+            except Exception as e:
+                print(f"⚠️ Outbox worker failed: {e}")
+        if self.conn is None:
+            return
+        try:
+            await asyncio.wait_for(self.drain_once(), timeout=drain_timeout)
+        except Exception as e:
+            print(f"⚠️ Outbox final drain skipped ({self.pending} pending kept on disk): {e}")
+        await self.conn.close()
+        self.conn = None
+
+    def get_stats(self) -> dict:
+        """Counters for monitoring."""
+        return {
+            "pending": self.pending,
+            "dead": self.dead,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "retries": self.retries,
+            "batches": self.batches,
+        }
+
+
+# Global outbox instance (the worker is started by main.py on startup)
+db_outbox = DBOutbox()
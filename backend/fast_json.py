@@ -0,0 +1,24 @@
+"""
+JSON Encoding for WebSocket Frames
+
+Uses orjson when installed and falls back to the standard library. Output
+matches Starlette's `send_json` (compact separators, UTF-8 text) so
+clients see the same frames either way.
+"""
+
+import json
+
+try:
+    import orjson
+
+    def dumps(obj) -> str:
+        """Encode a frame to compact JSON text."""
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    JSON_BACKEND = "orjson"
+except ImportError:  # orjson not installed
+    def dumps(obj) -> str:
+        """Encode a frame to compact JSON text."""
+        return json.dumps(obj, default=str, ensure_ascii=False, separators=(",", ":"))
+
+    JSON_BACKEND = "json"
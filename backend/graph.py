@@ -17,6 +17,7 @@ from langsmith import traceable
 import operator
 import json
 import os
+import uuid
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -24,6 +25,15 @@ load_dotenv()
 # PostgreSQL persistence (optional - uses InMemorySaver if not configured)
 SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL")
 
+# Embedded SQLite persistence for single-node installs and CI
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH")
+CHECKPOINT_COMMIT_INTERVAL_MS = float(os.getenv("CHECKPOINT_COMMIT_INTERVAL_MS", "50"))
+
+# Explicit checkpointer mode: "postgres", "sqlite" or "memory".
+# When unset, picks postgres if SUPABASE_DB_URL is set, then sqlite if
+# CHECKPOINT_SQLITE_PATH is set, then memory.
+CHECKPOINTER = os.getenv("CHECKPOINTER", "").lower()
+
 # IMPORTANT: Disable psycopg3 prepared statements globally
 # Supabase's transaction pooler (port 6543) uses PgBouncer which is incompatible
 # with prepared statements. This MUST be set before any connections are made.
@@ -99,6 +109,8 @@ class JourniState(TypedDict):
     # Photo/Milestone fields
     milestones: list[Milestone]
     photos: list[Photo]
+    # Bumped whenever a tool may have changed the ledger (for delta sync)
+    ledger_version: int
 
 
 # ============== HELPER FUNCTIONS ==============
@@ -108,6 +120,16 @@ def normalize_name(name: str) -> str:
     return name.strip()
 
 
+def next_record_id(prefix: str, items: list) -> str:
+    """Next "<prefix>_<n>" id, past every n in use (ids stay unique after deletes)."""
+    highest = 0
+    for item in items:
+        number = str(item.get("id", "")).rpartition(f"{prefix}_")[2]
+        if number.isdigit():
+            highest = max(highest, int(number))
+    return f"{prefix}_{highest + 1}"
+
+
 def update_balance(balances: dict, person: str, currency: str, amount: float) -> None:
     """Update a person's balance for a specific currency.
 
@@ -558,6 +580,16 @@ PHOTO_TOOLS = [create_milestone, edit_milestone, delete_milestone, list_mileston
 # All tools
 TOOLS = EXPENSE_TOOLS + PHOTO_TOOLS
 
+# Tools that can change expenses, payments, balances, milestones or photos
+LEDGER_MUTATING_TOOLS = {
+    "register_expense", "edit_expense", "delete_expense", "register_payment",
+    "create_milestone", "edit_milestone", "delete_milestone",
+    "register_photo", "edit_photo", "delete_photo",
+}
+
+# Tools that change expenses or payments (mirrored to SQL after the turn)
+MONEY_TOOLS = {"register_expense", "edit_expense", "delete_expense", "register_payment"}
+
 
 class LLMWithFallback:
     """LLM wrapper with automatic fallback between providers."""
@@ -777,6 +809,8 @@ async def execute_tools(state: JourniState) -> dict:
     participants = list(state.get("participants", []))
     new_milestones = list(state.get("milestones", []))
     new_photos = list(state.get("photos", []))
+    # DB writes for this turn's milestones, photos and ledger, handed to the outbox after the loop
+    outbox_ops = []
 
     for tool_call in last_message.tool_calls:
         tool_name = tool_call["name"]
@@ -787,7 +821,7 @@ async def execute_tools(state: JourniState) -> dict:
 
         if tool_name == "register_expense":
             data = tool_args
-            expense_id = f"exp_{len(new_expenses) + 1}"
+            expense_id = next_record_id("exp", new_expenses)
 
             # Normalize names
             paid_by = normalize_name(data["paid_by"])
@@ -950,7 +984,7 @@ async def execute_tools(state: JourniState) -> dict:
             currency = data.get("currency", "PEN").upper()
 
             # Create payment record
-            payment_id = f"pay_{len(new_payments) + 1}"
+            payment_id = next_record_id("pay", new_payments)
             payment = {
                 "id": payment_id,
                 "from_user": from_user,
@@ -1066,10 +1100,11 @@ async def execute_tools(state: JourniState) -> dict:
         # ============== MILESTONE TOOL HANDLERS ==============
         elif tool_name == "create_milestone":
             from datetime import datetime
-            from services import get_db
+            from services.supabase_db import milestone_row
+            from db_outbox import MILESTONE as OUTBOX_MILESTONE
 
             data = tool_args
-            milestone_id = f"milestone_{len(new_milestones) + 1}"
+            milestone_id = next_record_id("milestone", new_milestones)
             session_ctx = state.get("session_context", {})
             current_user = session_ctx.get("current_user", "unknown")
             trip_id = session_ctx.get("trip_id")  # Get trip_id from session context
@@ -1087,23 +1122,21 @@ async def execute_tools(state: JourniState) -> dict:
             }
             new_milestones.append(milestone)
 
-            # Persist to database if trip_id is available
+            # Persist to database (via the outbox) if trip_id is available
             if trip_id:
-                try:
-                    db = get_db()
-                    db_milestone = await db.insert_milestone(
-                        trip_id=trip_id,
-                        name=data["name"],
-                        description=data.get("description"),
-                        location=data.get("location"),
-                        tags=data.get("tags", []),
-                        created_by_user_id=None  # Anonymous user support
-                    )
-                    if db_milestone:
-                        milestone["db_id"] = db_milestone.id
-                        print(f"✅ Milestone persisted to DB: {db_milestone.id}")
-                except Exception as e:
-                    print(f"⚠️ Failed to persist milestone to DB: {e}")
+                row = milestone_row(
+                    trip_id=trip_id,
+                    name=data["name"],
+                    description=data.get("description"),
+                    location=data.get("location"),
+                    tags=data.get("tags", []),
+                    created_by_user_id=None  # Anonymous user support
+                )
+                # Left to the column default so a retried upsert can't reset it
+                del row["photo_count"]
+                # Photos find the DB row through this key once it's written
+                milestone["db_key"] = uuid.uuid4().hex
+                outbox_ops.append((OUTBOX_MILESTONE, milestone["db_key"], row))
 
             result_content = f"Milestone creado: '{data['name']}'" + (f" en {data['location']}" if data.get('location') else "")
 
@@ -1170,8 +1203,10 @@ async def execute_tools(state: JourniState) -> dict:
         # ============== PHOTO TOOL HANDLERS ==============
         elif tool_name == "register_photo":
             from datetime import datetime
+            from services.supabase_db import photo_row
+            from db_outbox import PHOTO as OUTBOX_PHOTO
             data = tool_args
-            photo_id = f"photo_{len(new_photos) + 1}"
+            photo_id = next_record_id("photo", new_photos)
             session_ctx = state.get("session_context", {})
             current_user = session_ctx.get("current_user", "unknown")
 
@@ -1218,33 +1253,27 @@ async def execute_tools(state: JourniState) -> dict:
                         new_milestones[idx] = ms
                         break
 
-                # Persist to database if trip_id is available
+                # Persist to database (via the outbox) if trip_id is available
                 trip_id = session_ctx.get("trip_id")
                 if trip_id and upload_info.get("url"):
-                    try:
-                        from services import get_db
-                        db = get_db()
-
-                        # Get DB milestone ID if available
-                        db_milestone_id = target_milestone.get("db_id")
-
-                        db_photo = await db.insert_photo(
-                            trip_id=trip_id,
-                            milestone_id=db_milestone_id,
-                            photo_url=upload_info.get("url", ""),
-                            storage_path=upload_info.get("path", ""),
-                            uploaded_by_user_id=None,  # Anonymous user support
-                            description=data["description"],
-                            tags=data.get("tags", []),
-                            detected_people=data.get("detected_people", []),
-                            location_name=data.get("location"),
-                            order_index=photo["order_index"]
-                        )
-                        if db_photo:
-                            photo["db_id"] = db_photo.id
-                            print(f"✅ Photo persisted to DB: {db_photo.id}")
-                    except Exception as e:
-                        print(f"⚠️ Failed to persist photo to DB: {e}")
+                    row = photo_row(
+                        trip_id=trip_id,
+                        # Legacy milestones (written before the outbox) only have db_id;
+                        # the others are resolved from milestone_key by the outbox
+                        milestone_id=None if target_milestone.get("db_key") else target_milestone.get("db_id"),
+                        photo_url=upload_info.get("url", ""),
+                        storage_path=upload_info.get("path", ""),
+                        uploaded_by_user_id=None,  # Anonymous user support
+                        description=data["description"],
+                        tags=data.get("tags", []),
+                        detected_people=data.get("detected_people", []),
+                        location_name=data.get("location"),
+                        order_index=photo["order_index"]
+                    )
+                    if target_milestone.get("db_key"):
+                        row["milestone_key"] = target_milestone["db_key"]
+                    photo["db_key"] = uuid.uuid4().hex
+                    outbox_ops.append((OUTBOX_PHOTO, photo["db_key"], row))
 
                 result_content = f"Foto guardada en '{target_milestone['name']}': {data['description'][:50]}..."
 
@@ -1360,6 +1389,24 @@ async def execute_tools(state: JourniState) -> dict:
             ToolMessage(content=result_content, tool_call_id=tool_id)
         )
 
+    # Mirror the ledger for SQL-side balances (services/ledger_service.py)
+    trip_id = state.get("session_context", {}).get("trip_id")
+    if trip_id and any(tc["name"] in MONEY_TOOLS for tc in last_message.tool_calls):
+        from db_outbox import ledger_op
+        outbox_ops.append(ledger_op(trip_id, new_expenses, new_payments))
+
+    if outbox_ops:
+        from db_outbox import db_outbox
+        # A local SQLite commit; the background worker writes to Supabase
+        try:
+            await db_outbox.enqueue(outbox_ops)
+        except Exception as e:
+            print(f"⚠️ Failed to queue DB writes: {e}")
+
+    ledger_version = state.get("ledger_version", 0) or 0
+    if any(tc["name"] in LEDGER_MUTATING_TOOLS for tc in last_message.tool_calls):
+        ledger_version += 1
+
     return {
         "messages": tool_results,
         "expenses": new_expenses,
@@ -1367,7 +1414,8 @@ async def execute_tools(state: JourniState) -> dict:
         "balances": new_balances,
         "participants": participants,
         "milestones": new_milestones,
-        "photos": new_photos
+        "photos": new_photos,
+        "ledger_version": ledger_version
     }
 
 
@@ -1416,14 +1464,44 @@ _checkpointer = None
 _graph = None
 
 
+def get_checkpointer_mode() -> str:
+    """Resolve which checkpointer backend to use from the environment."""
+    if CHECKPOINTER in ("postgres", "sqlite", "memory"):
+        return CHECKPOINTER
+    if SUPABASE_DB_URL:
+        return "postgres"
+    if CHECKPOINT_SQLITE_PATH:
+        return "sqlite"
+    return "memory"
+
+
 async def get_async_checkpointer():
-    """Get or create async PostgreSQL checkpointer."""
+    """Get or create the async checkpointer (PostgreSQL, SQLite or memory)."""
     global _checkpointer
 
     if _checkpointer is not None:
         return _checkpointer
 
-    if SUPABASE_DB_URL:
+    mode = get_checkpointer_mode()
+
+    if mode == "sqlite":
+        try:
+            from sqlite_checkpointer import create_sqlite_checkpointer
+
+            path = CHECKPOINT_SQLITE_PATH or "journi_checkpoints.sqlite"
+            print(f"🗄️ Opening SQLite checkpointer at {path} (WAL, batch {CHECKPOINT_COMMIT_INTERVAL_MS:.0f}ms)...")
+            _checkpointer = await create_sqlite_checkpointer(
+                path,
+                commit_interval_ms=CHECKPOINT_COMMIT_INTERVAL_MS
+            )
+            print("✅ SQLite checkpointer ready")
+            return _checkpointer
+        except Exception as e:
+            print(f"⚠️ SQLite failed, falling back to memory: {e}")
+            _checkpointer = InMemorySaver()
+            return _checkpointer
+
+    if mode == "postgres" and SUPABASE_DB_URL:
         try:
             from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
             from psycopg_pool import AsyncConnectionPool
@@ -1458,11 +1536,29 @@ async def get_async_checkpointer():
             _checkpointer = InMemorySaver()
             return _checkpointer
     else:
-        print("📝 Using InMemorySaver (set SUPABASE_DB_URL for persistence)")
+        print("📝 Using InMemorySaver (set SUPABASE_DB_URL or CHECKPOINT_SQLITE_PATH for persistence)")
         _checkpointer = InMemorySaver()
         return _checkpointer
 
 
+async def close_async_checkpointer():
+    """Flush and release the async checkpointer (called on shutdown)."""
+    global _checkpointer, _graph
+
+    if _checkpointer is None:
+        return
+
+    aclose = getattr(_checkpointer, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception as e:
+            print(f"⚠️ Error closing checkpointer: {e}")
+
+    _checkpointer = None
+    _graph = None
+
+
 def get_sync_checkpointer():
     """Get sync checkpointer for initialization (falls back to memory)."""
     # For the initial graph build, use InMemorySaver
@@ -1541,5 +1637,6 @@ def get_initial_state(session_name: str = "", participants: list = None) -> Jour
         "session_name": session_name,
         "session_context": {},
         "milestones": [],
-        "photos": []
+        "photos": [],
+        "ledger_version": 0
     }
@@ -21,9 +21,22 @@ import secrets
 import string
 from dotenv import load_dotenv
 
-from room_manager import room_manager
-from graph import graph, get_initial_state, normalize_name, get_graph
-from services import get_storage, session_service, auth_service, get_supabase_client
+from room_manager import room_manager, SNAPSHOT_HISTORY_LIMIT, RESUME_GRACE
+from room_pubsub import create_pubsub, InProcessPubSub
+from turn_queue import turn_queue, QueuedTurn, TurnCancelled, CANCEL_DEADLINE
+from thread_locks import create_thread_lock
+from db_outbox import db_outbox, ledger_op
+from stream_aggregator import ChunkAggregator
+from uploads import (
+    upload_registry, upload_limiter, upload_key, check_upload_key,
+    PendingUpload, UploadTooLarge, limit_size, ALLOWED_IMAGE_TYPES, MAX_UPLOAD_BYTES
+)
+from state_sync import compute_state_delta, get_ledger_version
+from graph import graph, get_initial_state, normalize_name, get_graph, close_async_checkpointer
+from services import (
+    get_storage, session_service, auth_service, ledger_service, get_async_client, close_async_client,
+    get_trip_resolver, get_trip_cache, TRIP_CACHE_CHANNEL, InvalidPageRequest
+)
 from services.auth_service import AuthUser
 from services.whatsapp_service import get_whatsapp_service, WhatsAppMessage
 from langchain_core.messages import SystemMessage
@@ -62,6 +75,46 @@ async def startup_event():
         print("⚠️ Server will continue without graph initialization")
         print("⚠️ Some features may not work until connection is restored")
 
+    # Free memory held by rooms nobody is connected to
+    asyncio.create_task(room_manager.run_eviction_loop())
+    # Ping clients, reap dead sockets
+    asyncio.create_task(room_manager.run_heartbeat_loop())
+    # Write the agent's queued milestone/photo rows to Supabase
+    asyncio.create_task(db_outbox.run())
+    # Delete chat images uploaded but never sent
+    asyncio.create_task(upload_registry.run_pruner())
+
+    # Trip cache changes reach the other workers over the room pub/sub
+    room_manager.subscribe(TRIP_CACHE_CHANNEL, get_trip_cache().apply_remote)
+    get_trip_cache().set_publisher(lambda message: room_manager.publish(TRIP_CACHE_CHANNEL, message))
+
+    # Graph runs on a thread are serialized across workers too (ROOM_PUBSUB=postgres).
+    # No fallback: workers sharing threads without it would race on checkpoints
+    thread_lock = create_thread_lock()
+    if thread_lock is not None:
+        await thread_lock.start()
+        turn_queue.set_shared_lock(thread_lock)
+
+    # Cross-worker room fan-out (ROOM_PUBSUB=postgres)
+    pubsub = create_pubsub()
+    if not isinstance(pubsub, InProcessPubSub):
+        try:
+            await room_manager.use_pubsub(pubsub)
+        except Exception as e:
+            print(f"⚠️ Could not start room pub/sub, staying in-process: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush pending checkpoint and outbox writes before the process exits."""
+    await close_async_checkpointer()
+    await room_manager.pubsub.close()
+    if turn_queue.shared_lock is not None:
+        await turn_queue.shared_lock.close()
+    upload_registry.close()
+    await db_outbox.close()
+    await close_async_client()
+
 
 # ============== MODELS ==============
 
@@ -124,6 +177,46 @@ def is_tool_related_content(content: str) -> bool:
     return False
 
 
+SPEAKER_LINE = re.compile(r'^\[([^\]\n]+)\]: ')
+# A line of message text that looks like a speaker prefix, escaped or not
+SPEAKER_LIKE_LINE = re.compile(r'^\\*\[[^\]\n]+\]: ', re.MULTILINE)
+
+
+def speaker_line(user_id: str, content: str) -> str:
+    """
+    Format a user message as "[user_id]: content".
+
+    Lines inside the content that look like a speaker prefix get a leading
+    backslash, so a message can't pass itself off as someone else's line
+    (split_speaker_lines removes it again).
+    """
+    first, sep, rest = content.partition('\n')
+    return f"[{user_id}]: {first}{sep}" + SPEAKER_LIKE_LINE.sub(lambda m: '\\' + m.group(0), rest)
+
+
+def split_speaker_lines(text: str) -> List[tuple]:
+    """
+    Split a stored user message into (user_id, content) pairs.
+
+    Messages are stored as "[user_id]: content" (see speaker_line). A turn
+    that merged several queued messages has one such line per speaker;
+    lines without a prefix belong to the previous speaker.
+    """
+    entries = []
+    for line in text.split('\n'):
+        match = SPEAKER_LINE.match(line)
+        if match:
+            entries.append([match.group(1), line[match.end():]])
+            continue
+        if entries:
+            if SPEAKER_LIKE_LINE.match(line):
+                line = line[1:]
+            entries[-1][1] += '\n' + line
+        else:
+            entries.append(["Usuario", line])
+    return [(user_id, content) for user_id, content in entries]
+
+
 def calculate_debts(balances: dict) -> dict:
     """
     Calculate optimized debts from multi-currency balances.
@@ -224,6 +317,94 @@ def extract_structured_data(state_values: dict) -> dict:
     }
 
 
+def build_state_update(old_values: dict, new_values: dict) -> dict:
+    """
+    Build the versioned ledger fields for bot_complete/whatsapp_message.
+
+    Large collections travel as a delta against `base_version`; balances,
+    debts and participants are small and always sent whole. When no delta
+    can be built, `base_version` is None so clients resync.
+    """
+    balances = new_values.get("balances", {})
+    delta = compute_state_delta(old_values, new_values)
+    return {
+        "base_version": get_ledger_version(old_values) if delta is not None else None,
+        "state_version": get_ledger_version(new_values),
+        "state_delta": delta or {},
+        "balances": balances,
+        "debts": calculate_debts(balances),
+        "participants": new_values.get("participants", []),
+    }
+
+
+def build_state_snapshot(state_values: dict) -> dict:
+    """Build a full `state_snapshot` frame (sent on join and on version mismatch)."""
+    balances = state_values.get("balances", {})
+    return {
+        "type": "state_snapshot",
+        "state_version": get_ledger_version(state_values),
+        "state": {
+            "expenses": state_values.get("expenses", []),
+            "payments": state_values.get("payments", []),
+            "balances": balances,
+            "participants": state_values.get("participants", []),
+            "debts": calculate_debts(balances),
+            "milestones": state_values.get("milestones", []),
+            "photos": state_values.get("photos", [])
+        }
+    }
+
+
+def build_room_snapshot(thread_id: str, history_page: dict, state_values: dict) -> dict:
+    """
+    Build the single `room_snapshot` frame sent on join.
+
+    Carries the recent room history, presence and the full ledger with its
+    version, so the client is ready after one frame instead of a replay.
+    Older history is requested with {"type": "load_history", "before": cursor}.
+    """
+    state_snapshot = build_state_snapshot(state_values)
+    return {
+        "type": "room_snapshot",
+        "messages": history_page["messages"],
+        "history_before": history_page["before"],
+        "online_users": room_manager.get_online_users(thread_id),
+        "presence": room_manager.get_presence(thread_id),
+        "connection_count": room_manager.get_connection_count(thread_id),
+        "last_seq": history_page["last_seq"],
+        "epoch": history_page["epoch"],
+        "state_version": state_snapshot["state_version"],
+        "state": state_snapshot["state"]
+    }
+
+
+async def announce_user_left(thread_id: str, user_id: str, grace: float = RESUME_GRACE):
+    """
+    Broadcast `user_left` unless the user reconnects within `grace` seconds.
+
+    Short drops (network switch, phone waking up) resume silently instead
+    of flashing left/joined in everyone's chat. If the room is empty by
+    then, the agent's running turn is cancelled too.
+    """
+    if grace > 0:
+        await asyncio.sleep(grace)
+    if user_id in room_manager.get_online_users(thread_id):
+        return
+
+    # Nobody left to read the answer on any worker: stop the agent instead of finishing it
+    if room_manager.get_room_connection_count(thread_id) == 0:
+        turn_queue.cancel(thread_id, reason="room empty", drop_pending=True)
+
+    await room_manager.broadcast(thread_id, {
+        "type": "user_left",
+        "user_id": user_id,
+        "participants": room_manager.get_participants(thread_id),
+        "online_users": room_manager.get_online_users(thread_id),
+        "presence": room_manager.get_presence(thread_id),
+        "connection_count": room_manager.get_connection_count(thread_id)
+    })
+
+
 def detect_action_from_expenses(old_expenses: list, new_expenses: list,
                                  old_payments: list, new_payments: list) -> Optional[dict]:
     """Detect what action was performed by comparing states."""
@@ -282,6 +463,22 @@ def build_multimodal_content(text: str, image_base64: Optional[str] = None,
     if not image_base64:
         return text
 
+    # Build multimodal content in OpenAI-compatible format (used by OpenRouter)
+    return [
+        {
+            "type": "text",
+            "text": text
+        },
+        build_image_block(image_base64, image_type)
+    ]
+
+
+def build_image_block(image_base64: str, image_type: str = "image/jpeg") -> dict:
+    """Build an OpenAI-compatible image content block from base64, a data URL or a public URL."""
+    # Pre-uploaded images are passed by reference
+    if image_base64.startswith(("http://", "https://")):
+        return {"type": "image_url", "image_url": {"url": image_base64}}
+
     # Clean up base64 string if it has a data URL prefix
     if image_base64.startswith('data:'):
         # Extract media type and data from data URL
@@ -294,19 +491,40 @@ def build_multimodal_content(text: str, image_base64: Optional[str] = None,
                 image_type = media_part.split(';')[0].replace('data:', '')
             image_base64 = parts[1]
 
-    # Build multimodal content in OpenAI-compatible format (used by OpenRouter)
-    return [
-        {
-            "type": "text",
-            "text": text
-        },
-        {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:{image_type};base64,{image_base64}"
-            }
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:{image_type};base64,{image_base64}"
         }
-    ]
+    }
+
+
+IMAGE_ATTACHED_NOTE = " [El usuario adjuntó una imagen - analízala para extraer información del gasto/recibo o para registrar un momento del viaje]"
+
+
+def build_turn_message(turns: list) -> str:
+    """
+    Build the user message text for one agent turn.
+
+    Several queued messages are merged into a single multi-speaker
+    message, one "[user_id]: content" line per message.
+    """
+    lines = []
+    for turn in turns:
+        line = speaker_line(turn.user_id, turn.content)
+        if turn.image or turn.upload:
+            line += IMAGE_ATTACHED_NOTE
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def build_turn_content(turns: list) -> Union[list, str]:
+    """Build (possibly multimodal) message content for a batch of turns."""
+    text = build_turn_message(turns)
+    images = [turn.upload.url if turn.upload else turn.image for turn in turns if turn.image or turn.upload]
+    if not images:
+        return text
+    return [{"type": "text", "text": text}] + [build_image_block(image) for image in images]
 
 
 class ChatRequest(BaseModel):
@@ -330,6 +548,29 @@ async def root():
     }
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Realtime gauges: rooms, connections, send queues and agent turns."""
+    return {
+        "rooms": room_manager.get_stats(),
+        "turns": turn_queue.get_stats(),
+        "uploads": {**upload_registry.get_stats(), **upload_limiter.get_stats()},
+        "trip_ids": get_trip_resolver().get_stats(),
+        "trip_cache": get_trip_cache().get_stats(),
+        "db_outbox": db_outbox.get_stats()
+    }
+
+
+@app.get("/api/rooms/{thread_id}/connections")
+async def get_room_connections(thread_id: str):
+    """Per-connection send queue depth, lag and idle time, plus presence."""
+    return {
+        "thread_id": thread_id,
+        "connections": room_manager.get_connection_stats(thread_id),
+        "presence": room_manager.get_presence(thread_id)
+    }
+
+
 @app.post("/api/chat")
 async def chat_http(request: ChatRequest):
     """
@@ -433,6 +674,73 @@ async def get_session(thread_id: str):
         }
 
 
+@app.post("/api/sessions/{thread_id}/uploads")
+async def upload_chat_image(thread_id: str, request: Request, user_id: str = ""):
+    """
+    Upload a chat image ahead of the message that uses it.
+
+    The body is the raw image (Content-Type: image/jpeg, image/png, ...),
+    streamed straight to Storage. Send the returned upload_id in the chat
+    message ({"content": "...", "upload_id": "..."}) instead of base64.
+
+    Only room members can upload: pass ?user_id= and the `upload_key`
+    from the room_snapshot/resumed frame in the X-Upload-Key header.
+
+    Returns:
+        {"upload_id": "...", "url": "...", "expires_in": seconds}
+    """
+    user_id = normalize_name(user_id)
+    if not check_upload_key(thread_id, user_id, request.headers.get("x-upload-key")):
+        raise HTTPException(status_code=403, detail="Join the session before uploading")
+    if not upload_limiter.allow(thread_id, user_id):
+        raise HTTPException(status_code=429, detail="Too many uploads, try again in a minute")
+
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    extension = ALLOWED_IMAGE_TYPES.get(media_type)
+    if not extension:
+        raise HTTPException(status_code=415, detail=f"Unsupported image type: {media_type or 'none'}")
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+
+    size = 0
+
+    async def body():
+        nonlocal size
+        async for chunk in limit_size(request.stream()):
+            size += len(chunk)
+            yield chunk
+
+    try:
+        result = await get_storage().upload_stream(body(), thread_id, content_type=media_type, extension=extension)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Image too large")
+    except Exception as e:
+        print(f"⚠️ [{thread_id}] Image upload error: {e}")
+        raise HTTPException(status_code=502, detail="Image upload failed")
+
+    if not result.success:
+        print(f"⚠️ [{thread_id}] Image upload failed: {result.error}")
+        raise HTTPException(status_code=502, detail="Image upload failed")
+
+    upload = PendingUpload(
+        thread_id=thread_id,
+        url=result.url,
+        path=result.path,
+        media_type=media_type,
+        size=size
+    )
+    try:
+        upload_id = await upload_registry.register(upload)
+    except Exception as e:
+        print(f"⚠️ [{thread_id}] Could not store upload token: {e}")
+        await get_storage().delete(result.path)
+        raise HTTPException(status_code=502, detail="Image upload failed")
+    print(f"📷 [{thread_id}] Image pre-uploaded by {user_id}: {result.path} ({size} bytes)")
+    return {"upload_id": upload_id, "url": result.url, "expires_in": upload_registry.ttl}
+
+
 @app.get("/api/sessions/{thread_id}/history")
 async def get_session_history(thread_id: str):
     """
@@ -480,19 +788,14 @@ async def get_session_history(thread_id: str):
 
             if msg_type in ('human', 'user'):
                 # Parse user_id from message format "[user_id]: content"
-                user_id = "Usuario"
-                actual_content = filtered_content
-                if filtered_content.startswith('[') and ']: ' in filtered_content:
-                    parts = filtered_content.split(']: ', 1)
-                    user_id = parts[0][1:]  # Remove leading [
-                    actual_content = parts[1] if len(parts) > 1 else filtered_content
-
-                history.append({
-                    "type": "user",
-                    "user_id": user_id,
-                    "content": actual_content,
-                    "timestamp": datetime.now().isoformat()  # LangGraph doesn't store timestamps
-                })
+                # (coalesced turns hold one such line per speaker)
+                for user_id, actual_content in split_speaker_lines(filtered_content):
+                    history.append({
+                        "type": "user",
+                        "user_id": user_id,
+                        "content": actual_content,
+                        "timestamp": datetime.now().isoformat()  # LangGraph doesn't store timestamps
+                    })
             elif msg_type in ('ai', 'AIMessageChunk', 'assistant'):
                 history.append({
                     "type": "bot",
@@ -505,6 +808,7 @@ async def get_session_history(thread_id: str):
         return {
             "thread_id": thread_id,
             "messages": history,
+            "state_version": get_ledger_version(state.values),
             "state": {
                 "expenses": state.values.get("expenses", []),
                 "payments": state.values.get("payments", []),
@@ -520,6 +824,7 @@ async def get_session_history(thread_id: str):
         return {
             "thread_id": thread_id,
             "messages": [],
+            "state_version": 0,
             "state": {
                 "expenses": [],
                 "payments": [],
@@ -607,14 +912,51 @@ async def create_trip(request: Request):
     return trip
 
 
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Column list from a comma-separated `fields` query param."""
+    if not fields:
+        return None
+    return [f.strip() for f in fields.split(",") if f.strip()] or None
+
+
 @app.get("/api/trips")
-async def list_trips(request: Request):
-    """List all trips for the authenticated user."""
+async def list_trips(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """
+    List the authenticated user's trips, newest first.
+
+    Query params:
+        limit: Page size (default 50, max 200)
+        cursor: next_cursor from the previous page
+        status: active, completed or cancelled
+        fields: Comma-separated trip columns (default: the dashboard set)
+
+    Returns {"trips", "total", "next_cursor"}; total counts all the user's
+    trips matching status, on the first page only (null after).
+    """
     user = await require_auth_user(request)
 
-    trips = await session_service.get_user_trips(user.id)
+    if status and status not in ("active", "completed", "cancelled"):
+        raise HTTPException(status_code=400, detail="status must be active, completed or cancelled")
+
+    try:
+        page = await session_service.get_user_trips(
+            user.id,
+            limit=limit,
+            cursor=cursor,
+            status=status,
+            fields=parse_fields(fields),
+            with_total=not cursor
+        )
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    return {"trips": trips, "total": len(trips)}
+    return page
 
 
 @app.get("/api/trips/{trip_id}")
@@ -639,7 +981,8 @@ async def get_trip_by_code(code: str):
     Public endpoint to lookup trip by session code.
     Used by join page to display trip info before joining.
     """
-    trip = await session_service.get_trip_by_code(code.upper())
+    # Cached for a few seconds: invite links get hit in bursts
+    trip = await session_service.get_public_trip_card(code)
 
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
@@ -647,8 +990,6 @@ async def get_trip_by_code(code: str):
     if trip["status"] != "active":
         raise HTTPException(status_code=410, detail="Trip is no longer active")
 
-    participant_count = await session_service.get_participant_count(trip["id"])
-
     # Return limited public info
     return {
         "id": trip["id"],
@@ -656,7 +997,7 @@ async def get_trip_by_code(code: str):
         "start_date": trip["start_date"],
         "end_date": trip["end_date"],
         "location": trip.get("location"),
-        "participant_count": participant_count,
+        "participant_count": trip["participant_count"],
         "status": trip["status"]
     }
 
@@ -668,7 +1009,8 @@ async def join_trip(trip_id: int, request: Request):
     - Authenticated users: linked via user_id
     - Anonymous users: get temporary token with display_name
     """
-    trip = await session_service.get_trip_by_id(trip_id)
+    # Status may have changed on another worker: don't trust the cache
+    trip = await session_service.get_trip_by_id(trip_id, fresh=True)
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
 
@@ -736,7 +1078,8 @@ async def finalize_trip(trip_id: int, request: Request):
     """
     user = await require_auth_user(request)
 
-    trip = await session_service.get_trip_by_id(trip_id)
+    # Status may have changed on another worker: don't trust the cache
+    trip = await session_service.get_trip_by_id(trip_id, fresh=True)
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
 
@@ -755,16 +1098,26 @@ async def finalize_trip(trip_id: int, request: Request):
     try:
         state = await graph.aget_state(config)
         expenses = state.values.get("expenses", [])
+        payments = state.values.get("payments", [])
         balances = state.values.get("balances", {})
         participants = state.values.get("participants", [])
         debts = calculate_debts(balances)
     except Exception as e:
         print(f"Error getting state for finalize: {e}")
         expenses = []
+        payments = []
         balances = {}
         participants = []
         debts = {}
 
+    # Final snapshot for the SQL ledger mirror (also covers trips whose
+    # ledger was built before the mirror existed)
+    if expenses or payments:
+        try:
+            await db_outbox.enqueue([ledger_op(trip_id, expenses, payments)])
+        except Exception as e:
+            print(f"⚠️ Failed to queue final ledger snapshot: {e}")
+
     # Calculate totals
     total_spent = sum(exp.get("amount", 0) for exp in expenses)
 
@@ -803,6 +1156,41 @@ async def finalize_trip(trip_id: int, request: Request):
     }
 
 
+@app.get("/api/trips/{trip_id}/balances")
+async def get_trip_balances(trip_id: int, request: Request):
+    """
+    Balances, debts and totals from the SQL ledger mirror.
+
+    Aggregated in Postgres (trip_ledger_balances / trip_ledger_totals views)
+    instead of loading the trip's checkpoint. The mirror is written by the
+    outbox worker, so it can trail the chat by a moment; `synced_at` says
+    when it was last updated. Requires participant access.
+    """
+    user = await require_auth_user(request)
+
+    trip = await session_service.get_trip_by_id(trip_id)
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+
+    is_participant = await session_service.is_participant(trip_id, user.id)
+    if not is_participant:
+        raise HTTPException(status_code=403, detail="Not a participant of this trip")
+
+    balances, totals, synced_at = await asyncio.gather(
+        ledger_service.get_trip_balances(trip_id),
+        ledger_service.get_trip_totals(trip_id),
+        ledger_service.get_last_sync(trip_id)
+    )
+
+    return {
+        "trip_id": trip_id,
+        "balances": balances,
+        "debts": calculate_debts(balances),
+        "totals": totals,
+        "synced_at": synced_at
+    }
+
+
 @app.get("/api/sessions/{session_code}/summary")
 async def get_session_summary(session_code: str):
     """
@@ -906,6 +1294,322 @@ async def transcribe_audio(request: Request):
 
 # ============== WEBSOCKET ENDPOINT ==============
 
+async def process_turns(thread_id: str, turns: List[QueuedTurn]):
+    """
+    Run one agent turn for a batch of queued messages and stream it to the room.
+
+    Called by the turn queue, which guarantees only one turn runs per thread
+    at a time. A batch with several messages becomes a single multi-speaker
+    message, so the LLM answers the whole burst at once.
+    """
+    graph = await get_graph()
+
+    speakers = list(dict.fromkeys(turn.user_id for turn in turns))
+    current_user = speakers[0] if len(speakers) == 1 else ", ".join(speakers)
+    old_values = {}
+    chunks = None
+
+    # Process with LangGraph
+    config = {"configurable": {"thread_id": thread_id}}
+
+    # Indicate bot is typing
+    await room_manager.broadcast(thread_id, {
+        "type": "bot_typing",
+        "active": True
+    })
+
+    try:
+        print(f"🔄 [{thread_id}] Processing {len(turns)} message(s) from {current_user}: {turns[0].content[:50]}...")
+
+        # Build session context for AI awareness
+        # Get trip_id from session_code (thread_id)
+        trip_id = None
+        try:
+            trip_id = await get_trip_resolver().resolve(thread_id)
+            if trip_id:
+                print(f"✅ [{thread_id}] Resolved trip_id: {trip_id}")
+            else:
+                print(f"⚠️ [{thread_id}] No trip found for session_code")
+        except Exception as e:
+            print(f"⚠️ [{thread_id}] Error resolving trip_id: {e}")
+
+        session_context = {
+            "current_user": current_user,
+            "trip_id": trip_id,  # Add trip_id for database persistence
+            "pending_uploads": []  # Will be populated if images are uploaded
+        }
+
+        # Upload images to Supabase Storage if present
+        for turn in turns:
+            if turn.upload:
+                # Already in Storage via /api/sessions/{thread_id}/uploads
+                session_context["pending_uploads"].append({
+                    "url": turn.upload.url,
+                    "path": turn.upload.path
+                })
+                continue
+            if not turn.image:
+                continue
+            try:
+                storage = get_storage()
+                upload_result = await storage.upload(turn.image, thread_id)
+                if upload_result.success:
+                    session_context["pending_uploads"].append({
+                        "url": upload_result.url,
+                        "path": upload_result.path
+                    })
+                    print(f"📷 Image uploaded: {upload_result.path}")
+            except Exception as upload_err:
+                print(f"⚠️ Image upload error (continuing without persistence): {upload_err}")
+
+        # Capture state before processing for action detection and deltas
+        try:
+            old_state = await graph.aget_state(config)
+            old_values = old_state.values
+            old_expenses = list(old_state.values.get("expenses", []))
+            old_payments = list(old_state.values.get("payments", []))
+        except Exception:
+            old_expenses = []
+            old_payments = []
+
+        # Build message content (multimodal if images present)
+        message_content = build_turn_content(turns)
+
+        # Track tool calls for Chain of Thought
+        tool_calls_made = []
+
+        # Stream response, batching tokens into fewer bot_chunk frames
+        full_response = ""
+
+        async def send_chunk(text: str):
+            nonlocal full_response
+            # Filter out any JSON tool outputs that might leak
+            if is_tool_related_content(text):
+                return
+            filtered_chunk = filter_json_from_response(text)
+            if filtered_chunk:
+                full_response += filtered_chunk
+                await room_manager.broadcast(thread_id, {
+                    "type": "bot_chunk",
+                    "content": filtered_chunk
+                })
+
+        chunks = ChunkAggregator(send_chunk)
+
+        async for event in graph.astream(
+            {
+                "messages": [{"role": "user", "content": message_content}],
+                "session_context": session_context
+            },
+            config=config,
+            stream_mode="messages"
+        ):
+            if event and len(event) > 0:
+                msg = event[0]
+
+                # Detect and broadcast tool calls (Chain of Thought)
+                if hasattr(msg, 'tool_calls') and msg.tool_calls:
+                    for tool_call in msg.tool_calls:
+                        tool_info = {
+                            "name": tool_call.get("name", "unknown"),
+                            "args": tool_call.get("args", {})
+                        }
+                        tool_calls_made.append(tool_info)
+                        print(f"🔧 [{thread_id}] Tool call: {tool_info['name']}({tool_info['args']})")
+
+                        # Send Chain of Thought event (after any buffered text)
+                        await chunks.flush()
+                        await room_manager.broadcast(thread_id, {
+                            "type": "thinking_step",
+                            "step": "tool_call",
+                            "tool_name": tool_info["name"],
+                            "tool_args": tool_info["args"],
+                            "status": "active"
+                        })
+
+                # Detect tool results
+                if hasattr(msg, 'type') and msg.type == "tool":
+                    tool_result = extract_text_content(msg.content) if hasattr(msg, 'content') else ""
+                    print(f"✅ [{thread_id}] Tool result: {tool_result[:100]}...")
+
+                    # Send tool result as Chain of Thought
+                    await chunks.flush()
+                    await room_manager.broadcast(thread_id, {
+                        "type": "thinking_step",
+                        "step": "tool_result",
+                        "result": tool_result[:200],
+                        "status": "complete"
+                    })
+
+                if hasattr(msg, 'content') and msg.content:
+                    # Accept both AIMessage (type="ai") and AIMessageChunk (type="AIMessageChunk")
+                    if hasattr(msg, 'type') and msg.type in ("ai", "AIMessageChunk"):
+                        await chunks.add(extract_text_content(msg.content))
+
+        await chunks.close()
+        print(f"📝 [{thread_id}] Stream finished. Response length: {len(full_response)} "
+              f"({chunks.pieces_in} tokens in {chunks.frames_out} frames)")
+
+        # Get final state for expense/balance updates
+        final_state = await graph.aget_state(config)
+        new_expenses = final_state.values.get("expenses", [])
+        new_payments = final_state.values.get("payments", [])
+
+        # Detect what action was performed
+        last_action = detect_action_from_expenses(
+            old_expenses, new_expenses,
+            old_payments, new_payments
+        )
+
+        # If no streaming happened, get response from state
+        if not full_response:
+            print(f"⚠️ [{thread_id}] No streaming response, extracting from state...")
+            messages = final_state.values.get("messages", [])
+            for msg in reversed(messages):
+                if hasattr(msg, 'type') and msg.type in ("ai", "AIMessageChunk") and hasattr(msg, 'content'):
+                    raw_response = extract_text_content(msg.content)
+                    full_response = filter_json_from_response(raw_response, strip=True)
+                    if full_response:
+                        print(f"📝 [{thread_id}] Extracted response: {full_response[:100]}...")
+                        await room_manager.broadcast(thread_id, {
+                            "type": "bot_chunk",
+                            "content": full_response
+                        })
+                    break
+
+        # Ledger changes travel as a versioned delta (see state_sync.py)
+        state_update = build_state_update(old_values, final_state.values)
+
+        print(f"✅ [{thread_id}] Sending bot_complete. Ledger v{state_update['base_version']} -> "
+              f"v{state_update['state_version']}, changed: {list(state_update['state_delta'].keys())}")
+
+        # Send completion with structured data
+        await room_manager.broadcast(thread_id, {
+            "type": "bot_complete",
+            "content": full_response or "(El agente procesó la solicitud pero no generó respuesta de texto)",
+            "structured_data": {
+                "last_action": last_action,
+                "tool_calls": tool_calls_made
+            },
+            **state_update
+        })
+
+    except asyncio.CancelledError:
+        # Deadline passed, a client sent "cancel", or the room emptied
+        reason = turn_queue.get_cancel_reason(thread_id) or "cancelled"
+        print(f"🛑 [{thread_id}] Turn stopped: {reason}")
+        if chunks:
+            try:
+                await chunks.close()
+            except Exception:
+                pass
+        cancelled_msg = {
+            "type": "bot_complete",
+            "content": "Respuesta cancelada." if reason != CANCEL_DEADLINE
+            else "La respuesta tardó demasiado y se canceló. Inténtalo de nuevo.",
+            "cancelled": True,
+            "cancel_reason": reason
+        }
+        # Tools may have run before the cancel; keep clients' ledgers in step
+        try:
+            state = await graph.aget_state(config)
+            cancelled_msg.update(build_state_update(old_values, state.values))
+        except Exception as state_err:
+            print(f"❌ [{thread_id}] Could not get state after cancel: {state_err}")
+        await room_manager.broadcast(thread_id, cancelled_msg)
+        raise
+
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"❌ [{thread_id}] Error: {e}\n{error_trace}")
+
+        # Send text already streamed before the error frame
+        if chunks:
+            try:
+                await chunks.close()
+            except Exception:
+                pass
+
+        # Still try to get and send current state even on error
+        try:
+            error_state = await graph.aget_state(config)
+
+            await room_manager.broadcast(thread_id, {
+                "type": "bot_complete",
+                "content": f"Hubo un error procesando tu mensaje. Los datos actuales se muestran abajo.",
+                "error": True,
+                "error_details": str(e),
+                **build_state_update(old_values, error_state.values)
+            })
+        except Exception as state_err:
+            print(f"❌ [{thread_id}] Could not get state on error: {state_err}")
+            await room_manager.broadcast(thread_id, {
+                "type": "bot_complete",
+                "content": f"Error procesando mensaje: {str(e)}",
+                "error": True
+            })
+
+    finally:
+        await room_manager.broadcast(thread_id, {
+            "type": "bot_typing",
+            "active": False
+        })
+
+
+async def notify_turns_cancelled(thread_id: str, turns: List[QueuedTurn], reason: str):
+    """
+    Answer messages whose turn was cancelled before it started.
+
+    Their user_message frames were already broadcast, so the room gets the
+    same cancelled bot_complete a running turn would end with. Nothing ran,
+    so the ledger is unchanged and the frame carries no state fields.
+    """
+    await room_manager.broadcast(thread_id, {
+        "type": "bot_complete",
+        "content": "Respuesta cancelada." if reason != CANCEL_DEADLINE
+        else "La respuesta tardó demasiado y se canceló. Inténtalo de nuevo.",
+        "cancelled": True,
+        "cancel_reason": reason
+    })
+
+
+turn_queue.set_handler(process_turns, on_cancelled=notify_turns_cancelled)
+
+
+async def join_room(thread_id: str, user_id: str, config: dict) -> dict:
+    """
+    Add a user to the graph state participants (persistent).
+
+    Returns:
+        The thread's state values, or {} if the thread has no state yet.
+    """
+    graph = await get_graph()
+    state_values = {}
+    try:
+        state = await graph.aget_state(config)
+        state_values = dict(state.values)
+        participants = list(state.values.get("participants", []))
+        if user_id not in participants:
+            participants.append(user_id)
+            # Update participants AND add system message so LLM knows about new user
+            messages = list(state.values.get("messages", []))
+            system_msg = SystemMessage(
+                content=f"[SISTEMA] {user_id} se ha unido al grupo. "
+                f"Los participantes actuales son: {', '.join(participants)}. "
+                f"A partir de ahora, incluye a {user_id} en los gastos cuando corresponda."
+            )
+            messages.append(system_msg)
+            await graph.aupdate_state(config, {"participants": participants, "messages": messages})
+            state_values["participants"] = participants
+            print(f"👤 [{thread_id}] New participant {user_id} added. Total: {participants}")
+    except Exception as e:
+        # If no state exists yet, it will be created on first message
+        print(f"Note: Could not update participants for new user {user_id}: {e}")
+
+    return state_values
+
+
 @app.websocket("/ws/{thread_id}/{user_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
@@ -918,15 +1622,32 @@ async def websocket_endpoint(
     Multiple users can connect to the same thread_id and all will
     see each other's messages and the bot's responses in real-time.
 
+    Reconnecting clients pass `?resume_seq=N&epoch=E` (the last `seq` they
+    saw) and get only the frames they missed, or a fresh room_snapshot if
+    the room no longer has them.
+
     Message types sent to clients:
+    - room_snapshot: Recent history, presence, full ledger state and upload_key (on join)
+    - resumed: Frames missed since resume_seq, and upload_key (on reconnect)
+    - presence: Online users changed without a join/leave notice
+    - history_page: Older room history (reply to "load_history")
+    - state_snapshot: Full ledger state (reply to "sync")
     - user_message: Message from a user
     - bot_chunk: Streaming chunk from bot
-    - bot_complete: Bot finished responding
+    - bot_complete: Bot finished responding (ledger changes as a versioned delta)
     - user_joined: Someone joined the room
     - user_left: Someone left the room
+    - ping: Heartbeat; clients answer {"type": "pong"} or get reaped
     - system: System notifications
     - expense_update: New expense registered
     - balance_update: Balances changed
+
+    Client messages:
+    - {"content": ..., "image"/"upload_id": ...}: Chat message for the agent
+    - cancel: Stop the agent's current answer (and any queued for the room)
+    - sync: Ledger version mismatch; answered with state_snapshot
+    - load_history: Older room history before a cursor
+    - pong: Heartbeat reply
     """
     # Get async graph (already initialized in startup)
     graph = await get_graph()
@@ -934,53 +1655,128 @@ async def websocket_endpoint(
     # Normalize user_id to avoid case duplicates
     user_id = normalize_name(user_id)
 
+    try:
+        resume_seq = int(websocket.query_params["resume_seq"])
+    except (KeyError, ValueError):
+        resume_seq = None
+
     # Connect to room
-    history = await room_manager.connect(thread_id, user_id, websocket)
+    history_page = await room_manager.connect(
+        thread_id, user_id, websocket,
+        resume_seq=resume_seq,
+        resume_epoch=websocket.query_params.get("epoch")
+    )
 
-    # Send history to the new client
-    for msg in history:
-        await room_manager.send_to_one(websocket, msg)
+    config = {"configurable": {"thread_id": thread_id}}
+    state_values = {}
+
+    if history_page["resumed"]:
+        # Replay what was missed; deltas in the frames bring the ledger up to date
+        await room_manager.send_to_one(websocket, {
+            "type": "resumed",
+            "messages": history_page["messages"],
+            "last_seq": history_page["last_seq"],
+            "epoch": history_page["epoch"],
+            "online_users": room_manager.get_online_users(thread_id),
+            "presence": room_manager.get_presence(thread_id),
+            "upload_key": upload_key(thread_id, user_id)
+        })
+        await room_manager.broadcast(thread_id, {
+            "type": "presence",
+            "online_users": room_manager.get_online_users(thread_id),
+            "presence": room_manager.get_presence(thread_id),
+            "connection_count": room_manager.get_connection_count(thread_id)
+        })
+        print(f"🔁 [{thread_id}] {user_id} resumed after seq {resume_seq} "
+              f"({len(history_page['messages'])} missed frames)")
+    else:
+        state_values = await join_room(thread_id, user_id, config)
 
-    # Notify room of new user
-    await room_manager.broadcast(thread_id, {
-        "type": "user_joined",
-        "user_id": user_id,
-        "participants": room_manager.get_participants(thread_id),
-        "connection_count": room_manager.get_connection_count(thread_id)
-    })
+        # Everything the client needs in one frame; afterwards only deltas
+        await room_manager.send_to_one(websocket, {
+            **build_room_snapshot(thread_id, history_page, state_values),
+            # Lets this user POST images to /api/sessions/{thread_id}/uploads
+            "upload_key": upload_key(thread_id, user_id)
+        })
 
-    # Add user to graph state participants (persistent)
-    config = {"configurable": {"thread_id": thread_id}}
-    try:
-        state = await graph.aget_state(config)
-        participants = list(state.values.get("participants", []))
-        if user_id not in participants:
-            participants.append(user_id)
-            # Update participants AND add system message so LLM knows about new user
-            messages = list(state.values.get("messages", []))
-            system_msg = SystemMessage(
-                content=f"[SISTEMA] {user_id} se ha unido al grupo. "
-                f"Los participantes actuales son: {', '.join(participants)}. "
-                f"A partir de ahora, incluye a {user_id} en los gastos cuando corresponda."
-            )
-            messages.append(system_msg)
-            await graph.aupdate_state(config, {"participants": participants, "messages": messages})
-            print(f"👤 [{thread_id}] New participant {user_id} added. Total: {participants}")
-    except Exception as e:
-        # If no state exists yet, it will be created on first message
-        print(f"Note: Could not update participants for new user {user_id}: {e}")
+        # Notify room of new user
+        await room_manager.broadcast(thread_id, {
+            "type": "user_joined",
+            "user_id": user_id,
+            "participants": state_values.get("participants") or room_manager.get_participants(thread_id),
+            "online_users": room_manager.get_online_users(thread_id),
+            "presence": room_manager.get_presence(thread_id),
+            "connection_count": room_manager.get_connection_count(thread_id)
+        })
 
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_text()
+            room_manager.touch(websocket)
 
             try:
                 message = json.loads(data)
+
+                # Heartbeat reply; touch() above already recorded it
+                if message.get("type") == "pong":
+                    continue
+
+                # Stop the agent's current answer for the whole room
+                if message.get("type") == "cancel":
+                    if not turn_queue.cancel(thread_id, reason=f"cancelled by {user_id}"):
+                        await room_manager.send_to_one(websocket, {
+                            "type": "error",
+                            "content": "No hay ninguna respuesta en curso"
+                        })
+                    continue
+
+                # Client's ledger version doesn't match a delta: resend everything
+                if message.get("type") == "sync":
+                    # Missed only the latest turn: replay its cached frame
+                    cached = room_manager.get_cached_frame(thread_id)
+                    if cached:
+                        cached_message, cached_text = cached
+                        client_version = message.get("version")
+                        if (cached_message.get("base_version") == client_version
+                                and cached_message.get("state_version") != client_version):
+                            await room_manager.send_to_one(websocket, cached_message, encoded=cached_text)
+                            continue
+                    try:
+                        state = await graph.aget_state(config)
+                        state_values = state.values
+                    except Exception as e:
+                        print(f"⚠️ [{thread_id}] Could not load state for sync: {e}")
+                    await room_manager.send_to_one(websocket, build_state_snapshot(state_values))
+                    continue
+
+                # Older room history, paged backwards from the snapshot
+                if message.get("type") == "load_history":
+                    page = room_manager.get_history_page(
+                        thread_id,
+                        before=message.get("before"),
+                        limit=message.get("limit", SNAPSHOT_HISTORY_LIMIT)
+                    )
+                    await room_manager.send_to_one(websocket, {
+                        "type": "history_page",
+                        "messages": page["messages"],
+                        "before": page["before"]
+                    })
+                    continue
+
                 content = message.get("content", "")
-                image_data = message.get("image")  # Optional base64 image
+                # Pre-uploaded image reference; inline base64 still accepted
+                upload = await upload_registry.claim(message.get("upload_id"), thread_id)
+                image_data = None if upload else message.get("image")
+
+                if message.get("upload_id") and not upload:
+                    await room_manager.send_to_one(websocket, {
+                        "type": "error",
+                        "content": "La imagen expiró o no es válida, vuelve a adjuntarla"
+                    })
+                    continue
 
-                if not content.strip() and not image_data:
+                if not content.strip() and not image_data and not upload:
                     continue
 
                 # Broadcast user message to all (with image indicator if present)
@@ -989,232 +1785,22 @@ async def websocket_endpoint(
                     "user_id": user_id,
                     "content": content
                 }
-                if image_data:
+                if upload:
+                    broadcast_msg["has_image"] = True
+                    broadcast_msg["image_url"] = upload.url
+                elif image_data:
                     broadcast_msg["has_image"] = True
                     # Optionally include a thumbnail or indicator
                 await room_manager.broadcast(thread_id, broadcast_msg)
 
-                # Process with LangGraph
-                config = {"configurable": {"thread_id": thread_id}}
-
-                # Indicate bot is typing
-                await room_manager.broadcast(thread_id, {
-                    "type": "bot_typing",
-                    "active": True
-                })
-
-                try:
-                    print(f"🔄 [{thread_id}] Processing message from {user_id}: {content[:50]}...")
-
-                    # Include user_id in the message so AI knows who is speaking
-                    message_with_user = f"[{user_id}]: {content}"
-
-                    # Build session context for AI awareness
-                    # Get trip_id from session_code (thread_id)
-                    trip_id = None
-                    try:
-                        from services import get_db
-                        trip_id = get_db().get_trip_id_from_session_code(thread_id)
-                        if trip_id:
-                            print(f"✅ [{thread_id}] Resolved trip_id: {trip_id}")
-                        else:
-                            print(f"⚠️ [{thread_id}] No trip found for session_code")
-                    except Exception as e:
-                        print(f"⚠️ [{thread_id}] Error resolving trip_id: {e}")
-
-                    session_context = {
-                        "current_user": user_id,
-                        "trip_id": trip_id,  # Add trip_id for database persistence
-                        "pending_uploads": []  # Will be populated if images are uploaded
-                    }
-
-                    # Upload image to Supabase Storage if present
-                    if image_data:
-                        message_with_user += " [El usuario adjuntó una imagen - analízala para extraer información del gasto/recibo o para registrar un momento del viaje]"
-                        try:
-                            storage = get_storage()
-                            upload_result = await storage.upload(image_data, thread_id)
-                            if upload_result.success:
-                                session_context["pending_uploads"].append({
-                                    "url": upload_result.url,
-                                    "path": upload_result.path
-                                })
-                                print(f"📷 Image uploaded: {upload_result.path}")
-                        except Exception as upload_err:
-                            print(f"⚠️ Image upload error (continuing without persistence): {upload_err}")
-
-                    # Capture state before processing for action detection
-                    try:
-                        old_state = await graph.aget_state(config)
-                        old_expenses = list(old_state.values.get("expenses", []))
-                        old_payments = list(old_state.values.get("payments", []))
-                    except Exception:
-                        old_expenses = []
-                        old_payments = []
-
-                    # Build message content (multimodal if image present)
-                    message_content = build_multimodal_content(message_with_user, image_data)
-
-                    # Track tool calls for Chain of Thought
-                    tool_calls_made = []
-
-                    # Stream response
-                    full_response = ""
-                    async for event in graph.astream(
-                        {
-                            "messages": [{"role": "user", "content": message_content}],
-                            "session_context": session_context
-                        },
-                        config=config,
-                        stream_mode="messages"
-                    ):
-                        if event and len(event) > 0:
-                            msg = event[0]
-
-                            # Detect and broadcast tool calls (Chain of Thought)
-                            if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                                for tool_call in msg.tool_calls:
-                                    tool_info = {
-                                        "name": tool_call.get("name", "unknown"),
-                                        "args": tool_call.get("args", {})
-                                    }
-                                    tool_calls_made.append(tool_info)
-                                    print(f"🔧 [{thread_id}] Tool call: {tool_info['name']}({tool_info['args']})")
-
-                                    # Send Chain of Thought event
-                                    await room_manager.broadcast(thread_id, {
-                                        "type": "thinking_step",
-                                        "step": "tool_call",
-                                        "tool_name": tool_info["name"],
-                                        "tool_args": tool_info["args"],
-                                        "status": "active"
-                                    })
-
-                            # Detect tool results
-                            if hasattr(msg, 'type') and msg.type == "tool":
-                                tool_result = extract_text_content(msg.content) if hasattr(msg, 'content') else ""
-                                print(f"✅ [{thread_id}] Tool result: {tool_result[:100]}...")
-
-                                # Send tool result as Chain of Thought
-                                await room_manager.broadcast(thread_id, {
-                                    "type": "thinking_step",
-                                    "step": "tool_result",
-                                    "result": tool_result[:200],
-                                    "status": "complete"
-                                })
-
-                            if hasattr(msg, 'content') and msg.content:
-                                # Accept both AIMessage (type="ai") and AIMessageChunk (type="AIMessageChunk")
-                                if hasattr(msg, 'type') and msg.type in ("ai", "AIMessageChunk"):
-                                    chunk = extract_text_content(msg.content)
-                                    # Filter out any JSON tool outputs that might leak
-                                    if not is_tool_related_content(chunk):
-                                        filtered_chunk = filter_json_from_response(chunk)
-                                        if filtered_chunk:
-                                            full_response += filtered_chunk
-                                            await room_manager.broadcast(thread_id, {
-                                                "type": "bot_chunk",
-                                                "content": filtered_chunk
-                                            })
-
-                    print(f"📝 [{thread_id}] Stream finished. Response length: {len(full_response)}")
-
-                    # Get final state for expense/balance updates
-                    final_state = await graph.aget_state(config)
-                    new_expenses = final_state.values.get("expenses", [])
-                    new_payments = final_state.values.get("payments", [])
-
-                    # Detect what action was performed
-                    last_action = detect_action_from_expenses(
-                        old_expenses, new_expenses,
-                        old_payments, new_payments
-                    )
-
-                    # If no streaming happened, get response from state
-                    if not full_response:
-                        print(f"⚠️ [{thread_id}] No streaming response, extracting from state...")
-                        messages = final_state.values.get("messages", [])
-                        for msg in reversed(messages):
-                            if hasattr(msg, 'type') and msg.type in ("ai", "AIMessageChunk") and hasattr(msg, 'content'):
-                                raw_response = extract_text_content(msg.content)
-                                full_response = filter_json_from_response(raw_response, strip=True)
-                                if full_response:
-                                    print(f"📝 [{thread_id}] Extracted response: {full_response[:100]}...")
-                                    await room_manager.broadcast(thread_id, {
-                                        "type": "bot_chunk",
-                                        "content": full_response
-                                    })
-                                break
-
-                    # Build structured data for rich UI
-                    balances = final_state.values.get("balances", {})
-                    debts = calculate_debts(balances)
-                    milestones = final_state.values.get("milestones", [])
-                    photos = final_state.values.get("photos", [])
-                    structured_data = {
-                        "expenses": new_expenses,
-                        "payments": new_payments,
-                        "balances": balances,
-                        "participants": final_state.values.get("participants", []),
-                        "debts": debts,
-                        "last_action": last_action,
-                        "milestones": milestones,
-                        "photos": photos,
-                        "tool_calls": tool_calls_made
-                    }
-
-                    print(f"✅ [{thread_id}] Sending bot_complete. Expenses: {len(new_expenses)}, Balances: {len(balances)}")
-
-                    # Send completion with structured data
-                    await room_manager.broadcast(thread_id, {
-                        "type": "bot_complete",
-                        "content": full_response or "(El agente procesó la solicitud pero no generó respuesta de texto)",
-                        "structured_data": structured_data,
-                        # Keep these for backwards compatibility
-                        "expenses": new_expenses,
-                        "balances": balances,
-                        "participants": structured_data["participants"],
-                        "debts": debts,
-                        "milestones": milestones,
-                        "photos": photos,
-                        "tool_calls": tool_calls_made
-                    })
-
-                except Exception as e:
-                    import traceback
-                    error_trace = traceback.format_exc()
-                    print(f"❌ [{thread_id}] Error: {e}\n{error_trace}")
-
-                    # Still try to get and send current state even on error
-                    try:
-                        error_state = await graph.aget_state(config)
-                        error_balances = error_state.values.get("balances", {})
-                        error_expenses = error_state.values.get("expenses", [])
-                        error_debts = calculate_debts(error_balances)
-
-                        await room_manager.broadcast(thread_id, {
-                            "type": "bot_complete",
-                            "content": f"Hubo un error procesando tu mensaje. Los datos actuales se muestran abajo.",
-                            "error": True,
-                            "error_details": str(e),
-                            "expenses": error_expenses,
-                            "balances": error_balances,
-                            "participants": error_state.values.get("participants", []),
-                            "debts": error_debts
-                        })
-                    except Exception as state_err:
-                        print(f"❌ [{thread_id}] Could not get state on error: {state_err}")
-                        await room_manager.broadcast(thread_id, {
-                            "type": "bot_complete",
-                            "content": f"Error procesando mensaje: {str(e)}",
-                            "error": True
-                        })
-
-                finally:
-                    await room_manager.broadcast(thread_id, {
-                        "type": "bot_typing",
-                        "active": False
-                    })
+                # Queue for the agent. Messages that arrive while a turn is
+                # running on this thread are merged into the next turn.
+                turn_queue.submit(thread_id, QueuedTurn(
+                    user_id=user_id,
+                    content=content,
+                    image=image_data,
+                    upload=upload
+                ))
 
             except json.JSONDecodeError:
                 await room_manager.send_to_one(websocket, {
@@ -1223,26 +1809,34 @@ async def websocket_endpoint(
                 })
 
     except WebSocketDisconnect:
-        # Notify room of user leaving
-        await room_manager.broadcast(thread_id, {
-            "type": "user_left",
-            "user_id": user_id,
-            "participants": room_manager.get_participants(thread_id),
-            "connection_count": room_manager.get_connection_count(thread_id) - 1
-        })
-        await room_manager.disconnect(thread_id, user_id, websocket)
+        pass
 
     except Exception as e:
+        # Also reached when the heartbeat reaper closed the socket
         print(f"WebSocket error: {e}")
-        await room_manager.disconnect(thread_id, user_id, websocket)
+
+    await room_manager.disconnect(thread_id, user_id, websocket)
+
+    # Notify room of user leaving, unless they come right back
+    asyncio.create_task(announce_user_left(thread_id, user_id))
 
 
 # ============== PHOTO/MILESTONE REST API ==============
 
 @app.get("/api/trips/{trip_id}/milestones")
-async def get_trip_milestones(trip_id: int):
+async def get_trip_milestones(
+    trip_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
     """
-    Get all milestones for a trip.
+    Get a page of a trip's milestones, newest first.
+
+    Query params:
+        limit: Page size (default 50, max 200)
+        cursor: next_cursor from the previous page
+        fields: Comma-separated columns (default all)
 
     Returns:
         {
@@ -1256,24 +1850,39 @@ async def get_trip_milestones(trip_id: int):
                     "photo_count": 5,
                     ...
                 }
-            ]
+            ],
+            "next_cursor": "..." or null,
+            "total": 12 (first page only, null after)
         }
     """
     from services import get_db
 
     try:
         db = get_db()
-        milestones = await db.get_trip_milestones(trip_id)
-        return {"milestones": milestones}
+        return await db.get_trip_milestones(
+            trip_id, limit=limit, cursor=cursor, fields=parse_fields(fields), with_total=not cursor
+        )
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error fetching milestones: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/milestones/{milestone_id}/photos")
-async def get_milestone_photos(milestone_id: int):
+async def get_milestone_photos(
+    milestone_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
     """
-    Get all photos in a specific milestone.
+    Get a page of the photos in a milestone, in upload order.
+
+    Query params:
+        limit: Page size (default 50, max 200)
+        cursor: next_cursor from the previous page
+        fields: Comma-separated columns (default all; "id,photo_url,thumbnail_url" for a grid)
 
     Returns:
         {
@@ -1286,24 +1895,39 @@ async def get_milestone_photos(milestone_id: int):
                     "tags": ["paisaje", "grupo"],
                     ...
                 }
-            ]
+            ],
+            "next_cursor": "..." or null,
+            "total": 5 (first page only, null after)
         }
     """
     from services import get_db
 
     try:
         db = get_db()
-        photos = await db.get_milestone_photos(milestone_id)
-        return {"photos": photos}
+        return await db.get_milestone_photos(
+            milestone_id, limit=limit, cursor=cursor, fields=parse_fields(fields), with_total=not cursor
+        )
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error fetching milestone photos: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/trips/{trip_id}/photos")
-async def get_trip_photos(trip_id: int):
+async def get_trip_photos(
+    trip_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
     """
-    Get all photos for a trip (across all milestones).
+    Get a page of a trip's photos (across all milestones), newest first.
+
+    Query params:
+        limit: Page size (default 50, max 200)
+        cursor: next_cursor from the previous page
+        fields: Comma-separated columns (default all; "id,photo_url,thumbnail_url" for a grid)
 
     Returns:
         {
@@ -1318,15 +1942,20 @@ async def get_trip_photos(trip_id: int):
                     "detected_people": [...],
                     ...
                 }
-            ]
+            ],
+            "next_cursor": "..." or null,
+            "total": 40 (first page only, null after)
         }
     """
     from services import get_db
 
     try:
         db = get_db()
-        photos = await db.get_trip_photos(trip_id)
-        return {"photos": photos}
+        return await db.get_trip_photos(
+            trip_id, limit=limit, cursor=cursor, fields=parse_fields(fields), with_total=not cursor
+        )
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error fetching trip photos: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1349,6 +1978,7 @@ async def upload_photos(trip_id: int, request: Request):
         }
     """
     from services import get_db
+    from services.supabase_db import photo_row
 
     # Get trip first
     trip = await session_service.get_trip_by_id(trip_id)
@@ -1397,6 +2027,7 @@ async def upload_photos(trip_id: int, request: Request):
         db = get_db()
 
         session_code = trip["session_code"]
+        photo_rows = []
 
         for idx, photo_file in enumerate(photo_files):
             # Read file content
@@ -1417,8 +2048,7 @@ async def upload_photos(trip_id: int, request: Request):
                 print(f"⚠️ Failed to upload photo {idx + 1}: {upload_result.error}")
                 continue
 
-            # Insert into database
-            photo_record = await db.insert_photo(
+            photo_rows.append(photo_row(
                 trip_id=trip_id,
                 milestone_id=milestone_id,
                 photo_url=upload_result.url,
@@ -1426,17 +2056,18 @@ async def upload_photos(trip_id: int, request: Request):
                 uploaded_by_user_id=user_id,
                 description=description,
                 order_index=idx
-            )
-
-            if photo_record:
-                uploaded_photos.append({
-                    "id": photo_record.id,
-                    "trip_id": photo_record.trip_id,
-                    "milestone_id": photo_record.milestone_id,
-                    "photo_url": photo_record.photo_url,
-                    "description": photo_record.description,
-                    "created_at": photo_record.created_at
-                })
+            ))
+
+        # Insert all rows in one request
+        for photo_record in await db.insert_photos_bulk(photo_rows):
+            uploaded_photos.append({
+                "id": photo_record.id,
+                "trip_id": photo_record.trip_id,
+                "milestone_id": photo_record.milestone_id,
+                "photo_url": photo_record.photo_url,
+                "description": photo_record.description,
+                "created_at": photo_record.created_at
+            })
 
         if len(uploaded_photos) == 0:
             raise HTTPException(status_code=500, detail="Failed to upload any photos")
@@ -2076,8 +2707,72 @@ async def test_page():
         // Chain of Thought state
         let thinkingSteps = [];
 
+        // Ledger kept in sync with versioned deltas (see state_sync.py)
+        let ledger = {version: null, expenses: [], payments: [], milestones: [], photos: []};
+
+        function applySnapshot(version, state) {
+            ledger = {
+                version: version,
+                expenses: state.expenses || [],
+                payments: state.payments || [],
+                milestones: state.milestones || [],
+                photos: state.photos || []
+            };
+            renderLedger(state);
+        }
+
+        function applyStateUpdate(data) {
+            if (data.state_version === undefined) return;
+            if (data.base_version !== ledger.version) {
+                // Missed a change: ask for the full state
+                ws.send(JSON.stringify({type: 'sync', version: ledger.version}));
+                return;
+            }
+            for (const [key, diff] of Object.entries(data.state_delta || {})) {
+                const removed = new Set(diff.removed || []);
+                const changed = new Map((diff.changed || []).map(item => [item.id, item]));
+                ledger[key] = (ledger[key] || [])
+                    .filter(item => !removed.has(item.id))
+                    .map(item => changed.get(item.id) || item)
+                    .concat(diff.added || []);
+            }
+            ledger.version = data.state_version;
+            renderLedger(data);
+        }
+
+        function renderLedger(state) {
+            if (state.participants) {
+                state.participants.forEach(p => allParticipants.add(p));
+                updateParticipants(state.participants);
+                updateParticipantBubbles();
+            }
+            if (state.balances) updateBalances(state.balances);
+            updateExpenses(ledger.expenses);
+            if (state.debts) updateDebts(state.debts);
+        }
+
         function handleMessage(data) {
             switch (data.type) {
+                case 'ping':
+                    // Heartbeat: unanswered sockets are reaped by the server
+                    ws.send(JSON.stringify({type: 'pong'}));
+                    break;
+                case 'room_snapshot':
+                    (data.messages || []).forEach(frame => {
+                        if (frame.type === 'user_message') addMessage('user', frame.content, frame.user_id);
+                        else if (frame.type === 'bot_complete') addMessage('bot', frame.content, 'Journi');
+                    });
+                    (data.online_users || []).forEach(u => onlineUsers.add(u));
+                    applySnapshot(data.state_version, data.state);
+                    break;
+                case 'state_snapshot':
+                    applySnapshot(data.state_version, data.state);
+                    break;
+                case 'whatsapp_message':
+                    addMessage('user', data.content, `${data.user_id} (WhatsApp)`);
+                    addMessage('bot', data.response, 'Journi');
+                    applyStateUpdate(data);
+                    break;
                 case 'user_message':
                     addMessage('user', data.content, data.user_id);
                     // Clear thinking steps for new conversation turn
@@ -2095,14 +2790,7 @@ async def test_page():
                     finalizeThinkingContainer();
                     finalizeStreamingMessage(data.content);
                     streamingContent = '';
-                    if (data.participants) {
-                        data.participants.forEach(p => allParticipants.add(p));
-                        updateParticipants(data.participants);
-                        updateParticipantBubbles();
-                    }
-                    if (data.balances) updateBalances(data.balances);
-                    if (data.expenses) updateExpenses(data.expenses);
-                    if (data.debts) updateDebts(data.debts);
+                    applyStateUpdate(data);
                     break;
                 case 'user_joined':
                     addMessage('system', `${data.user_id} se unió`);
@@ -2425,7 +3113,7 @@ async def process_message_complete(
     config = {"configurable": {"thread_id": thread_id}}
 
     # Build message with user context
-    message_with_user = f"[{user_id}]: {content}"
+    message_with_user = speaker_line(user_id, content)
 
     if image_base64:
         message_with_user += " [El usuario adjunto una imagen - analizala para extraer informacion del gasto/recibo]"
@@ -2439,8 +3127,7 @@ async def process_message_complete(
 
     # Try to get trip_id from session_code
     try:
-        from services import get_db
-        trip_id = get_db().get_trip_id_from_session_code(thread_id)
+        trip_id = await get_trip_resolver().resolve(thread_id)
         session_context["trip_id"] = trip_id
     except Exception as e:
         print(f"[WhatsApp] Could not resolve trip_id: {e}")
@@ -2464,7 +3151,17 @@ async def process_message_complete(
     # Invoke graph (no streaming)
     print(f"[WhatsApp] Processing: {content[:50]}...")
 
-    try:
+    # State before this run, to send web clients only the delta (None: unknown)
+    old_values = None
+
+    async def run_graph():
+        nonlocal old_values
+        try:
+            old_state = await agent_graph.aget_state(config)
+            old_values = old_state.values
+        except Exception:
+            old_values = {}
+
         await agent_graph.ainvoke(
             {
                 "messages": [{"role": "user", "content": message_content}],
@@ -2474,7 +3171,12 @@ async def process_message_complete(
         )
 
         # Get final state
-        final_state = await agent_graph.aget_state(config)
+        return await agent_graph.aget_state(config)
+
+    try:
+        # Same per-thread lock, global slot and deadline as web turns, so this
+        # run never races them on the checkpoint or overloads the workers
+        final_state = await turn_queue.run_exclusive(thread_id, run_graph)
         messages = final_state.values.get("messages", [])
 
         # Extract last AI response
@@ -2486,28 +3188,40 @@ async def process_message_complete(
                 if response_text:
                     break
 
-        # Build structured data
-        balances = final_state.values.get("balances", {})
-        debts = calculate_debts(balances)
-
         return {
             "response": response_text or "Mensaje procesado.",
-            "expenses": final_state.values.get("expenses", []),
-            "payments": final_state.values.get("payments", []),
-            "balances": balances,
-            "participants": final_state.values.get("participants", []),
-            "debts": debts
+            **build_state_update(old_values, final_state.values)
+        }
+
+    except TurnCancelled as e:
+        print(f"[WhatsApp] Run stopped: {e.reason}")
+        result = {
+            "response": "Respuesta cancelada." if e.reason != CANCEL_DEADLINE
+            else "La respuesta tardó demasiado y se canceló. Inténtalo de nuevo.",
+            "error": True,
+            "cancelled": True,
+            "cancel_reason": e.reason
         }
 
     except Exception as e:
         print(f"[WhatsApp] Error processing message: {e}")
         import traceback
         traceback.print_exc()
-        return {
+        result = {
             "response": f"Error procesando mensaje: {str(e)}",
             "error": True
         }
 
+    # The run may have saved some tool results before failing: send what
+    # changed against the real version, or no ledger fields at all
+    if old_values is not None:
+        try:
+            current = await agent_graph.aget_state(config)
+            result.update(build_state_update(old_values, current.values))
+        except Exception:
+            pass
+    return result
+
 
 @app.get("/api/whatsapp/webhook")
 async def whatsapp_verify(request: Request):
@@ -2555,8 +3269,8 @@ async def whatsapp_webhook(request: Request):
     if not user or user.display_name == msg.display_name:
         # User not in cache or still using WhatsApp profile name - check DB for linked account
         try:
-            supabase = get_supabase_client()
-            linked_user = supabase.table("users").select("id, full_name, email").eq(
+            supabase = get_async_client()
+            linked_user = await supabase.table("users").select("id, full_name, email").eq(
                 "phone_number", msg.phone_number
             ).execute()
 
@@ -2731,19 +3445,19 @@ async def whatsapp_webhook(request: Request):
 
     # Also broadcast to web users if any are connected
     try:
-        await room_manager.broadcast(thread_id, {
+        frame = {
             "type": "whatsapp_message",
             "user_id": user_name,
             "content": message_content,  # Use message_content (includes audio transcription)
             "response": response_text,
-            "source": "whatsapp",
-            # Include structured data for UI updates
-            "expenses": result.get("expenses", []),
-            "payments": result.get("payments", []),
-            "balances": result.get("balances", {}),
-            "participants": result.get("participants", []),
-            "debts": result.get("debts", {})
-        })
+            "source": "whatsapp"
+        }
+        # Versioned ledger delta for UI updates (absent when the state
+        # couldn't be read: clients then keep their ledger as is)
+        if "state_version" in result:
+            for key in ("base_version", "state_version", "state_delta", "balances", "participants", "debts"):
+                frame[key] = result[key]
+        await room_manager.broadcast(thread_id, frame)
     except Exception as e:
         print(f"[WhatsApp] Could not broadcast to web: {e}")
 
@@ -2772,19 +3486,19 @@ async def whatsapp_generate_code(request: GenerateCodeRequest):
     The user will send this code via WhatsApp to verify their phone number.
     """
     try:
-        supabase = get_supabase_client()
+        supabase = get_async_client()
 
         # Generate unique code
         code = generate_verification_code()
         expires_at = datetime.utcnow() + timedelta(minutes=10)
 
         # Delete any existing pending codes for this user
-        supabase.table("whatsapp_verification_codes").delete().eq(
+        await supabase.table("whatsapp_verification_codes").delete().eq(
             "user_id", request.user_id
         ).is_("verified_at", "null").execute()
 
         # Store the code (phone_number will be set when user verifies)
-        result = supabase.table("whatsapp_verification_codes").insert({
+        result = await supabase.table("whatsapp_verification_codes").insert({
             "user_id": request.user_id,
             "code": code,
             "phone_number": "",  # Will be set when user sends the code
@@ -2818,10 +3532,10 @@ async def whatsapp_verify_status(code: str, request: Request):
         if not user_id:
             raise HTTPException(status_code=401, detail="Missing authorization")
 
-        supabase = get_supabase_client()
+        supabase = get_async_client()
 
         # Find the verification code
-        result = supabase.table("whatsapp_verification_codes").select("*").eq(
+        result = await supabase.table("whatsapp_verification_codes").select("*").eq(
             "code", code.upper()
         ).eq("user_id", user_id).execute()
 
@@ -2855,11 +3569,11 @@ async def handle_vincular_command(msg, phone_number: str, verification_code: str
     Returns a tuple of (success: bool, message: str)
     """
     whatsapp = get_whatsapp_service()
-    supabase = get_supabase_client()
+    supabase = get_async_client()
 
     try:
         # Find the verification code
-        result = supabase.table("whatsapp_verification_codes").select("*").eq(
+        result = await supabase.table("whatsapp_verification_codes").select("*").eq(
             "code", verification_code.upper()
         ).is_("verified_at", "null").execute()
 
@@ -2884,19 +3598,19 @@ async def handle_vincular_command(msg, phone_number: str, verification_code: str
         user_id = verification["user_id"]
 
         # Update the verification record
-        supabase.table("whatsapp_verification_codes").update({
+        await supabase.table("whatsapp_verification_codes").update({
             "phone_number": phone_number,
             "verified_at": datetime.utcnow().isoformat()
         }).eq("id", verification["id"]).execute()
 
         # Link phone number to user account
-        supabase.table("users").update({
+        await supabase.table("users").update({
             "phone_number": phone_number,
             "whatsapp_linked_at": datetime.utcnow().isoformat()
         }).eq("id", user_id).execute()
 
         # Get user info for display name
-        user_result = supabase.table("users").select("full_name, email").eq(
+        user_result = await supabase.table("users").select("full_name, email").eq(
             "id", user_id
         ).execute()
 
@@ -3,58 +3,367 @@ Room Manager for Multi-User WebSocket Sessions
 
 Handles multiple users connecting to the same session/thread,
 broadcasting messages to all participants in real-time.
+
+Every connection has its own bounded outbound queue drained by a writer
+task, so a slow client only delays itself. When a queue backs up,
+consecutive `bot_chunk` frames are merged; if it is still full, chunks are
+dropped (the final `bot_complete` carries the whole text), and a client
+that can't even keep up with regular messages is closed so it reconnects
+and resyncs from a snapshot.
+
+Room history is a fixed-size ring buffer, and rooms left without
+connections for longer than ROOM_IDLE_TTL are evicted entirely. Every
+stored message gets a per-room `seq`; a reconnecting client passes its last
+seen seq and gets only the frames it missed (see connect()).
+
+Each broadcast is JSON-encoded once (fast_json) and the same text is sent
+to every socket. The latest `bot_complete` frame of each room is kept
+encoded so a client that missed just that frame can be served from cache.
+
+A heartbeat loop pings every connection; sockets that haven't sent anything
+(pong or message) within WS_HEARTBEAT_TIMEOUT are reaped. Presence keeps a
+last-seen time per user and forgets users not seen for PRESENCE_TTL.
+
+Membership changes take a per-room lock and replace the room's connection
+set (copy-on-write), so the broadcast hot path never takes a lock and
+rooms never wait on each other.
+
+broadcast() goes through a pub/sub backend (see room_pubsub.py) so messages
+published by one worker process reach sockets held by the others; deliver()
+is the local half that every process runs for every message. Non-room
+channels (see subscribe()) share the same backend for small cross-worker
+notices such as trip cache invalidations.
+
+Every worker also publishes its connection count per room (on join, on leave and with each heartbeat), so
+get_room_connection_count() sees sockets held by the other workers.
+Counts not refreshed within REMOTE_COUNT_TTL (a worker died) are ignored.
 """
 
-from typing import Dict, Set, List
+from typing import Callable, Deque, Dict, FrozenSet, List, Optional, Tuple
+from collections import deque
+from itertools import islice
 import asyncio
+import os
+import time
+import uuid
 from fastapi import WebSocket
-from datetime import datetime
+from datetime import datetime, timezone
+
+from fast_json import dumps
+from room_pubsub import InProcessPubSub
+
+# Messages included in the room_snapshot sent on join; older ones are paged
+SNAPSHOT_HISTORY_LIMIT = int(os.getenv("ROOM_SNAPSHOT_HISTORY", "50"))
+# Max messages per history page requested by clients
+MAX_HISTORY_PAGE = 200
+# Max frames waiting to be sent to a single client
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# Messages kept per room (oldest are discarded first)
+ROOM_HISTORY_SIZE = int(os.getenv("ROOM_HISTORY_SIZE", "500"))
+# Seconds a room may sit without connections before it is evicted
+ROOM_IDLE_TTL = float(os.getenv("ROOM_IDLE_TTL", "1800"))
+# Seconds between server pings, and silence after which a socket is reaped
+HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "60"))
+# Seconds an offline user stays in a room's presence list
+PRESENCE_TTL = float(os.getenv("PRESENCE_TTL", "86400"))
+# Keep each room's latest bot_complete frame encoded for reconnecting clients
+ROOM_FRAME_CACHE = os.getenv("ROOM_FRAME_CACHE", "true").lower() in ("true", "1", "yes")
+
+# Seconds another worker's connection count stays valid without a refresh
+REMOTE_COUNT_TTL = 3 * HEARTBEAT_INTERVAL
+# Channel carrying each worker's connection count per room
+ROOM_COUNT_CHANNEL = "__room_counts__"
+
+# Seconds a user may be gone before others see user_left (covers network switches)
+RESUME_GRACE = float(os.getenv("WS_RESUME_GRACE", "5"))
+
+# Transient frames: not stored in history, no seq
+EPHEMERAL_TYPES = ("bot_chunk", "bot_typing", "presence", "ping")
+
+# Close code for clients that fall too far behind (RFC 6455 "Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Close code for sockets that stopped answering heartbeats (app-defined range)
+HEARTBEAT_CLOSE_CODE = 4000
+
+PING_FRAME = {"type": "ping"}
+
+
+class Connection:
+    """An open WebSocket with its own bounded send queue and writer task."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        max_queue: int = SEND_QUEUE_SIZE,
+        on_dead: Optional[Callable[["Connection"], None]] = None,
+        thread_id: Optional[str] = None
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.thread_id = thread_id
+        # Monotonic time of the last frame received from the client
+        self.last_seen = time.monotonic()
+        self.max_queue = max_queue
+        # Called once when the socket fails or is closed as too slow
+        self.on_dead = on_dead
+        # (message, encoded text or None, enqueued_at) waiting for the writer
+        self.queue: Deque[Tuple[dict, Optional[str], float]] = deque()
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer: Optional[asyncio.Task] = None
+        # Metrics
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def start(self):
+        """Start the writer task."""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._run())
+
+    def enqueue(self, message: dict, encoded: Optional[str] = None) -> bool:
+        """
+        Queue a message for this client without waiting for the send.
+
+        Args:
+            message: The message dict
+            encoded: The message already encoded as JSON text (shared by
+                every connection of a broadcast); encoded on send if None
+
+        Returns:
+            False if the message was dropped
+        """
+        if self.closed:
+            return False
+
+        is_chunk = message.get("type") == "bot_chunk"
+
+        # Merge into a chunk that is still waiting: fewer, larger frames
+        # for clients that are behind, no text lost
+        if is_chunk and self.queue and self.queue[-1][0].get("type") == "bot_chunk":
+            tail, _, enqueued_at = self.queue[-1]
+            merged = {**tail, "content": tail.get("content", "") + message.get("content", "")}
+            self.queue[-1] = (merged, None, enqueued_at)
+            self.coalesced += 1
+            return True
+
+        if len(self.queue) >= self.max_queue:
+            if is_chunk:
+                self.dropped += 1
+                return False
+            # Make room by discarding stream chunks before giving up
+            kept = deque(item for item in self.queue if item[0].get("type") != "bot_chunk")
+            self.dropped += len(self.queue) - len(kept)
+            self.queue = kept
+            if len(self.queue) >= self.max_queue:
+                self.dropped += 1
+                print(f"🐢 {self.user_id}: send queue full, closing slow connection")
+                self._mark_dead()
+                asyncio.create_task(self._close_slow())
+                return False
+
+        self.queue.append((message, encoded, time.monotonic()))
+        self._idle.clear()
+        self._wakeup.set()
+        return True
+
+    async def _run(self):
+        """Writer loop: send queued frames in order."""
+        try:
+            while True:
+                if not self.queue:
+                    self._idle.set()
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                message, encoded, enqueued_at = self.queue.popleft()
+                await self.websocket.send_text(encoded if encoded is not None else dumps(message))
+
+                lag_ms = (time.monotonic() - enqueued_at) * 1000
+                self.sent += 1
+                self.last_lag_ms = lag_ms
+                self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._mark_dead()
+
+    async def _close_slow(self):
+        await self.close_socket(SLOW_CONSUMER_CLOSE_CODE)
+
+    async def close_socket(self, code: int):
+        """Close the underlying WebSocket, ignoring already-closed sockets."""
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def _mark_dead(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self._idle.set()
+        if self.on_dead:
+            self.on_dead(self)
+
+    async def flush(self, timeout: float = 5.0):
+        """Wait until everything queued so far has been sent."""
+        await asyncio.wait_for(self._idle.wait(), timeout)
+
+    def close(self):
+        """Stop the writer; queued frames are discarded."""
+        self.closed = True
+        self.queue.clear()
+        self._idle.set()
+        if self._writer and not self._writer.done():
+            self._writer.cancel()
+
+    def get_stats(self) -> dict:
+        """Per-connection send metrics."""
+        oldest_ms = (time.monotonic() - self.queue[0][2]) * 1000 if self.queue else 0.0
+        return {
+            "user_id": self.user_id,
+            "idle_s": round(time.monotonic() - self.last_seen, 1),
+            "queued": len(self.queue),
+            "oldest_queued_ms": round(oldest_ms, 1),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "last_lag_ms": round(self.last_lag_ms, 1),
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "closed": self.closed
+        }
 
 
 class RoomManager:
     """Manages WebSocket connections for multi-user chat rooms."""
 
-    def __init__(self):
-        # thread_id -> set of WebSocket connections
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
-        # thread_id -> list of message history
-        self.room_history: Dict[str, List[dict]] = {}
-        # thread_id -> set of participant names
-        self.participants: Dict[str, Set[str]] = {}
-        # Lock for thread-safe operations
-        self.lock = asyncio.Lock()
+    def __init__(
+        self,
+        send_queue_size: int = SEND_QUEUE_SIZE,
+        history_size: int = ROOM_HISTORY_SIZE,
+        idle_ttl: float = ROOM_IDLE_TTL,
+        frame_cache: bool = ROOM_FRAME_CACHE
+    ):
+        # thread_id -> WebSocket connections (immutable, replaced on change)
+        self.active_connections: Dict[str, FrozenSet[WebSocket]] = {}
+        # thread_id -> ring buffer of recent messages
+        self.room_history: Dict[str, Deque[dict]] = {}
+        # thread_id -> encoded size of each buffered message (same order)
+        self.history_sizes: Dict[str, Deque[int]] = {}
+        # thread_id -> messages ever added (absolute index for history cursors)
+        self.history_total: Dict[str, int] = {}
+        # thread_id -> id of this incarnation of the room (seqs restart with it)
+        self.room_epochs: Dict[str, str] = {}
+        # thread_id -> monotonic time the room lost its last connection
+        self.idle_since: Dict[str, float] = {}
+        # thread_id -> (latest bot_complete message, its encoded text)
+        self.frame_cache: Dict[str, Tuple[dict, str]] = {}
+        self.frame_cache_enabled = frame_cache
+        # thread_id -> user_id -> last seen (epoch seconds)
+        self.presence: Dict[str, Dict[str, float]] = {}
+        # WebSocket -> its Connection (user, send queue, writer task)
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.send_queue_size = send_queue_size
+        self.history_size = history_size
+        self.idle_ttl = idle_ttl
+        # Cross-process fan-out (in-process until use_pubsub is called)
+        self.pubsub = InProcessPubSub(self.deliver)
+        # channel -> handler for non-room messages on the same pub/sub
+        self.channel_handlers: Dict[str, Callable[[dict], None]] = {
+            ROOM_COUNT_CHANNEL: self._on_remote_count
+        }
+        # Tags this process's connection counts
+        self.origin = uuid.uuid4().hex[:12]
+        # thread_id -> origin -> (connections that worker holds, monotonic time received)
+        self.remote_counts: Dict[str, Dict[str, Tuple[int, float]]] = {}
+        # thread_id -> count last published for this process (dropped once 0 is sent)
+        self.published_counts: Dict[str, int] = {}
+        # Gauges
+        self.history_bytes = 0
+        self.rooms_evicted = 0
+        self.sockets_reaped = 0
+        # thread_id -> lock for membership changes in that room
+        self.room_locks: Dict[str, asyncio.Lock] = {}
+
+    def _room_lock(self, thread_id: str) -> asyncio.Lock:
+        """Get the lock guarding a room's membership changes."""
+        if thread_id not in self.room_locks:
+            self.room_locks[thread_id] = asyncio.Lock()
+        return self.room_locks[thread_id]
 
     async def connect(
         self,
         thread_id: str,
         user_id: str,
-        websocket: WebSocket
-    ) -> List[dict]:
+        websocket: WebSocket,
+        history_limit: int = SNAPSHOT_HISTORY_LIMIT,
+        resume_seq: Optional[int] = None,
+        resume_epoch: Optional[str] = None
+    ) -> dict:
         """
-        Add a client to a room and return message history.
+        Add a client to a room and return the history it needs.
 
         Args:
             thread_id: The session/room identifier
             user_id: The user's identifier
             websocket: The WebSocket connection
+            history_limit: Max recent messages to return
+            resume_seq: Last seq the client saw before reconnecting
+            resume_epoch: Room epoch that seq belongs to
 
         Returns:
-            List of previous messages in the room
+            {"messages": [...], "before": cursor or None, "last_seq": N,
+             "epoch": str, "resumed": bool}. When resumed, messages are exactly the frames
+            after resume_seq; otherwise the most recent page.
         """
         await websocket.accept()
 
-        async with self.lock:
+        async with self._room_lock(thread_id):
             # Initialize room if it doesn't exist
             if thread_id not in self.active_connections:
-                self.active_connections[thread_id] = set()
-                self.room_history[thread_id] = []
-                self.participants[thread_id] = set()
+                self.active_connections[thread_id] = frozenset()
+                self.room_history[thread_id] = deque(maxlen=self.history_size)
+                self.history_sizes[thread_id] = deque(maxlen=self.history_size)
+                self.history_total[thread_id] = 0
+                self.room_epochs[thread_id] = uuid.uuid4().hex[:12]
+                self.presence[thread_id] = {}
+            self.idle_since.pop(thread_id, None)
+
+            connection = Connection(
+                websocket,
+                user_id,
+                max_queue=self.send_queue_size,
+                on_dead=lambda conn: self._remove_dead(thread_id, conn),
+                thread_id=thread_id
+            )
+            connection.start()
+
+            self.active_connections[thread_id] = self.active_connections[thread_id] | {websocket}
+            self.presence[thread_id][user_id] = time.time()
+            self.connections[websocket] = connection
 
-            self.active_connections[thread_id].add(websocket)
-            self.participants[thread_id].add(user_id)
+            position = {"last_seq": self.history_total[thread_id], "epoch": self.room_epochs[thread_id]}
 
-            # Return history for the new client
-            return list(self.room_history[thread_id])
+            # Computed while registering, so no frame is both missed and live
+            missed = self.get_frames_since(thread_id, resume_seq, resume_epoch)
+            if missed is not None:
+                result = {"messages": missed, "before": None, **position, "resumed": True}
+            else:
+                # Only the recent tail; older pages are fetched on demand
+                page = self._history_page(thread_id, None, history_limit)
+                result = {**page, **position, "resumed": False}
+
+        await self._publish_count(thread_id)
+        return result
 
     async def disconnect(
         self,
@@ -63,73 +372,391 @@ class RoomManager:
         websocket: WebSocket
     ):
         """Remove a client from a room."""
-        async with self.lock:
+        async with self._room_lock(thread_id):
+            connection = self.connections.pop(websocket, None)
+            if connection:
+                connection.close()
             if thread_id in self.active_connections:
-                self.active_connections[thread_id].discard(websocket)
-                # Note: We don't remove user_id from participants
-                # because they might reconnect
+                self.active_connections[thread_id] = self.active_connections[thread_id] - {websocket}
+                # Users stay in presence (offline, with last seen) because
+                # they might reconnect
+                if thread_id in self.presence:
+                    self.presence[thread_id][user_id] = time.time()
 
-                # Clean up empty rooms (optional)
+                # Keep empty rooms for potential reconnections until
+                # evict_idle_rooms drops them
                 if not self.active_connections[thread_id]:
-                    # Keep history for potential reconnections
-                    pass
+                    self.idle_since[thread_id] = time.monotonic()
+
+        await self._publish_count(thread_id)
+
+    def _remove_dead(self, thread_id: str, connection: Connection):
+        """Drop a connection whose writer failed (runs synchronously, no lock needed)."""
+        if self.connections.get(connection.websocket) is connection:
+            del self.connections[connection.websocket]
+        if thread_id in self.active_connections:
+            self.active_connections[thread_id] = self.active_connections[thread_id] - {connection.websocket}
+            if not self.active_connections[thread_id]:
+                self.idle_since.setdefault(thread_id, time.monotonic())
+
+    async def use_pubsub(self, pubsub):
+        """Switch to another pub/sub backend (e.g. Postgres) and start it."""
+        await pubsub.start(self.deliver)
+        self.pubsub = pubsub
+
+    def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        """
+        Receive messages published on a non-room channel, from every process.
+
+        Channel names must not be valid session codes (e.g. "__trip_cache__").
+        The handler runs inside deliver() and must not block.
+        """
+        self.channel_handlers[channel] = handler
+
+    async def publish(self, channel: str, message: dict):
+        """Send a message to the channel's handler in every process (this one included)."""
+        await self.pubsub.publish(channel, message)
+
+    async def _publish_count(self, thread_id: str):
+        """Tell the other workers how many of the room's sockets this one holds."""
+        count = self.get_connection_count(thread_id)
+        try:
+            await self.publish(ROOM_COUNT_CHANNEL, {"origin": self.origin, "thread_id": thread_id, "count": count})
+        except Exception as e:
+            print(f"⚠️ Could not publish connection count for {thread_id}: {e}")
+            return
+        if count:
+            self.published_counts[thread_id] = count
+        else:
+            self.published_counts.pop(thread_id, None)
+
+    def _on_remote_count(self, message: dict):
+        """Record another worker's connection count for a room."""
+        origin, thread_id = message.get("origin"), message.get("thread_id")
+        if origin == self.origin or thread_id is None:
+            return
+        counts = self.remote_counts.setdefault(thread_id, {})
+        if message.get("count"):
+            counts[origin] = (message["count"], time.monotonic())
+        else:
+            counts.pop(origin, None)
+            if not counts:
+                del self.remote_counts[thread_id]
 
     async def broadcast(self, thread_id: str, message: dict):
         """
-        Send a message to ALL clients connected to a room.
+        Send a message to ALL clients connected to a room, in any process.
 
         Args:
             thread_id: The room to broadcast to
             message: The message dict to send
         """
-        if thread_id not in self.active_connections:
-            return
-
         # Add timestamp if not present
         if "timestamp" not in message:
             message["timestamp"] = datetime.utcnow().isoformat()
 
-        async with self.lock:
-            # Store in history (except for stream chunks)
-            if message.get("type") not in ["bot_chunk"]:
-                self.room_history[thread_id].append(message)
+        await self.pubsub.publish(thread_id, message)
 
-            # Get connections snapshot
-            connections = list(self.active_connections[thread_id])
+    async def deliver(self, thread_id: str, message: dict):
+        """
+        Deliver a published message to this process's sockets in the room.
 
-        # Send to all connections (without holding lock)
-        disconnected = []
-        for conn in connections:
-            try:
-                await conn.send_json(message)
-            except Exception:
-                disconnected.append(conn)
-
-        # Clean up disconnected clients
-        if disconnected:
-            async with self.lock:
-                for conn in disconnected:
-                    self.active_connections[thread_id].discard(conn)
-
-    async def send_to_one(self, websocket: WebSocket, message: dict):
-        """Send a message to a specific client."""
+        Only queues the message on every connection; each connection's
+        writer task does the actual send.
+        """
+        handler = self.channel_handlers.get(thread_id)
+        if handler is not None:
+            handler(message)
+            return
+
+        if thread_id not in self.active_connections:
+            return
+
+        # No awaits from here on: seq, history, cache and fan-out happen
+        # atomically with respect to other coroutines, without taking a lock.
+        # The member set is immutable, so iterating it is safe even if
+        # someone joins.
+        stored = message.get("type") not in EPHEMERAL_TYPES
+        if stored:
+            # seq is the message's 1-based absolute position in room history
+            message["seq"] = self.history_total[thread_id] + 1
+
+        # Encode once for every socket in the room
+        encoded = dumps(message)
+
+        if stored:
+            self._append_history(thread_id, message, len(encoded))
+        if self.frame_cache_enabled and message.get("type") == "bot_complete":
+            self.frame_cache[thread_id] = (message, encoded)
+
+        connections = self.connections
+        for websocket in self.active_connections[thread_id]:
+            connection = connections.get(websocket)
+            if connection:
+                connection.enqueue(message, encoded)
+
+    async def send_to_one(self, websocket: WebSocket, message: dict, encoded: Optional[str] = None):
+        """Send a message to a specific client (in order with its broadcasts)."""
+        connection = self.connections.get(websocket)
+        if connection:
+            connection.enqueue(message, encoded)
+            return
         try:
-            await websocket.send_json(message)
+            await websocket.send_text(encoded if encoded is not None else dumps(message))
         except Exception:
             pass
 
+    def get_cached_frame(self, thread_id: str) -> Optional[Tuple[dict, str]]:
+        """Get the room's latest bot_complete as (message, encoded text), if cached."""
+        return self.frame_cache.get(thread_id)
+
+    def touch(self, websocket: WebSocket):
+        """Record activity from a client (any frame, including pong)."""
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return
+        connection.last_seen = time.monotonic()
+        room_presence = self.presence.get(connection.thread_id)
+        if room_presence is not None:
+            room_presence[connection.user_id] = time.time()
+
+    async def heartbeat(self, timeout: Optional[float] = None) -> int:
+        """
+        Ping every connection and reap the ones that went silent.
+
+        Returns:
+            Number of sockets reaped
+        """
+        timeout = HEARTBEAT_TIMEOUT if timeout is None else timeout
+        now = time.monotonic()
+        ping_text = dumps(PING_FRAME)
+        reaped = 0
+
+        for connection in list(self.connections.values()):
+            if now - connection.last_seen > timeout:
+                # Frees its queue and drops it from the room right away; the
+                # close makes the endpoint run its normal disconnect path
+                connection.close()
+                self._remove_dead(connection.thread_id, connection)
+                asyncio.create_task(connection.close_socket(HEARTBEAT_CLOSE_CODE))
+                reaped += 1
+            else:
+                connection.enqueue(PING_FRAME, ping_text)
+
+        # Forget users that have been offline for too long
+        wall_now = time.time()
+        for thread_id, room_presence in self.presence.items():
+            online = set(self.get_online_users(thread_id))
+            for user_id, last_seen in list(room_presence.items()):
+                if user_id not in online and wall_now - last_seen > PRESENCE_TTL:
+                    del room_presence[user_id]
+
+        self.sockets_reaped += reaped
+        if reaped:
+            print(f"💀 Reaped {reaped} unresponsive socket(s)")
+
+        # Keep other workers' view of our rooms fresh (and send the zeros
+        # left by reaped sockets), and forget counts from workers gone quiet
+        for thread_id in set(self.active_connections) | set(self.published_counts):
+            if self.get_connection_count(thread_id) or thread_id in self.published_counts:
+                await self._publish_count(thread_id)
+        for thread_id, counts in list(self.remote_counts.items()):
+            for origin, (_, received) in list(counts.items()):
+                if now - received > REMOTE_COUNT_TTL:
+                    del counts[origin]
+            if not counts:
+                del self.remote_counts[thread_id]
+        return reaped
+
+    async def run_heartbeat_loop(self, interval: float = HEARTBEAT_INTERVAL):
+        """Periodically ping clients and reap dead sockets (started on app startup)."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                print(f"⚠️ Heartbeat failed: {e}")
+
     def get_participants(self, thread_id: str) -> List[str]:
-        """Get list of participants in a room."""
-        return list(self.participants.get(thread_id, set()))
+        """Get users seen in a room recently (online or within PRESENCE_TTL)."""
+        return list(self.presence.get(thread_id, {}))
+
+    def get_presence(self, thread_id: str) -> List[dict]:
+        """Get every recently seen user with online status and last-seen time."""
+        online = set(self.get_online_users(thread_id))
+        return [
+            {
+                "user_id": user_id,
+                "online": user_id in online,
+                "last_seen": datetime.fromtimestamp(last_seen, timezone.utc).isoformat()
+            }
+            for user_id, last_seen in sorted(self.presence.get(thread_id, {}).items())
+        ]
 
     def get_connection_count(self, thread_id: str) -> int:
         """Get number of active connections in a room."""
         return len(self.active_connections.get(thread_id, set()))
 
+    def get_room_connection_count(self, thread_id: str) -> int:
+        """Get number of connections in a room across all workers."""
+        now = time.monotonic()
+        remote = sum(
+            count for count, received in self.remote_counts.get(thread_id, {}).values()
+            if now - received <= REMOTE_COUNT_TTL
+        )
+        return self.get_connection_count(thread_id) + remote
+
+    def get_online_users(self, thread_id: str) -> List[str]:
+        """Get users with at least one open connection in a room."""
+        return sorted({
+            self.connections[conn].user_id
+            for conn in self.active_connections.get(thread_id, set())
+            if conn in self.connections
+        })
+
+    def get_connection_stats(self, thread_id: str) -> List[dict]:
+        """Get send queue and lag metrics for every connection in a room."""
+        return [
+            self.connections[conn].get_stats()
+            for conn in self.active_connections.get(thread_id, set())
+            if conn in self.connections
+        ]
+
+    def get_stats(self) -> dict:
+        """Room and history gauges plus aggregate send metrics."""
+        stats = [conn.get_stats() for conn in self.connections.values()]
+        return {
+            "rooms": len(self.active_connections),
+            "idle_rooms": len(self.idle_since),
+            "rooms_evicted": self.rooms_evicted,
+            "history_messages": sum(len(h) for h in self.room_history.values()),
+            "history_bytes": self.history_bytes,
+            "cached_frames": len(self.frame_cache),
+            "connections": len(stats),
+            "sockets_reaped": self.sockets_reaped,
+            "queued": sum(s["queued"] for s in stats),
+            "dropped": sum(s["dropped"] for s in stats),
+            "coalesced": sum(s["coalesced"] for s in stats),
+            "max_lag_ms": max((s["max_lag_ms"] for s in stats), default=0.0),
+            "pubsub": self.pubsub.get_stats()
+        }
+
+    def _append_history(self, thread_id: str, message: dict, size: int):
+        """Add a message to the room's ring buffer, keeping the byte gauge in sync."""
+        history = self.room_history[thread_id]
+        sizes = self.history_sizes[thread_id]
+        if len(sizes) == sizes.maxlen:
+            # Oldest entry is about to fall off the ring
+            self.history_bytes -= sizes[0]
+        history.append(message)
+        sizes.append(size)
+        self.history_bytes += size
+        self.history_total[thread_id] += 1
+
+    async def evict_idle_rooms(self, ttl: Optional[float] = None) -> List[str]:
+        """
+        Drop rooms that have had no connections for at least `ttl` seconds.
+
+        Returns:
+            The evicted thread_ids
+        """
+        ttl = self.idle_ttl if ttl is None else ttl
+        now = time.monotonic()
+        evicted = []
+
+        for thread_id, since in list(self.idle_since.items()):
+            if now - since < ttl or self.active_connections.get(thread_id):
+                continue
+            # Someone is joining right now
+            if self._room_lock(thread_id).locked():
+                continue
+            self.history_bytes -= sum(self.history_sizes.get(thread_id, ()))
+            for room_dict in (self.active_connections, self.room_history, self.history_sizes,
+                              self.history_total, self.room_epochs, self.presence, self.idle_since,
+                              self.frame_cache, self.room_locks):
+                room_dict.pop(thread_id, None)
+            evicted.append(thread_id)
+
+        self.rooms_evicted += len(evicted)
+        if evicted:
+            print(f"🧹 Evicted {len(evicted)} idle room(s)")
+        return evicted
+
+    async def run_eviction_loop(self, interval: float = 60):
+        """Periodically evict idle rooms (started on app startup)."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle_rooms()
+            except Exception as e:
+                print(f"⚠️ Room eviction failed: {e}")
+
     def get_history(self, thread_id: str) -> List[dict]:
         """Get message history for a room."""
         return list(self.room_history.get(thread_id, []))
 
+    def get_history_page(
+        self,
+        thread_id: str,
+        before: Optional[int] = None,
+        limit: int = SNAPSHOT_HISTORY_LIMIT
+    ) -> dict:
+        """
+        Get a page of room history, newest last.
+
+        Args:
+            thread_id: The room identifier
+            before: Cursor from a previous page (None = most recent)
+            limit: Max messages in the page
+
+        Returns:
+            {"messages": [...], "before": cursor for the next older page, or None}
+        """
+        # Values come straight from client frames
+        if not isinstance(before, int):
+            before = None
+        if not isinstance(limit, int):
+            limit = SNAPSHOT_HISTORY_LIMIT
+        return self._history_page(thread_id, before, min(max(limit, 1), MAX_HISTORY_PAGE))
+
+    def get_frames_since(
+        self,
+        thread_id: str,
+        last_seq: Optional[int],
+        epoch: Optional[str]
+    ) -> Optional[List[dict]]:
+        """
+        Get the stored frames after `last_seq`, for resuming a session.
+
+        Returns:
+            The missed frames in order (possibly empty), or None if the
+            client can't resume: unknown room, a seq from another epoch
+            (server restart or evicted room), or frames already dropped
+            from the ring buffer.
+        """
+        if not isinstance(last_seq, int) or last_seq < 0:
+            return None
+        if thread_id not in self.room_history or epoch != self.room_epochs.get(thread_id):
+            return None
+        history = self.room_history[thread_id]
+        total = self.history_total[thread_id]
+        first_seq = total - len(history) + 1
+        if last_seq > total or last_seq + 1 < first_seq:
+            return None
+        return list(islice(history, last_seq + 1 - first_seq, None))
+
+    def _history_page(self, thread_id: str, before: Optional[int], limit: int) -> dict:
+        history = self.room_history.get(thread_id, ())
+        total = self.history_total.get(thread_id, 0)
+        # Cursors are absolute indexes; anything before `first` left the ring
+        first = total - len(history)
+        end = total if before is None else max(first, min(before, total))
+        start = max(first, end - limit)
+        return {
+            "messages": list(islice(history, start - first, end - first)),
+            "before": start if start > first else None
+        }
+
 
 # Global instance
 room_manager = RoomManager()
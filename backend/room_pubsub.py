@@ -0,0 +1,245 @@
+"""
+Room Pub/Sub Backends
+
+RoomManager.broadcast publishes every room message through one of these
+backends, and each backend hands messages to the local RoomManager of every
+process that holds sockets for the room:
+
+- InProcessPubSub: single process, delivers directly (default).
+- PostgresPubSub: LISTEN/NOTIFY on SUPABASE_DB_URL, so the WhatsApp webhook
+  served by one uvicorn worker reaches sockets held by another.
+
+Select with ROOM_PUBSUB=postgres. Needs a direct (session) connection;
+the transaction pooler on port 6543 doesn't support LISTEN.
+"""
+
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import itertools
+import json
+import os
+import time
+import uuid
+
+ROOM_PUBSUB = os.getenv("ROOM_PUBSUB", "memory").lower()
+SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL")
+
+# Postgres channel shared by all workers
+PUBSUB_CHANNEL = "journi_rooms"
+# NOTIFY payloads must stay under 8000 bytes; larger messages are split
+MAX_NOTIFY_PART = 7500
+
+DeliverHandler = Callable[[str, dict], Awaitable[None]]
+
+
+class InProcessPubSub:
+    """Delivers room messages to the RoomManager in this process."""
+
+    def __init__(self, handler: Optional[DeliverHandler] = None):
+        self.handler = handler
+
+    async def start(self, handler: DeliverHandler):
+        """Register the local delivery handler."""
+        self.handler = handler
+
+    async def publish(self, thread_id: str, message: dict):
+        """Deliver a message to this process's sockets."""
+        if self.handler:
+            await self.handler(thread_id, message)
+
+    async def close(self):
+        pass
+
+    def get_stats(self) -> dict:
+        return {"backend": "memory"}
+
+
+def encode_notify_parts(origin: str, msg_id: int, thread_id: str, message: dict) -> List[str]:
+    """
+    Encode a room message as one or more NOTIFY payloads.
+
+    Each part is "origin:msg_id:index:count:" followed by a slice of the
+    ASCII-only JSON body, so part length in characters equals bytes.
+    """
+    body = json.dumps({"thread_id": thread_id, "message": message}, ensure_ascii=True, default=str)
+    slices = [body[i:i + MAX_NOTIFY_PART] for i in range(0, len(body), MAX_NOTIFY_PART)] or [""]
+    return [f"{origin}:{msg_id}:{idx}:{len(slices)}:{part}" for idx, part in enumerate(slices)]
+
+
+class NotifyAssembler:
+    """Reassembles split NOTIFY payloads into room messages."""
+
+    # Incomplete messages older than this are discarded (publisher died mid-send)
+    PARTIAL_TTL = 30.0
+
+    def __init__(self):
+        # (origin, msg_id) -> (first_seen, parts)
+        self.partials: Dict[Tuple[str, str], Tuple[float, List[Optional[str]]]] = {}
+
+    def feed(self, payload: str) -> Optional[Tuple[str, str, dict]]:
+        """
+        Add one NOTIFY payload.
+
+        Returns:
+            (origin, thread_id, message) once all parts have arrived, else None
+        """
+        origin, msg_id, idx, count, part = payload.split(":", 4)
+        idx, count = int(idx), int(count)
+
+        if count == 1:
+            body = part
+        else:
+            key = (origin, msg_id)
+            first_seen, parts = self.partials.setdefault(key, (time.monotonic(), [None] * count))
+            parts[idx] = part
+            if any(p is None for p in parts):
+                self._prune()
+                return None
+            del self.partials[key]
+            body = "".join(parts)
+
+        data = json.loads(body)
+        return origin, data["thread_id"], data["message"]
+
+    def _prune(self):
+        now = time.monotonic()
+        for key, (first_seen, _) in list(self.partials.items()):
+            if now - first_seen > self.PARTIAL_TTL:
+                del self.partials[key]
+
+
+class PostgresPubSub:
+    """
+    Fan-out across processes with Postgres LISTEN/NOTIFY.
+
+    Messages are delivered to local sockets right away and NOTIFY'd to the
+    other processes by a sender task, so a broadcast never waits on a
+    database round trip. Each process ignores its own notifications.
+    """
+
+    def __init__(self, dsn: str, channel: str = PUBSUB_CHANNEL):
+        self.dsn = dsn
+        self.channel = channel
+        # Identifies this process's notifications
+        self.origin = uuid.uuid4().hex[:12]
+        self.handler: Optional[DeliverHandler] = None
+        self._msg_ids = itertools.count()
+        self._assembler = NotifyAssembler()
+        self._publish_conn = None
+        # NOTIFY payloads waiting for the sender task, in publish order
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._listener: Optional[asyncio.Task] = None
+        self._sender: Optional[asyncio.Task] = None
+        # Stats
+        self.published = 0
+        self.received = 0
+        self.errors = 0
+
+    async def start(self, handler: DeliverHandler):
+        """Register the local handler and start listening."""
+        self.handler = handler
+        self._listener = asyncio.create_task(self._listen())
+        self._sender = asyncio.create_task(self._send_loop())
+
+    async def _connect(self):
+        import psycopg
+        return await psycopg.AsyncConnection.connect(self.dsn, autocommit=True)
+
+    async def _listen(self):
+        """Listener loop; reconnects with backoff if the connection drops."""
+        backoff = 1.0
+        while True:
+            try:
+                conn = await self._connect()
+                try:
+                    await conn.execute(f"LISTEN {self.channel}")
+                    print(f"📡 Room pub/sub listening on '{self.channel}' (origin {self.origin})")
+                    backoff = 1.0
+                    async for notify in conn.notifies():
+                        await self._on_notify(notify.payload)
+                finally:
+                    await conn.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Room pub/sub listener error: {e} (retrying in {backoff:.0f}s)")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    async def _on_notify(self, payload: str):
+        try:
+            assembled = self._assembler.feed(payload)
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Bad room pub/sub payload: {e}")
+            return
+        if assembled is None:
+            return
+
+        origin, thread_id, message = assembled
+        if origin == self.origin:
+            return  # Already delivered locally
+        self.received += 1
+        if self.handler:
+            await self.handler(thread_id, message)
+
+    async def publish(self, thread_id: str, message: dict):
+        """Deliver locally and queue a NOTIFY for the other processes."""
+        if self.handler:
+            await self.handler(thread_id, message)
+
+        self._outbox.put_nowait(encode_notify_parts(self.origin, next(self._msg_ids), thread_id, message))
+        self.published += 1
+
+    async def _send_loop(self):
+        """Send queued payloads, batching everything queued into one statement."""
+        while True:
+            payloads = list(await self._outbox.get())
+            while not self._outbox.empty():
+                payloads.extend(self._outbox.get_nowait())
+            try:
+                if self._publish_conn is None or self._publish_conn.closed:
+                    self._publish_conn = await self._connect()
+                # One statement = one transaction: delivered together and in order
+                await self._publish_conn.execute(
+                    "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+                    (self.channel, payloads)
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Room pub/sub publish failed ({len(payloads)} payloads dropped): {e}")
+
+    async def close(self):
+        for task in (self._listener, self._sender):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        if self._publish_conn is not None:
+            await self._publish_conn.close()
+            self._publish_conn = None
+
+    def get_stats(self) -> dict:
+        return {
+            "backend": "postgres",
+            "origin": self.origin,
+            "published": self.published,
+            "outbox": self._outbox.qsize(),
+            "received": self.received,
+            "errors": self.errors,
+            "pending_partials": len(self._assembler.partials)
+        }
+
+
+def create_pubsub():
+    """Create the pub/sub backend selected by ROOM_PUBSUB."""
+    if ROOM_PUBSUB == "postgres":
+        if SUPABASE_DB_URL:
+            return PostgresPubSub(SUPABASE_DB_URL)
+        print("⚠️ ROOM_PUBSUB=postgres but SUPABASE_DB_URL is not set, using in-process pub/sub")
+    return InProcessPubSub()
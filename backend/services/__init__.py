@@ -1,9 +1,13 @@
 """Services module for Journi."""
 from .supabase_storage import SupabaseStorage, get_storage
 from .supabase_db import SupabaseDB, get_db
-from .supabase_client import get_supabase_client
+from .supabase_client import get_supabase_client, get_async_client, close_async_client
+from .trip_resolver import TripResolver, get_trip_resolver
+from .trip_cache import TripCache, get_trip_cache, TRIP_CACHE_CHANNEL
+from .pagination import InvalidPageRequest
 from . import session_service
 from . import auth_service
+from . import ledger_service
 
 __all__ = [
     "SupabaseStorage",
@@ -11,6 +15,15 @@ __all__ = [
     "SupabaseDB",
     "get_db",
     "get_supabase_client",
+    "get_async_client",
+    "close_async_client",
+    "TripResolver",
+    "get_trip_resolver",
+    "TripCache",
+    "get_trip_cache",
+    "TRIP_CACHE_CHANNEL",
+    "InvalidPageRequest",
     "session_service",
-    "auth_service"
+    "auth_service",
+    "ledger_service"
 ]
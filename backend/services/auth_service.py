@@ -12,7 +12,7 @@ from typing import Optional
 from dataclasses import dataclass
 from dotenv import load_dotenv
 
-from .supabase_client import get_supabase_client
+from .supabase_client import get_async_client
 
 load_dotenv()
 
@@ -82,7 +82,7 @@ async def create_anonymous_token(trip_id: int, display_name: str) -> str:
     Returns:
         UUID token that can be used to authenticate WebSocket connections
     """
-    supabase = get_supabase_client()
+    supabase = get_async_client()
 
     token = str(uuid.uuid4())
     expires_at = datetime.utcnow() + timedelta(days=7)
@@ -90,7 +90,7 @@ async def create_anonymous_token(trip_id: int, display_name: str) -> str:
     # Insert into anonymous_sessions table
     # Note: This table needs to be created via migration 006
     try:
-        supabase.table("anonymous_sessions").insert({
+        await supabase.table("anonymous_sessions").insert({
             "id": token,
             "trip_id": trip_id,
             "display_name": display_name,
@@ -114,10 +114,10 @@ async def verify_anonymous_token(token: str) -> Optional[tuple[int, str]]:
     Returns:
         Tuple of (trip_id, display_name) if valid, None if invalid/expired
     """
-    supabase = get_supabase_client()
+    supabase = get_async_client()
 
     try:
-        result = supabase.table("anonymous_sessions").select(
+        result = await supabase.table("anonymous_sessions").select(
             "trip_id, display_name, expires_at"
         ).eq("id", token).execute()
 
@@ -132,7 +132,7 @@ async def verify_anonymous_token(token: str) -> Optional[tuple[int, str]]:
             return None
 
         # Update last_active_at
-        supabase.table("anonymous_sessions").update({
+        await supabase.table("anonymous_sessions").update({
             "last_active_at": datetime.utcnow().isoformat()
         }).eq("id", token).execute()
 
@@ -185,11 +185,11 @@ async def link_anonymous_to_account(anonymous_token: str, user_id: str) -> bool:
     Returns:
         True if linked successfully
     """
-    supabase = get_supabase_client()
+    supabase = get_async_client()
 
     try:
         # Get anonymous session info
-        result = supabase.table("anonymous_sessions").select(
+        result = await supabase.table("anonymous_sessions").select(
             "trip_id"
         ).eq("id", anonymous_token).execute()
 
@@ -203,7 +203,7 @@ async def link_anonymous_to_account(anonymous_token: str, user_id: str) -> bool:
         await session_service.add_participant(trip_id, user_id)
 
         # Delete anonymous session
-        supabase.table("anonymous_sessions").delete().eq("id", anonymous_token).execute()
+        await supabase.table("anonymous_sessions").delete().eq("id", anonymous_token).execute()
 
         return True
 
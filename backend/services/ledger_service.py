@@ -0,0 +1,154 @@
+"""
+Ledger Mirror Service
+
+The expense ledger lives in LangGraph state (checkpoints). This module
+mirrors it into the `expenses` / `expense_splits` tables (migration 013)
+so reports read indexed SQL aggregates instead of loading checkpoints:
+
+- `ledger_entries` turns a state's expenses and payments into rows with
+  explicit per-person splits (in cents, so they add up exactly)
+- `sync_trip_ledger` replaces a trip's mirrored rows with that snapshot
+  in one transaction; the outbox worker calls it after ledger changes
+- `get_trip_balances` / `get_trip_totals` read the aggregate views
+
+A payment is stored as an entry paid by the sender and split entirely to
+the receiver, which moves both balances the same way the agent does.
+"""
+
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+from typing import Dict, List, Optional
+
+from .supabase_client import get_async_client
+
+CENT = Decimal("0.01")
+
+
+def _cents(amount) -> Decimal:
+    return Decimal(str(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def split_equally(amount, people: List[str]) -> List[Dict]:
+    """Split an amount in cents; leftover cents go to the first people."""
+    total = _cents(amount)
+    share = (total / len(people)).quantize(CENT, rounding=ROUND_DOWN)
+    leftover = int((total - share * len(people)) / CENT)
+    return [
+        {"person_name": person, "amount": str(share + (CENT if i < leftover else 0))}
+        for i, person in enumerate(people)
+    ]
+
+
+def ledger_entries(expenses: List[dict], payments: List[dict]) -> List[dict]:
+    """
+    Rows for sync_trip_ledger from a state's expenses and payments.
+
+    Args:
+        expenses: State expenses (paid_by, split_among, optional split_amounts)
+        payments: State payments (from_user, to_user)
+
+    Returns:
+        Entries {ledger_id, kind, description, amount, currency, paid_by_name,
+        splits: [{person_name, amount}]}; amounts are decimal strings
+    """
+    entries = []
+    for expense in expenses:
+        people = expense.get("split_among") or []
+        if not people or not expense.get("amount") or expense["amount"] <= 0:
+            continue
+        split_amounts = expense.get("split_amounts")
+        if split_amounts:
+            splits = [{"person_name": p, "amount": str(_cents(a))} for p, a in split_amounts.items()]
+        else:
+            splits = split_equally(expense["amount"], people)
+        entries.append({
+            "ledger_id": expense["id"],
+            "kind": "expense",
+            "description": expense.get("description") or "",
+            "amount": str(_cents(expense["amount"])),
+            "currency": expense.get("currency", "PEN"),
+            "paid_by_name": expense["paid_by"],
+            "splits": splits,
+        })
+
+    for payment in payments:
+        if not payment.get("amount") or payment["amount"] <= 0:
+            continue
+        amount = str(_cents(payment["amount"]))
+        entries.append({
+            "ledger_id": payment["id"],
+            "kind": "payment",
+            "description": f"Pago de {payment['from_user']} a {payment['to_user']}",
+            "amount": amount,
+            "currency": payment.get("currency", "PEN"),
+            "paid_by_name": payment["from_user"],
+            "splits": [{"person_name": payment["to_user"], "amount": amount}],
+        })
+
+    return entries
+
+
+async def sync_trip_ledger(trip_id: int, version: int, entries: List[dict]) -> bool:
+    """
+    Replace a trip's mirrored ledger with a snapshot (raises on failure).
+
+    Args:
+        trip_id: Trip the ledger belongs to
+        version: Snapshot ordering token (enqueue time in microseconds);
+            the database ignores snapshots older than the last one applied
+        entries: Rows from ledger_entries()
+
+    Returns:
+        True if applied, False if a newer snapshot was already there
+    """
+    result = await get_async_client().rpc("sync_trip_ledger", {
+        "p_trip_id": trip_id,
+        "p_version": version,
+        "p_entries": entries
+    }).execute()
+    return bool(result.data)
+
+
+async def get_trip_balances(trip_id: int) -> Dict[str, Dict[str, float]]:
+    """
+    Per-person, per-currency balances from the trip_ledger_balances view.
+
+    Returns:
+        {person: {currency: balance}}; positive means they are owed money
+    """
+    result = await get_async_client().table("trip_ledger_balances").select(
+        "person,currency,balance"
+    ).eq("trip_id", trip_id).execute()
+
+    balances: Dict[str, Dict[str, float]] = {}
+    for row in result.data or []:
+        balances.setdefault(row["person"], {})[row["currency"]] = float(row["balance"])
+    return balances
+
+
+async def get_trip_totals(trip_id: int) -> Dict[str, Dict[str, float]]:
+    """
+    Spending per currency from the trip_ledger_totals view.
+
+    Returns:
+        {currency: {"total_spent", "expense_count", "payment_count"}}
+    """
+    result = await get_async_client().table("trip_ledger_totals").select(
+        "currency,total_spent,expense_count,payment_count"
+    ).eq("trip_id", trip_id).execute()
+
+    return {
+        row["currency"]: {
+            "total_spent": float(row["total_spent"]),
+            "expense_count": row["expense_count"],
+            "payment_count": row["payment_count"],
+        }
+        for row in result.data or []
+    }
+
+
+async def get_last_sync(trip_id: int) -> Optional[str]:
+    """When the trip's ledger mirror was last updated (ISO timestamp), or None."""
+    result = await get_async_client().table("trip_ledger_sync").select(
+        "synced_at"
+    ).eq("trip_id", trip_id).execute()
+    return result.data[0]["synced_at"] if result.data else None
@@ -0,0 +1,127 @@
+"""
+Keyset Pagination Helpers
+
+Listings are ordered by (created_at, id), newest first unless stated
+otherwise, and paged with an opaque cursor holding the last row's key, so
+page N costs the same as page 1 (no OFFSET scan) and rows inserted
+meanwhile don't shift later pages.
+
+Usage:
+    query = keyset(db.table("trips").select(columns).eq(...), cursor, limit)
+    rows, next_cursor = page_of((await query.execute()).data, limit)
+"""
+
+from typing import Iterable, List, Optional, Tuple
+import base64
+import json
+import os
+
+# Page size when the caller doesn't ask for one
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+# Largest page a caller can ask for
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+
+
+class InvalidPageRequest(ValueError):
+    """Cursor not produced by `encode_cursor`, or unknown fields requested."""
+
+
+def encode_cursor(row: dict) -> str:
+    """Opaque cursor pointing just after `row`."""
+    key = json.dumps([row["created_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """(created_at, id) from a cursor. Raises InvalidPageRequest."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError) as e:
+        raise InvalidPageRequest("Invalid cursor") from e
+    if not isinstance(created_at, str) or not isinstance(row_id, int):
+        raise InvalidPageRequest("Invalid cursor")
+    return created_at, row_id
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    """Page size within 1..MAX_PAGE_SIZE."""
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def apply_cursor(query, cursor: Optional[str], desc: bool = True):
+    """
+    Restrict a (created_at, id) ordered query to rows after the cursor.
+
+    Args:
+        query: PostgREST filter builder
+        cursor: Cursor from a previous page, or None for the first page
+        desc: Whether the query is ordered newest first
+
+    Returns:
+        The query with the keyset filter added
+    """
+    if not cursor:
+        return query
+    created_at, row_id = decode_cursor(cursor)
+    op = "lt" if desc else "gt"
+    # Quoted: timestamps contain ':' '.' and '+', reserved in or=() syntax
+    return query.or_(
+        f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}.{row_id})'
+    )
+
+
+def keyset(query, cursor: Optional[str], limit: int, desc: bool = True):
+    """
+    Order by (created_at, id), skip to the cursor and fetch one row past the page.
+
+    Args:
+        query: PostgREST filter builder with the listing's filters applied
+        cursor: Cursor from a previous page, or None for the first page
+        limit: Page size (already clamped); page_of() trims the extra row
+        desc: Newest first (default) or oldest first
+
+    Returns:
+        The query, ready to execute
+    """
+    query = query.order("created_at", desc=desc).order("id", desc=desc)
+    return apply_cursor(query, cursor, desc).limit(limit + 1)
+
+
+def page_of(rows: List[dict], limit: int) -> Tuple[List[dict], Optional[str]]:
+    """
+    Split a `limit + 1` result into the page and the next cursor.
+
+    Returns:
+        (rows, next_cursor); next_cursor is None on the last page
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def select_columns(fields: Optional[Iterable[str]], allowed: Iterable[str], default: str) -> str:
+    """
+    PostgREST select list for the requested fields.
+
+    Args:
+        fields: Requested column names (None for the default set)
+        allowed: Columns callers may ask for
+        default: Select list used when no fields are requested
+
+    Returns:
+        Comma-separated select list; created_at and id are always included
+        since the cursor is built from them. Raises InvalidPageRequest on
+        unknown fields.
+    """
+    if not fields:
+        return default
+    allowed = set(allowed)
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise InvalidPageRequest(f"Unknown fields: {', '.join(unknown)}")
+    columns = ["id", "created_at"] + [f for f in fields if f not in ("id", "created_at")]
+    return ",".join(dict.fromkeys(columns))
@@ -1,12 +1,41 @@
 """
 Session/Trip Service
 
-CRUD operations for trips using Supabase.
+CRUD operations for trips using Supabase (async PostgREST client).
+
+Trip records and participant checks are served from the trip cache when
+possible; every write here updates or invalidates it (see trip_cache.py).
 """
 
 from datetime import date
 from typing import Optional, List
-from .supabase_client import get_supabase_client
+from postgrest.exceptions import APIError
+from .supabase_client import get_async_client
+from .trip_resolver import get_trip_resolver
+from .trip_cache import get_trip_cache, MISSING
+from .single_flight import SingleFlight
+from .pagination import keyset, clamp_limit, page_of, select_columns
+
+# Trip columns callers may ask for in listings
+TRIP_COLUMNS = (
+    "id", "creator_id", "name", "subtitle", "location", "start_date", "end_date",
+    "cover_image_url", "session_code", "status", "created_at", "updated_at"
+)
+# What the dashboard list shows when no fields are requested
+TRIP_LIST_COLUMNS = (
+    "id,name,subtitle,session_code,location,start_date,end_date,status,"
+    "cover_image_url,creator_id,created_at,updated_at"
+)
+# What the public join page shows (participant_count is maintained by migration 014)
+PUBLIC_CARD_COLUMNS = "id,name,start_date,end_date,location,status,participant_count"
+
+
+# Set once the create_trip_with_creator RPC turns out not to be deployed
+_create_rpc_missing = False
+# Set once trips.participant_count turns out not to exist (migration 014 not applied)
+_participant_count_missing = False
+# Public card lookups in flight, shared by concurrent callers for a code
+_card_flights = SingleFlight()
 
 
 async def create_trip(
@@ -19,6 +48,10 @@ async def create_trip(
     """
     Create a new trip with a unique session code.
 
+    One RPC (migration 009) generates the code and inserts the trip and
+    the creator's admin membership in a single transaction. Databases
+    without the function fall back to the old three-request path.
+
     Args:
         creator_id: UUID of the authenticated user creating the trip
         name: Name of the trip
@@ -29,10 +62,49 @@ async def create_trip(
     Returns:
         Created trip record including generated session_code
     """
-    supabase = get_supabase_client()
+    global _create_rpc_missing
+    db = get_async_client()
+
+    trip = None
+    if not _create_rpc_missing:
+        try:
+            result = await db.rpc("create_trip_with_creator", {
+                "p_creator_id": creator_id,
+                "p_name": name,
+                "p_start_date": start_date.isoformat(),
+                "p_end_date": end_date.isoformat(),
+                "p_location": location
+            }).execute()
+            trip = result.data["trip"]
+        except APIError as e:
+            # PGRST202: function not found (migration 009 not applied)
+            if e.code != "PGRST202":
+                raise
+            print("Note: create_trip_with_creator not deployed, using separate inserts")
+            _create_rpc_missing = True
+
+    if trip is None:
+        trip = await _create_trip_separately(db, creator_id, name, start_date, end_date, location)
+
+    # The room for this code will ask for its trip_id on the first message
+    get_trip_resolver().remember(trip["session_code"], trip["id"])
+    get_trip_cache().put_trip(trip)
+    get_trip_cache().put_member(trip["id"], creator_id, True)
+
+    return trip
+
 
+async def _create_trip_separately(
+    db,
+    creator_id: str,
+    name: str,
+    start_date: date,
+    end_date: date,
+    location: Optional[str]
+) -> dict:
+    """Pre-009 creation: code, trip and membership as three requests."""
     # Generate unique session code using database function
-    code_result = supabase.rpc('generate_session_code').execute()
+    code_result = await db.rpc('generate_session_code', {}).execute()
     session_code = code_result.data
 
     # Insert trip
@@ -46,11 +118,11 @@ async def create_trip(
         "status": "active"
     }
 
-    result = supabase.table("trips").insert(trip_data).execute()
+    result = await db.table("trips").insert(trip_data).execute()
     trip = result.data[0]
 
     # Add creator as admin participant
-    supabase.table("trip_participants").insert({
+    await db.table("trip_participants").insert({
         "trip_id": trip["id"],
         "user_id": creator_id,
         "role": "admin"
@@ -59,57 +131,172 @@ async def create_trip(
     return trip
 
 
-async def get_trip_by_id(trip_id: int) -> Optional[dict]:
-    """Get trip by ID."""
-    supabase = get_supabase_client()
+async def get_trip_by_id(trip_id: int, fresh: bool = False) -> Optional[dict]:
+    """
+    Get trip by ID.
+
+    Args:
+        trip_id: Trip to read
+        fresh: Read from the database even if cached. The cache only sees
+            this process's writes, so checks that gate a status change
+            (join, finalize) must not trust it.
+    """
+    if not fresh:
+        cached = get_trip_cache().get_trip(trip_id)
+        if cached is not MISSING:
+            return cached
+
+    db = get_async_client()
 
-    result = supabase.table("trips").select("*").eq("id", trip_id).execute()
+    result = await db.table("trips").select("*").eq("id", trip_id).execute()
 
     if result.data:
-        return result.data[0]
+        trip = result.data[0]
+        get_trip_resolver().remember(trip.get("session_code"), trip["id"])
+        get_trip_cache().put_trip(trip)
+        return trip
     return None
 
 
 async def get_trip_by_code(session_code: str) -> Optional[dict]:
     """Get trip by session code (case-insensitive)."""
-    supabase = get_supabase_client()
+    db = get_async_client()
 
-    result = supabase.table("trips").select("*").eq(
+    result = await db.table("trips").select("*").eq(
         "session_code", session_code.upper()
     ).execute()
 
     if result.data:
-        return result.data[0]
+        trip = result.data[0]
+        # Joining goes through here: warm the resolver for the room
+        get_trip_resolver().remember(trip.get("session_code"), trip["id"])
+        get_trip_cache().put_trip(trip)
+        return trip
     return None
 
 
-async def get_user_trips(user_id: str) -> List[dict]:
-    """Get all trips for a user (as participant or creator)."""
-    supabase = get_supabase_client()
+async def get_user_trips(
+    user_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    with_total: bool = False
+) -> dict:
+    """
+    Get a page of the trips the user participates in, newest first.
 
-    # Get trip IDs where user is a participant
-    participants_result = supabase.table("trip_participants").select(
-        "trip_id"
-    ).eq("user_id", user_id).execute()
+    One query: trips inner-joined with the user's trip_participants rows.
+    Creators are included because trip creation adds them as participants.
+
+    Args:
+        user_id: User whose trips to list
+        limit: Page size (default DEFAULT_PAGE_SIZE, capped at MAX_PAGE_SIZE)
+        cursor: next_cursor from the previous page
+        status: Only trips with this status
+        fields: Trip columns to return (default TRIP_LIST_COLUMNS)
+        with_total: Also count all the user's trips (matching status)
+
+    Returns:
+        {"trips": [...], "next_cursor": str or None, "total": int or None}.
+        Raises InvalidPageRequest for a bad cursor or unknown fields.
+    """
+    db = get_async_client()
+    limit = clamp_limit(limit)
+    columns = select_columns(fields, TRIP_COLUMNS, TRIP_LIST_COLUMNS)
+
+    query = db.table("trips").select(
+        f"{columns},trip_participants!inner(user_id)",
+        count="exact" if with_total else None
+    ).eq("trip_participants.user_id", user_id)
+    if status:
+        query = query.eq("status", status)
+
+    result = await keyset(query, cursor, limit).execute()
+    trips, next_cursor = page_of(result.data, limit)
+    for trip in trips:
+        trip.pop("trip_participants", None)
+
+    return {"trips": trips, "next_cursor": next_cursor, "total": result.count if with_total else None}
 
-    if not participants_result.data:
-        return []
 
-    trip_ids = [p["trip_id"] for p in participants_result.data]
+async def get_public_trip_card(session_code: str) -> Optional[dict]:
+    """
+    Public info for the join page, from the trip cache when possible.
+
+    A miss is one single-row query (participant_count is a maintained
+    column), shared by concurrent callers for the same code.
 
-    # Get trip details
-    trips_result = supabase.table("trips").select("*").in_(
-        "id", trip_ids
-    ).order("created_at", desc=True).execute()
+    Args:
+        session_code: Session code (case-insensitive)
 
-    return trips_result.data
+    Returns:
+        {id, name, start_date, end_date, location, status, participant_count},
+        or None if no trip uses the code
+    """
+    code = session_code.upper()
+    cached = get_trip_cache().get_card(code)
+    if cached is not MISSING:
+        return cached
+
+    card = await _card_flights.do(code, lambda: _load_public_trip_card(code))
+    return dict(card) if card else None
+
+
+async def _load_public_trip_card(session_code: str) -> Optional[dict]:
+    """Fetch a card and cache it (run once per code by get_public_trip_card)."""
+    card = await _fetch_public_trip_card(session_code)
+    get_trip_cache().put_card(session_code, card)
+    if card:
+        get_trip_resolver().remember(session_code, card["id"])
+    return card
+
+
+def _count_column_missing(e: APIError) -> bool:
+    """Whether e means trips.participant_count doesn't exist (remembered)."""
+    global _participant_count_missing
+    # 42703: undefined column (migration 014 not applied)
+    if e.code != "42703":
+        return False
+    print("Note: trips.participant_count not deployed, counting participants")
+    _participant_count_missing = True
+    return True
+
+
+async def _fetch_public_trip_card(session_code: str) -> Optional[dict]:
+    db = get_async_client()
+
+    if not _participant_count_missing:
+        try:
+            result = await db.table("trips").select(PUBLIC_CARD_COLUMNS).eq(
+                "session_code", session_code
+            ).execute()
+            return result.data[0] if result.data else None
+        except APIError as e:
+            if not _count_column_missing(e):
+                raise
+
+    trip = await get_trip_by_code(session_code)
+    if not trip:
+        return None
+    card = {key: trip.get(key) for key in PUBLIC_CARD_COLUMNS.split(",")}
+    card["participant_count"] = await get_participant_count(trip["id"])
+    return card
 
 
 async def get_participant_count(trip_id: int) -> int:
     """Get number of participants in a trip."""
-    supabase = get_supabase_client()
+    db = get_async_client()
 
-    result = supabase.table("trip_participants").select(
+    if not _participant_count_missing:
+        try:
+            result = await db.table("trips").select("participant_count").eq("id", trip_id).execute()
+            return result.data[0]["participant_count"] if result.data else 0
+        except APIError as e:
+            if not _count_column_missing(e):
+                raise
+
+    result = await db.table("trip_participants").select(
         "id", count="exact"
     ).eq("trip_id", trip_id).execute()
 
@@ -118,48 +305,64 @@ async def get_participant_count(trip_id: int) -> int:
 
 async def is_participant(trip_id: int, user_id: str) -> bool:
     """Check if user is a participant in the trip."""
-    supabase = get_supabase_client()
+    cached = get_trip_cache().get_member(trip_id, user_id)
+    if cached is not MISSING:
+        return cached
+
+    db = get_async_client()
 
-    result = supabase.table("trip_participants").select("id").eq(
+    result = await db.table("trip_participants").select("id").eq(
         "trip_id", trip_id
     ).eq("user_id", user_id).execute()
 
-    return len(result.data) > 0
+    is_member = len(result.data) > 0
+    get_trip_cache().put_member(trip_id, user_id, is_member)
+    return is_member
 
 
 async def add_participant(trip_id: int, user_id: str, role: str = "member") -> dict:
     """Add a user as participant to a trip."""
-    supabase = get_supabase_client()
+    db = get_async_client()
 
     # Check if already a participant
-    existing = supabase.table("trip_participants").select("id").eq(
+    existing = await db.table("trip_participants").select("id").eq(
         "trip_id", trip_id
     ).eq("user_id", user_id).execute()
 
     if existing.data:
+        get_trip_cache().put_member(trip_id, user_id, True)
         return existing.data[0]
 
-    result = supabase.table("trip_participants").insert({
+    # The count on trips is bumped by a trigger in the same transaction (migration 014)
+    result = await db.table("trip_participants").insert({
         "trip_id": trip_id,
         "user_id": user_id,
         "role": role
     }).execute()
 
+    get_trip_cache().put_member(trip_id, user_id, True)
+    get_trip_cache().invalidate_card(trip_id)
+    await get_trip_cache().announce(trip_id)
     return result.data[0]
 
 
 async def delete_trip(trip_id: int) -> bool:
     """Delete a trip (cascades to participants, etc.)."""
-    supabase = get_supabase_client()
+    db = get_async_client()
+
+    result = await db.table("trips").delete().eq("id", trip_id).execute()
 
-    result = supabase.table("trips").delete().eq("id", trip_id).execute()
+    get_trip_cache().invalidate_trip(trip_id)
+    await get_trip_cache().announce(trip_id)
+    for trip in result.data:
+        get_trip_resolver().forget(trip.get("session_code"))
 
     return len(result.data) > 0
 
 
 async def update_trip(trip_id: int, **updates) -> Optional[dict]:
     """Update trip fields."""
-    supabase = get_supabase_client()
+    db = get_async_client()
 
     # Filter out None values
     updates = {k: v for k, v in updates.items() if v is not None}
@@ -167,10 +370,15 @@ async def update_trip(trip_id: int, **updates) -> Optional[dict]:
     if not updates:
         return await get_trip_by_id(trip_id)
 
-    result = supabase.table("trips").update(updates).eq("id", trip_id).execute()
+    result = await db.table("trips").update(updates).eq("id", trip_id).execute()
 
+    get_trip_cache().invalidate_card(trip_id)
+    await get_trip_cache().announce(trip_id)
     if result.data:
+        get_trip_cache().put_trip(result.data[0])
         return result.data[0]
+    # Nothing updated (trip gone?): don't keep serving the old record
+    get_trip_cache().invalidate_trip(trip_id)
     return None
 
 
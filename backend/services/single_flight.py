@@ -0,0 +1,62 @@
+"""
+Single-Flight Calls
+
+Concurrent callers that miss a cache for the same key share one in-flight
+call instead of each querying the database: a burst of chat turns
+resolving one session code (trip_resolver.py), or a whole group opening
+the same invite link (the public trip card in session_service.py).
+"""
+
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        # key -> call in flight, awaited by concurrent callers
+        self.inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether a call for key is in flight (callers joining it count as hits)."""
+        return key in self.inflight
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run fn() for key, or wait for the call already running for it.
+
+        Errors reach every caller and are not remembered: the next call
+        after a failure runs fn() again. If the running call is cancelled,
+        callers waiting on it are cancelled too.
+
+        Args:
+            key: What is being loaded
+            fn: Creates the coroutine that loads it
+
+        Returns:
+            fn()'s result (the same object for every caller)
+        """
+        pending = self.inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here so waiter-less failures don't warn
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.inflight[key]
@@ -1,39 +1,113 @@
 """
 Supabase Client Service
 
-Singleton client for database operations using service role key.
+Singleton clients for database operations using service role key.
+
+`get_async_client()` is what request handlers and the agent use: an async
+PostgREST client over one pooled `httpx.AsyncClient`, so queries never
+block the event loop and reuse warm connections. `get_supabase_client()`
+is the blocking supabase-py client, kept for scripts and one-off tools.
 """
 
 import os
 from typing import Optional
+import httpx
+from postgrest import AsyncPostgrestClient
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Max open connections to PostgREST per process
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "20"))
+# Per-request timeout in seconds
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+
 _client: Optional[Client] = None
+_async_client: Optional[AsyncPostgrestClient] = None
+
+
+def _credentials() -> tuple:
+    url = os.getenv("SUPABASE_URL")
+    # Use service role key for backend operations (bypasses RLS)
+    key = (os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_SERVICE_KEY")
+           or os.getenv("SUPABASE_ANON_KEY"))
+
+    if not url:
+        raise ValueError("SUPABASE_URL environment variable is required")
+    if not key:
+        raise ValueError("SUPABASE_SERVICE_ROLE_KEY or SUPABASE_ANON_KEY is required")
+    return url, key
 
 
 def get_supabase_client() -> Client:
-    """Get singleton Supabase client with service role key."""
+    """Get singleton Supabase client with service role key (blocking)."""
     global _client
 
     if _client is None:
-        url = os.getenv("SUPABASE_URL")
-        # Use service role key for backend operations (bypasses RLS)
-        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_ANON_KEY")
+        _client = create_client(*_credentials())
 
-        if not url:
-            raise ValueError("SUPABASE_URL environment variable is required")
-        if not key:
-            raise ValueError("SUPABASE_SERVICE_ROLE_KEY or SUPABASE_ANON_KEY is required")
+    return _client
 
-        _client = create_client(url, key)
 
-    return _client
+def create_async_client(
+    url: str,
+    key: str,
+    transport: Optional[httpx.AsyncBaseTransport] = None
+) -> AsyncPostgrestClient:
+    """
+    Create an async PostgREST client with its own connection pool.
+
+    Args:
+        url: Supabase project URL
+        key: API key sent as apikey and bearer token
+        transport: Optional httpx transport (tests use a mock)
+
+    Returns:
+        AsyncPostgrestClient; queries are `await db.table(...)...execute()`
+    """
+    headers = {
+        "apikey": key,
+        "Authorization": f"Bearer {key}",
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+    }
+    rest_url = f"{url.rstrip('/')}/rest/v1"
+    http_client = httpx.AsyncClient(
+        base_url=rest_url,
+        headers=headers,
+        timeout=SUPABASE_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=SUPABASE_POOL_SIZE,
+            max_keepalive_connections=SUPABASE_POOL_SIZE
+        ),
+        follow_redirects=True,
+        transport=transport
+    )
+    return AsyncPostgrestClient(rest_url, headers=headers, http_client=http_client)
+
+
+def get_async_client() -> AsyncPostgrestClient:
+    """Get singleton async PostgREST client (pooled, non-blocking)."""
+    global _async_client
+
+    if _async_client is None:
+        _async_client = create_async_client(*_credentials())
+
+    return _async_client
+
+
+async def close_async_client():
+    """Close pooled connections (on shutdown)."""
+    global _async_client
+
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
 
 
 def reset_client():
-    """Reset the singleton client (useful for testing)."""
-    global _client
+    """Reset the singleton clients (useful for testing)."""
+    global _client, _async_client
     _client = None
+    _async_client = None
@@ -7,9 +7,25 @@ separate from the LangGraph state management.
 import os
 from typing import Optional, List, Dict, Any
 from dataclasses import dataclass
-import asyncio
 from datetime import datetime
 
+from .supabase_client import get_async_client
+from .trip_resolver import get_trip_resolver
+from .pagination import keyset, clamp_limit, page_of, select_columns
+
+# Columns listings may project (id and created_at always come back: the cursor needs them)
+PHOTO_COLUMNS = (
+    "id", "trip_id", "milestone_id", "uploaded_by_user_id", "photo_url", "thumbnail_url",
+    "storage_path", "caption", "description", "tags", "detected_people", "location_name",
+    "latitude", "longitude", "taken_at", "order_index", "created_at"
+)
+MILESTONE_COLUMNS = (
+    "id", "trip_id", "name", "description", "location", "tags", "created_at",
+    "created_by_user_id", "photo_count", "cover_photo_id"
+)
+# What the gallery grid needs
+PHOTO_GRID_FIELDS = ["id", "photo_url", "thumbnail_url"]
+
 
 @dataclass
 class MilestoneRecord:
@@ -44,28 +60,106 @@ class PhotoRecord:
     created_at: str
 
 
+def milestone_row(
+    trip_id: int,
+    name: str,
+    description: Optional[str] = None,
+    location: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    created_by_user_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """Insert payload for a milestone (see SupabaseDB.insert_milestone for the fields)."""
+    return {
+        "trip_id": trip_id,
+        "name": name,
+        "description": description,
+        "location": location,
+        "tags": tags or [],
+        "created_by_user_id": created_by_user_id,
+        "photo_count": 0
+    }
+
+
+def photo_row(
+    trip_id: int,
+    milestone_id: Optional[int],
+    photo_url: str,
+    storage_path: str,
+    uploaded_by_user_id: Optional[str] = None,
+    description: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    detected_people: Optional[List[str]] = None,
+    location_name: Optional[str] = None,
+    order_index: int = 0
+) -> Dict[str, Any]:
+    """Insert payload for a photo (see SupabaseDB.insert_photo for the fields)."""
+    return {
+        "trip_id": trip_id,
+        "milestone_id": milestone_id,
+        "uploaded_by_user_id": uploaded_by_user_id,
+        "photo_url": photo_url,
+        "storage_path": storage_path,
+        "description": description,
+        "tags": tags or [],
+        "detected_people": detected_people or [],
+        "location_name": location_name,
+        "order_index": order_index
+    }
+
+
+def to_milestone_record(record: Dict[str, Any]) -> MilestoneRecord:
+    return MilestoneRecord(
+        id=record["id"],
+        trip_id=record["trip_id"],
+        name=record["name"],
+        description=record.get("description"),
+        location=record.get("location"),
+        tags=record.get("tags", []),
+        created_at=record["created_at"],
+        created_by_user_id=record.get("created_by_user_id"),
+        photo_count=record.get("photo_count", 0),
+        cover_photo_id=record.get("cover_photo_id")
+    )
+
+
+def to_photo_record(record: Dict[str, Any]) -> PhotoRecord:
+    return PhotoRecord(
+        id=record["id"],
+        trip_id=record["trip_id"],
+        milestone_id=record.get("milestone_id"),
+        uploaded_by_user_id=record.get("uploaded_by_user_id"),
+        photo_url=record["photo_url"],
+        thumbnail_url=record.get("thumbnail_url"),
+        storage_path=record.get("storage_path"),
+        description=record.get("description"),
+        tags=record.get("tags", []),
+        detected_people=record.get("detected_people", []),
+        location_name=record.get("location_name"),
+        order_index=record.get("order_index", 0),
+        created_at=record["created_at"]
+    )
+
+
 class SupabaseDB:
     """
     Database service for photo/milestone operations.
 
-    Uses Supabase Python client for direct database access.
-    Requires SUPABASE_URL and SUPABASE_SERVICE_KEY env vars.
+    Uses the shared async PostgREST client, so queries don't block the
+    event loop. Requires SUPABASE_URL and SUPABASE_SERVICE_KEY env vars.
     """
 
     def __init__(self):
         self.url = os.getenv("SUPABASE_URL")
-        self.service_key = os.getenv("SUPABASE_SERVICE_KEY") or os.getenv("SUPABASE_ANON_KEY")
+        self.service_key = (os.getenv("SUPABASE_SERVICE_KEY") or os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+                            or os.getenv("SUPABASE_ANON_KEY"))
 
         if not self.url or not self.service_key:
             raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set")
 
-        # Lazy import to avoid requiring supabase-py if not used
-        try:
-            from supabase import create_client, Client
-            self.client: Client = create_client(self.url, self.service_key)
-        except ImportError:
-            print("⚠️ supabase-py not installed. Install with: pip install supabase")
-            self.client = None
+    @property
+    def client(self):
+        """The pooled async PostgREST client."""
+        return get_async_client()
 
     async def insert_milestone(
         self,
@@ -90,42 +184,13 @@ class SupabaseDB:
         Returns:
             MilestoneRecord if successful, None if failed
         """
-        if not self.client:
-            print("⚠️ Supabase client not initialized")
-            return None
-
         try:
-            data = {
-                "trip_id": trip_id,
-                "name": name,
-                "description": description,
-                "location": location,
-                "tags": tags or [],
-                "created_by_user_id": created_by_user_id,
-                "photo_count": 0
-            }
-
-            # Run in thread pool since Supabase client is sync
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: self.client.table("milestones").insert(data).execute()
-            )
+            data = milestone_row(trip_id, name, description, location, tags, created_by_user_id)
+
+            result = await self.client.table("milestones").insert(data).execute()
 
             if result.data and len(result.data) > 0:
-                record = result.data[0]
-                return MilestoneRecord(
-                    id=record["id"],
-                    trip_id=record["trip_id"],
-                    name=record["name"],
-                    description=record.get("description"),
-                    location=record.get("location"),
-                    tags=record.get("tags", []),
-                    created_at=record["created_at"],
-                    created_by_user_id=record.get("created_by_user_id"),
-                    photo_count=record.get("photo_count", 0),
-                    cover_photo_id=record.get("cover_photo_id")
-                )
+                return to_milestone_record(result.data[0])
 
             return None
 
@@ -166,136 +231,231 @@ class SupabaseDB:
         Returns:
             PhotoRecord if successful, None if failed
         """
-        if not self.client:
-            print("⚠️ Supabase client not initialized")
-            return None
+        records = await self.insert_photos_bulk([photo_row(
+            trip_id, milestone_id, photo_url, storage_path, uploaded_by_user_id,
+            description, tags, detected_people, location_name, order_index
+        )])
+        return records[0] if records else None
 
-        try:
-            data = {
-                "trip_id": trip_id,
-                "milestone_id": milestone_id,
-                "uploaded_by_user_id": uploaded_by_user_id,
-                "photo_url": photo_url,
-                "storage_path": storage_path,
-                "description": description,
-                "tags": tags or [],
-                "detected_people": detected_people or [],
-                "location_name": location_name,
-                "order_index": order_index
-            }
-
-            # Run in thread pool
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: self.client.table("photos").insert(data).execute()
-            )
+    async def insert_photos_bulk(self, rows: List[Dict[str, Any]]) -> List[PhotoRecord]:
+        """
+        Insert several photos in one request.
 
-            if result.data and len(result.data) > 0:
-                record = result.data[0]
-                return PhotoRecord(
-                    id=record["id"],
-                    trip_id=record["trip_id"],
-                    milestone_id=record.get("milestone_id"),
-                    uploaded_by_user_id=record.get("uploaded_by_user_id"),
-                    photo_url=record["photo_url"],
-                    thumbnail_url=record.get("thumbnail_url"),
-                    storage_path=record.get("storage_path"),
-                    description=record.get("description"),
-                    tags=record.get("tags", []),
-                    detected_people=record.get("detected_people", []),
-                    location_name=record.get("location_name"),
-                    order_index=record.get("order_index", 0),
-                    created_at=record["created_at"]
-                )
+        Args:
+            rows: Rows built with photo_row() (every row must have the same keys)
 
-            return None
+        Returns:
+            Created PhotoRecords in the same order, or [] if the insert failed
+        """
+        if not rows:
+            return []
+
+        try:
+            result = await self.client.table("photos").insert(rows).execute()
+            return [to_photo_record(record) for record in result.data or []]
 
         except Exception as e:
-            print(f"❌ Failed to insert photo: {e}")
+            print(f"❌ Failed to insert {len(rows)} photo(s): {e}")
             import traceback
             traceback.print_exc()
-            return None
-
-    async def get_trip_milestones(self, trip_id: int) -> List[Dict[str, Any]]:
-        """Get all milestones for a trip, ordered by creation date."""
-        if not self.client:
             return []
 
-        try:
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: self.client.table("milestones")
-                    .select("*")
-                    .eq("trip_id", trip_id)
-                    .order("created_at", desc=True)
-                    .execute()
-            )
-            return result.data or []
-        except Exception as e:
-            print(f"❌ Failed to fetch milestones: {e}")
-            return []
+    async def upsert_milestones(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Insert milestones keyed by idempotency_key in one request (migration 012).
 
-    async def get_milestone_photos(self, milestone_id: int) -> List[Dict[str, Any]]:
-        """Get all photos in a milestone, ordered by order_index."""
-        if not self.client:
-            return []
+        Rows already written under the same key are updated in place, so a
+        retried batch doesn't duplicate them. Unlike insert_milestone this
+        raises on failure, for callers that retry.
 
-        try:
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: self.client.table("photos")
-                    .select("*")
-                    .eq("milestone_id", milestone_id)
-                    .order("order_index")
-                    .execute()
-            )
-            return result.data or []
-        except Exception as e:
-            print(f"❌ Failed to fetch milestone photos: {e}")
+        Returns:
+            Written rows (with id and idempotency_key)
+        """
+        if not rows:
             return []
+        result = await self.client.table("milestones").upsert(
+            rows, on_conflict="idempotency_key"
+        ).execute()
+        return result.data or []
+
+    async def upsert_photos(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Insert photos keyed by idempotency_key in one request (migration 012).
+
+        Same retry semantics as upsert_milestones.
 
-    async def get_trip_photos(self, trip_id: int) -> List[Dict[str, Any]]:
-        """Get all photos for a trip across all milestones."""
-        if not self.client:
+        Returns:
+            Written rows (with id and idempotency_key)
+        """
+        if not rows:
             return []
+        result = await self.client.table("photos").upsert(
+            rows, on_conflict="idempotency_key"
+        ).execute()
+        return result.data or []
+
+    async def get_milestone_ids(self, keys: List[str]) -> Dict[str, int]:
+        """Map idempotency keys of already written milestones to their ids."""
+        if not keys:
+            return {}
+        result = await self.client.table("milestones").select(
+            "id,idempotency_key"
+        ).in_("idempotency_key", keys).execute()
+        return {row["idempotency_key"]: row["id"] for row in result.data or []}
+
+    async def insert_pending_upload(self, row: Dict[str, Any]):
+        """Store an upload token (migration 015). Raises on failure."""
+        await self.client.table("pending_uploads").insert(row).execute()
+
+    async def take_pending_upload(
+        self,
+        upload_id: str,
+        thread_id: str,
+        created_after: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Delete and return an upload token, if it belongs to the room and is fresh.
+
+        The delete makes the token single-use across workers: only one
+        concurrent claim gets the row back.
+
+        Args:
+            upload_id: Token from the upload endpoint
+            thread_id: Room the message is for
+            created_after: ISO timestamp; older tokens are left for the pruner
+
+        Returns:
+            The row, or None
+        """
+        result = await self.client.table("pending_uploads").delete().eq(
+            "upload_id", upload_id
+        ).eq("thread_id", thread_id).gt("created_at", created_after).execute()
+        return result.data[0] if result.data else None
+
+    async def take_expired_uploads(self, created_before: str) -> List[Dict[str, Any]]:
+        """Delete and return upload tokens created before a timestamp."""
+        result = await self.client.table("pending_uploads").delete().lt(
+            "created_at", created_before
+        ).execute()
+        return result.data or []
+
+    async def _list_page(
+        self,
+        table: str,
+        column: str,
+        value: int,
+        allowed: tuple,
+        limit: Optional[int],
+        cursor: Optional[str],
+        fields: Optional[List[str]],
+        with_total: bool,
+        desc: bool = True
+    ) -> Dict[str, Any]:
+        """
+        One keyset page of `table` rows where `column` = `value`.
+
+        A bad cursor or unknown field raises InvalidPageRequest before any
+        query; database errors are logged and give an empty page.
+        """
+        limit = clamp_limit(limit)
+        columns = select_columns(fields, allowed, "*")
+        # Exact count is an index-only scan on (column, created_at, id), see migration 011
+        query = self.client.table(table).select(
+            columns, count="exact" if with_total else None
+        ).eq(column, value)
+        query = keyset(query, cursor, limit, desc=desc)
 
         try:
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: self.client.table("photos")
-                    .select("*")
-                    .eq("trip_id", trip_id)
-                    .order("created_at", desc=True)
-                    .execute()
-            )
-            return result.data or []
+            result = await query.execute()
         except Exception as e:
-            print(f"❌ Failed to fetch trip photos: {e}")
-            return []
+            print(f"❌ Failed to fetch {table}: {e}")
+            return {table: [], "next_cursor": None, "total": None}
+
+        rows, next_cursor = page_of(result.data or [], limit)
+        return {table: rows, "next_cursor": next_cursor, "total": result.count if with_total else None}
 
-    def get_trip_id_from_session_code(self, session_code: str) -> Optional[int]:
+    async def get_trip_milestones(
+        self,
+        trip_id: int,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        with_total: bool = False
+    ) -> Dict[str, Any]:
         """
-        Lookup trip_id from session_code.
+        Get a page of a trip's milestones, newest first.
 
-        This is a sync method since it's called from WebSocket handler.
+        Args:
+            trip_id: Trip to list
+            limit: Page size (default DEFAULT_PAGE_SIZE, capped at MAX_PAGE_SIZE)
+            cursor: next_cursor from the previous page
+            fields: Columns to return (default all)
+            with_total: Also count all the trip's milestones
+
+        Returns:
+            {"milestones": [...], "next_cursor": str or None, "total": int or None}
         """
-        if not self.client:
-            return None
+        return await self._list_page(
+            "milestones", "trip_id", trip_id, MILESTONE_COLUMNS,
+            limit, cursor, fields, with_total
+        )
 
-        try:
-            result = self.client.table("trips")\
-                .select("id")\
-                .eq("session_code", session_code)\
-                .execute()
+    async def get_milestone_photos(
+        self,
+        milestone_id: int,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        with_total: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Get a page of a milestone's photos in upload order (oldest first).
 
-            if result.data and len(result.data) > 0:
-                return result.data[0]["id"]
+        Args:
+            milestone_id: Milestone to list
+            limit: Page size (default DEFAULT_PAGE_SIZE, capped at MAX_PAGE_SIZE)
+            cursor: next_cursor from the previous page
+            fields: Columns to return (default all; PHOTO_GRID_FIELDS for thumbnails)
+            with_total: Also count all the milestone's photos
 
-            return None
+        Returns:
+            {"photos": [...], "next_cursor": str or None, "total": int or None}
+        """
+        return await self._list_page(
+            "photos", "milestone_id", milestone_id, PHOTO_COLUMNS,
+            limit, cursor, fields, with_total, desc=False
+        )
+
+    async def get_trip_photos(
+        self,
+        trip_id: int,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        with_total: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Get a page of a trip's photos across all milestones, newest first.
+
+        Args:
+            trip_id: Trip to list
+            limit: Page size (default DEFAULT_PAGE_SIZE, capped at MAX_PAGE_SIZE)
+            cursor: next_cursor from the previous page
+            fields: Columns to return (default all; PHOTO_GRID_FIELDS for thumbnails)
+            with_total: Also count all the trip's photos
+
+        Returns:
+            {"photos": [...], "next_cursor": str or None, "total": int or None}
+        """
+        return await self._list_page(
+            "photos", "trip_id", trip_id, PHOTO_COLUMNS,
+            limit, cursor, fields, with_total
+        )
+
+    async def get_trip_id_from_session_code(self, session_code: str) -> Optional[int]:
+        """Lookup trip_id from session_code (cached, see trip_resolver.py)."""
+        try:
+            return await get_trip_resolver().resolve(session_code)
         except Exception as e:
             print(f"❌ Failed to lookup trip by session code: {e}")
             return None
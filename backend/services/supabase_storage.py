@@ -3,7 +3,7 @@ import os
 import base64
 import uuid
 import httpx
-from typing import Optional
+from typing import AsyncIterable, Optional, Union
 from dataclasses import dataclass
 
 # Singleton instance
@@ -67,35 +67,60 @@ class SupabaseStorage:
             if not filename:
                 filename = f"{uuid.uuid4()}.jpg"
 
-            # Full path in bucket: session_id/filename
-            path = f"{session_id}/{filename}"
+            return await self._put(image_bytes, f"{session_id}/{filename}", "image/jpeg")
 
-            # Upload to Supabase Storage
-            upload_url = f"{self.storage_url}/object/{self.bucket}/{path}"
+        except Exception as e:
+            return UploadResult(success=False, error=str(e))
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    upload_url,
-                    content=image_bytes,
-                    headers={
-                        **self.headers,
-                        "Content-Type": "image/jpeg",
-                    },
-                    timeout=30.0
-                )
+    async def upload_stream(
+        self,
+        chunks: AsyncIterable[bytes],
+        session_id: str,
+        content_type: str = "image/jpeg",
+        extension: str = "jpg"
+    ) -> UploadResult:
+        """
+        Stream raw image bytes to Supabase Storage without buffering them.
 
-                if response.status_code in (200, 201):
-                    # Get public URL
-                    public_url = f"{self.storage_url}/object/public/{self.bucket}/{path}"
-                    return UploadResult(success=True, url=public_url, path=path)
-                else:
-                    return UploadResult(
-                        success=False,
-                        error=f"Upload failed: {response.status_code} - {response.text}"
-                    )
+        Args:
+            chunks: Image bytes, e.g. a request body stream
+            session_id: Session/thread ID for organizing files
+            content_type: MIME type stored with the object
+            extension: File extension for the generated name
 
-        except Exception as e:
-            return UploadResult(success=False, error=str(e))
+        Returns:
+            UploadResult with url and path on success
+        """
+        return await self._put(chunks, f"{session_id}/{uuid.uuid4()}.{extension}", content_type)
+
+    async def _put(
+        self,
+        content: Union[bytes, AsyncIterable[bytes]],
+        path: str,
+        content_type: str
+    ) -> UploadResult:
+        """Upload bytes (or a byte stream) to `path` in the bucket."""
+        upload_url = f"{self.storage_url}/object/{self.bucket}/{path}"
+
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                upload_url,
+                content=content,
+                headers={
+                    **self.headers,
+                    "Content-Type": content_type,
+                },
+                timeout=30.0
+            )
+
+            if response.status_code in (200, 201):
+                # Get public URL
+                return UploadResult(success=True, url=self.get_public_url(path), path=path)
+            else:
+                return UploadResult(
+                    success=False,
+                    error=f"Upload failed: {response.status_code} - {response.text}"
+                )
 
     async def delete(self, path: str) -> DeleteResult:
         """
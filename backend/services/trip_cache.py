@@ -0,0 +1,208 @@
+"""
+Trip and Membership Cache
+
+Most trip endpoints (and `require_trip_access`) start with
+`get_trip_by_id` and then `is_participant`: two Supabase round trips for
+data that almost never changes. This cache keeps trip records and
+(trip_id, user_id) membership answers in process. session_service writes
+through it: `update_trip` stores the new record, `add_participant` marks
+the member, `delete_trip` drops the trip and its memberships (updates and
+joins also drop the trip's public card, below).
+
+Each write is also announced to the other workers over the room pub/sub
+(`announce()`; main.py wires it on startup), and they drop everything they
+cached for that trip. Announcements are best effort (and only reach other
+processes with ROOM_PUBSUB=postgres), so entries still expire: "not a
+member" is only cached briefly, and paths that act on a trip's status
+(join, finalize) read the trip with `get_trip_by_id(..., fresh=True)`.
+
+It also keeps the public trip cards shown by the join page, keyed by
+session code. An invite link shared in a big group chat gets hit in
+bursts, so cards are cached for a few seconds (unknown codes too); joins
+and updates drop the card on every worker.
+"""
+
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+import os
+import time
+import uuid
+
+# Seconds trip records and confirmed memberships are cached
+TRIP_CACHE_TTL = float(os.getenv("TRIP_CACHE_TTL", "300"))
+# Seconds a "not a participant" answer is cached
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "5"))
+# Max trips and memberships kept (each, least recently used are dropped)
+TRIP_CACHE_SIZE = int(os.getenv("TRIP_CACHE_SIZE", "5000"))
+# Seconds a public trip card (join page) is cached
+PUBLIC_CARD_TTL = float(os.getenv("PUBLIC_CARD_TTL", "10"))
+
+# Returned by lookups that aren't cached (None is a valid cached trip miss)
+MISSING = object()
+
+# Room pub/sub channel carrying trip changes between workers
+TRIP_CACHE_CHANNEL = "__trip_cache__"
+
+Publisher = Callable[[dict], Awaitable[None]]
+
+
+class TripCache:
+    """LRU + TTL cache of trip records, participant checks and public cards."""
+
+    def __init__(
+        self,
+        ttl: float = TRIP_CACHE_TTL,
+        negative_ttl: float = MEMBERSHIP_NEGATIVE_TTL,
+        max_size: int = TRIP_CACHE_SIZE,
+        card_ttl: float = PUBLIC_CARD_TTL
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.card_ttl = card_ttl
+        # Sends change announcements to the other workers (None: single process)
+        self.publisher: Optional[Publisher] = None
+        # Tags this process's announcements, which it already applied
+        self.origin = uuid.uuid4().hex[:12]
+        # trip_id -> (trip record, expires_at)
+        self.trips: "OrderedDict[int, Tuple[dict, float]]" = OrderedDict()
+        # (trip_id, user_id) -> (is_participant, expires_at)
+        self.members: "OrderedDict[Tuple[int, str], Tuple[bool, float]]" = OrderedDict()
+        # session_code -> (public card or None, expires_at)
+        self.cards: "OrderedDict[str, Tuple[Optional[dict], float]]" = OrderedDict()
+        # Stats
+        self.trip_hits = 0
+        self.trip_misses = 0
+        self.member_hits = 0
+        self.member_misses = 0
+        self.card_hits = 0
+        self.card_misses = 0
+        self.remote_invalidations = 0
+
+    def _get(self, table: OrderedDict, key):
+        entry = table.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return MISSING
+        table.move_to_end(key)
+        return entry[0]
+
+    def _put(self, table: OrderedDict, key, value, ttl: float):
+        table[key] = (value, time.monotonic() + ttl)
+        table.move_to_end(key)
+        while len(table) > self.max_size:
+            table.popitem(last=False)
+
+    # ============== TRIPS ==============
+
+    def get_trip(self, trip_id: int):
+        """Cached trip record (a copy), or MISSING."""
+        trip = self._get(self.trips, trip_id)
+        if trip is MISSING:
+            self.trip_misses += 1
+            return MISSING
+        self.trip_hits += 1
+        return dict(trip)
+
+    def put_trip(self, trip: Optional[dict]):
+        """Store a trip record fetched from or written to the database."""
+        if trip and trip.get("id") is not None:
+            self._put(self.trips, trip["id"], dict(trip), self.ttl)
+
+    def invalidate_trip(self, trip_id: int):
+        """Drop a trip, every membership answer for it and its public card."""
+        self.trips.pop(trip_id, None)
+        for key in [k for k in self.members if k[0] == trip_id]:
+            del self.members[key]
+        self.invalidate_card(trip_id)
+
+    # ============== MEMBERSHIP ==============
+
+    def get_member(self, trip_id: int, user_id: str):
+        """Cached is_participant answer, or MISSING."""
+        answer = self._get(self.members, (trip_id, user_id))
+        if answer is MISSING:
+            self.member_misses += 1
+        else:
+            self.member_hits += 1
+        return answer
+
+    def put_member(self, trip_id: int, user_id: str, is_member: bool):
+        """Store an is_participant answer."""
+        self._put(self.members, (trip_id, user_id), is_member,
+                  self.ttl if is_member else self.negative_ttl)
+
+    # ============== PUBLIC CARDS ==============
+
+    def get_card(self, session_code: str):
+        """Cached public card (a copy; None for an unknown code), or MISSING."""
+        card = self._get(self.cards, session_code)
+        if card is MISSING:
+            self.card_misses += 1
+            return MISSING
+        self.card_hits += 1
+        return dict(card) if card else None
+
+    def put_card(self, session_code: str, card: Optional[dict]):
+        """Store the public card for a code (None: no trip uses it)."""
+        self._put(self.cards, session_code, dict(card) if card else None,
+                  self.card_ttl if card else self.negative_ttl)
+
+    def invalidate_card(self, trip_id: int):
+        """Drop a trip's public card (participant joined, trip updated)."""
+        for key in [k for k, (card, _) in self.cards.items() if card and card["id"] == trip_id]:
+            del self.cards[key]
+
+    # ============== OTHER WORKERS ==============
+
+    def set_publisher(self, publisher: Optional[Publisher]):
+        """Set how change announcements reach the other workers."""
+        self.publisher = publisher
+
+    async def announce(self, trip_id: int):
+        """Tell the other workers a trip changed (joined, updated, deleted)."""
+        if self.publisher is None:
+            return
+        try:
+            await self.publisher({"origin": self.origin, "trip_id": trip_id})
+        except Exception as e:
+            print(f"⚠️ Could not announce change to trip {trip_id}: {e}")
+
+    def apply_remote(self, message: dict):
+        """Drop everything cached for a trip another worker changed."""
+        if message.get("origin") == self.origin or message.get("trip_id") is None:
+            return
+        self.invalidate_trip(message["trip_id"])
+        self.remote_invalidations += 1
+
+    def get_stats(self) -> dict:
+        """Sizes and hit rates for monitoring."""
+        def rate(hits, misses):
+            return round(hits / (hits + misses), 3) if hits + misses else None
+
+        return {
+            "trips": len(self.trips),
+            "memberships": len(self.members),
+            "trip_hits": self.trip_hits,
+            "trip_misses": self.trip_misses,
+            "trip_hit_rate": rate(self.trip_hits, self.trip_misses),
+            "member_hits": self.member_hits,
+            "member_misses": self.member_misses,
+            "member_hit_rate": rate(self.member_hits, self.member_misses),
+            "cards": len(self.cards),
+            "card_hits": self.card_hits,
+            "card_misses": self.card_misses,
+            "card_hit_rate": rate(self.card_hits, self.card_misses),
+            "remote_invalidations": self.remote_invalidations,
+        }
+
+
+# Singleton instance
+_cache_instance: Optional[TripCache] = None
+
+
+def get_trip_cache() -> TripCache:
+    """Get or create the singleton trip cache."""
+    global _cache_instance
+    if _cache_instance is None:
+        _cache_instance = TripCache()
+    return _cache_instance
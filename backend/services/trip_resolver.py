@@ -0,0 +1,127 @@
+"""
+Session Code → Trip ID Resolver
+
+Every chat turn and WhatsApp message needs the trip_id behind its
+session code, a mapping that never changes once the trip exists. The
+resolver keeps it in an LRU cache with a TTL, caches "no trip" for a
+short while (plain chat rooms have none), and lets concurrent lookups
+for the same code share one query. Trip creation, lookups and joins warm
+it; deleting a trip evicts it.
+"""
+
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+import os
+import time
+
+from .single_flight import SingleFlight
+
+# Seconds a resolved trip_id stays cached
+TRIP_ID_CACHE_TTL = float(os.getenv("TRIP_ID_CACHE_TTL", "3600"))
+# Seconds a "no trip for this code" answer stays cached
+TRIP_ID_NEGATIVE_TTL = float(os.getenv("TRIP_ID_NEGATIVE_TTL", "30"))
+# Max session codes kept (least recently used are dropped)
+TRIP_ID_CACHE_SIZE = int(os.getenv("TRIP_ID_CACHE_SIZE", "10000"))
+
+Lookup = Callable[[str], Awaitable[Optional[int]]]
+
+
+async def _lookup_trip_id(session_code: str) -> Optional[int]:
+    """Query the trips table (errors propagate and are not cached)."""
+    from .supabase_client import get_async_client
+
+    result = await get_async_client().table("trips").select("id").eq("session_code", session_code).execute()
+    if result.data:
+        return result.data[0]["id"]
+    return None
+
+
+class TripResolver:
+    """TTL/LRU cache of session_code -> trip_id with negative caching."""
+
+    def __init__(
+        self,
+        lookup: Lookup = _lookup_trip_id,
+        ttl: float = TRIP_ID_CACHE_TTL,
+        negative_ttl: float = TRIP_ID_NEGATIVE_TTL,
+        max_size: int = TRIP_ID_CACHE_SIZE
+    ):
+        self.lookup = lookup
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        # session_code -> (trip_id or None, expires_at), oldest first
+        self.cache: "OrderedDict[str, Tuple[Optional[int], float]]" = OrderedDict()
+        # Lookups in flight, shared by concurrent callers for a code
+        self.flights = SingleFlight()
+        # Stats
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    async def resolve(self, session_code: str) -> Optional[int]:
+        """
+        Get the trip_id for a session code.
+
+        Returns:
+            The trip_id, or None if no trip uses this code.
+        """
+        entry = self.cache.get(session_code)
+        if entry is not None and entry[1] > time.monotonic():
+            self.cache.move_to_end(session_code)
+            if entry[0] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[0]
+
+        if session_code in self.flights:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return await self.flights.do(session_code, lambda: self._load(session_code))
+
+    async def _load(self, session_code: str) -> Optional[int]:
+        trip_id = await self.lookup(session_code)
+        self._store(session_code, trip_id)
+        return trip_id
+
+    def remember(self, session_code: Optional[str], trip_id: Optional[int]):
+        """Warm the cache with a known mapping (trip created, fetched or joined)."""
+        if session_code and trip_id is not None:
+            self._store(session_code, trip_id)
+
+    def forget(self, session_code: Optional[str]):
+        """Drop a session code (trip deleted)."""
+        if session_code:
+            self.cache.pop(session_code, None)
+
+    def _store(self, session_code: str, trip_id: Optional[int]):
+        ttl = self.ttl if trip_id is not None else self.negative_ttl
+        self.cache[session_code] = (trip_id, time.monotonic() + ttl)
+        self.cache.move_to_end(session_code)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        """Cache counters for monitoring."""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self.cache),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 3) if lookups else None,
+        }
+
+
+# Singleton instance
+_resolver_instance: Optional[TripResolver] = None
+
+
+def get_trip_resolver() -> TripResolver:
+    """Get or create the singleton resolver."""
+    global _resolver_instance
+    if _resolver_instance is None:
+        _resolver_instance = TripResolver()
+    return _resolver_instance
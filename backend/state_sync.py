@@ -0,0 +1,103 @@
+"""
+Versioned Ledger Sync
+
+Computes the difference between two agent states so broadcasts only
+carry what changed in the ledger instead of every expense, payment,
+milestone and photo on every message.
+
+Protocol:
+- The ledger version lives in the graph state (`ledger_version`) and is
+  bumped by every tool that can change the ledger, so it is shared by
+  every process reading the same checkpoint.
+- `bot_complete` / `whatsapp_message` carry `base_version`,
+  `state_version` and a `state_delta`:
+      {"expenses": {"added": [...], "changed": [...], "removed": ["exp_2"]}, ...}
+  Only collections with changes are present.
+- A client whose version differs from `base_version` sends
+  {"type": "sync", "version": N} and receives a full `state_snapshot`.
+  Snapshots are also sent once on join.
+- Deltas need unique ids. Old checkpoints can hold duplicates (ids used
+  to be reused after a delete); for those `base_version` is null, which
+  no client has, so every client asks for a snapshot instead.
+"""
+
+from typing import Dict, List, Optional
+
+# Ledger collections synced by id
+DELTA_COLLECTIONS = ("expenses", "payments", "milestones", "photos")
+
+
+def get_ledger_version(state_values: dict) -> int:
+    """Get the ledger version from graph state values (0 for old checkpoints)."""
+    return state_values.get("ledger_version", 0) or 0
+
+
+def diff_collection(old_items: List[dict], new_items: List[dict]) -> Dict[str, list]:
+    """
+    Diff two lists of records keyed by "id".
+
+    Returns:
+        Dict with "added" and "changed" records and "removed" ids.
+        Empty dict if nothing changed.
+    """
+    old_by_id = {item.get("id"): item for item in old_items}
+    new_ids = set()
+    added = []
+    changed = []
+
+    for item in new_items:
+        item_id = item.get("id")
+        new_ids.add(item_id)
+        if item_id not in old_by_id:
+            added.append(item)
+        elif old_by_id[item_id] != item:
+            changed.append(item)
+
+    removed = [item_id for item_id in old_by_id if item_id not in new_ids]
+
+    if not (added or changed or removed):
+        return {}
+    return {"added": added, "changed": changed, "removed": removed}
+
+
+def has_unique_ids(items: List[dict]) -> bool:
+    """Whether every record in a collection has a different id."""
+    return len({item.get("id") for item in items}) == len(items)
+
+
+def compute_state_delta(old_values: dict, new_values: dict) -> Optional[dict]:
+    """
+    Diff every synced collection between two state snapshots.
+
+    Returns:
+        The delta, or None if a changed collection has duplicate ids (an
+        id-keyed delta would be applied wrong; send a snapshot instead).
+    """
+    delta = {}
+    for key in DELTA_COLLECTIONS:
+        old_items = old_values.get(key, []) or []
+        new_items = new_values.get(key, []) or []
+        diff = diff_collection(old_items, new_items)
+        if not diff:
+            continue
+        if not (has_unique_ids(old_items) and has_unique_ids(new_items)):
+            return None
+        delta[key] = diff
+    return delta
+
+
+def apply_state_delta(values: dict, delta: dict) -> dict:
+    """
+    Apply a delta to state values (mirror of the client-side logic).
+
+    Returns a new dict; the input is not modified.
+    """
+    result = dict(values)
+    for key, diff in delta.items():
+        items = list(result.get(key, []))
+        replacements = {item.get("id"): item for item in diff.get("changed", [])}
+        removed = set(diff.get("removed", []))
+        items = [replacements.get(item.get("id"), item) for item in items if item.get("id") not in removed]
+        items.extend(diff.get("added", []))
+        result[key] = items
+    return result
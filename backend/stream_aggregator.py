@@ -0,0 +1,76 @@
+"""
+Streaming Chunk Aggregator
+
+LLM tokens arrive a few characters at a time. Broadcasting each one as its
+own `bot_chunk` frame costs a JSON encode, a room lock and a send per
+client per token. The aggregator buffers streamed text and flushes it every
+`interval_ms` or once `max_chars` have accumulated, whichever comes first.
+The very first piece is flushed immediately so the typing bubble starts
+filling without delay.
+"""
+
+from typing import Awaitable, Callable, Optional
+import asyncio
+import os
+
+# Flush window for streamed text
+STREAM_FLUSH_MS = float(os.getenv("STREAM_FLUSH_MS", "80"))
+# Flush early once this much text is buffered
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "200"))
+
+
+class ChunkAggregator:
+    """Buffers streamed text and flushes it in time/size windows."""
+
+    def __init__(
+        self,
+        on_flush: Callable[[str], Awaitable[None]],
+        interval_ms: float = STREAM_FLUSH_MS,
+        max_chars: int = STREAM_FLUSH_CHARS
+    ):
+        self.on_flush = on_flush
+        self.interval = interval_ms / 1000
+        self.max_chars = max_chars
+        self.buffer = ""
+        self._timer: Optional[asyncio.Task] = None
+        # Keeps timer and explicit flushes in order
+        self._flush_lock = asyncio.Lock()
+        # Stats
+        self.pieces_in = 0
+        self.frames_out = 0
+
+    async def add(self, text: str):
+        """Add streamed text; flushes if the size limit is reached."""
+        if not text:
+            return
+        self.buffer += text
+        self.pieces_in += 1
+
+        if self.frames_out == 0 or len(self.buffer) >= self.max_chars:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        self._timer = None
+        await self._send()
+
+    async def flush(self):
+        """Send whatever is buffered now (call before any other room frame)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self._send()
+
+    async def _send(self):
+        async with self._flush_lock:
+            if not self.buffer:
+                return
+            text, self.buffer = self.buffer, ""
+            self.frames_out += 1
+            await self.on_flush(text)
+
+    async def close(self):
+        """Flush the remainder and stop the timer."""
+        await self.flush()
@@ -0,0 +1,216 @@
+"""
+Tests for the async data-access layer (services/supabase_client.py)
+
+Every service call goes through the pooled async PostgREST client. The
+blocking test runs them all against a fake PostgREST with network latency
+and fails if any step of the event loop takes longer than a few ms, which
+is what a synchronous HTTP call (or a forgotten `.execute()` without
+`await`) would do.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import date
+
+import httpx
+import pytest
+
+from services import session_service, supabase_client, supabase_db, trip_resolver, trip_cache
+from services.supabase_db import SupabaseDB
+
+# A loop step longer than this counts as blocking
+BLOCKING_THRESHOLD = 0.005
+# Simulated PostgREST round trip
+NETWORK_LATENCY = 0.02
+
+TRIP = {
+    "id": 1, "name": "Cusco", "session_code": "ABC123", "creator_id": "u1",
+    "start_date": "2026-01-01", "end_date": "2026-01-05", "status": "active",
+    "participant_count": 1, "created_at": "2026-01-01T00:00:00Z"
+}
+MILESTONE = {"id": 7, "trip_id": 1, "name": "Machu Picchu", "created_at": "2026-01-02T00:00:00Z"}
+PHOTO = {"id": 9, "trip_id": 1, "photo_url": "https://x/y.jpg", "created_at": "2026-01-02T00:00:00Z"}
+
+
+class FakePostgrest:
+    """Answers PostgREST requests after an async delay, like the network."""
+
+    def __init__(self):
+        self.requests = []
+        # Decoded JSON body of each request (None for reads)
+        self.bodies = []
+        # Functions answered as not deployed (PGRST202), like a pre-009 database
+        self.missing_functions = set()
+        # Columns answered as undefined (42703) when selected, like a pre-015 database
+        self.missing_columns = set()
+        # RPC name -> function of the request body giving the JSON result
+        self.functions = {}
+        # Rows returned for any request on each table
+        self.tables = {
+            "trips": [TRIP],
+            "trip_participants": [{"id": 3, "trip_id": 1, "user_id": "u1", "role": "admin"}],
+            "milestones": [MILESTONE],
+            "photos": [PHOTO],
+            "anonymous_sessions": [],
+        }
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(NETWORK_LATENCY)
+        table = request.url.path.rsplit("/", 1)[-1]
+        self.requests.append((request.method, table, dict(request.url.params)))
+        self.bodies.append(json.loads(request.content) if request.content else None)
+
+        selected = set(request.url.params.get("select", "").split(","))
+        if selected & self.missing_columns:
+            column = sorted(selected & self.missing_columns)[0]
+            return httpx.Response(400, json={
+                "code": "42703", "details": None, "hint": None,
+                "message": f"column {table}.{column} does not exist"
+            })
+        if "/rpc/" in request.url.path and table in self.missing_functions:
+            return httpx.Response(404, json={
+                "code": "PGRST202", "details": None, "hint": None,
+                "message": f"Could not find the function public.{table}"
+            })
+        if "/rpc/" in request.url.path and table in self.functions:
+            return httpx.Response(200, json=self.functions[table](self.bodies[-1]))
+        if request.url.path.endswith("/rpc/generate_session_code"):
+            return httpx.Response(200, json="ABC123")
+        if request.url.path.endswith("/rpc/create_trip_with_creator"):
+            return httpx.Response(200, json={
+                "trip": TRIP,
+                "membership": {"id": 3, "trip_id": 1, "user_id": "u1", "role": "admin"}
+            })
+
+        rows = [dict(row) for row in self.tables.get(table, [])]
+        return httpx.Response(200, json=rows, headers={"Content-Range": f"0-{len(rows) - 1}/{len(rows)}"})
+
+
+class BlockingSupabase:
+    """Sync client stand-in: any use blocks the loop like a real HTTP call."""
+
+    def __getattr__(self, name):
+        time.sleep(0.05)
+        raise RuntimeError(f"blocking supabase client used: {name}")
+
+
+class SlowCallbacks(logging.Handler):
+    """Collects asyncio's "Executing <Task> took X seconds" debug warnings."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        if "took" in record.getMessage():
+            self.records.append(record.getMessage())
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = FakePostgrest()
+    monkeypatch.setenv("SUPABASE_URL", "http://db.test")
+    monkeypatch.setenv("SUPABASE_SERVICE_KEY", "test-key")
+    monkeypatch.setattr(supabase_client, "_async_client",
+                        supabase_client.create_async_client("http://db.test", "test-key",
+                                                            transport=httpx.MockTransport(fake)))
+    monkeypatch.setattr(supabase_client, "_client", BlockingSupabase())
+    monkeypatch.setattr(supabase_db, "_db_instance", None)
+    monkeypatch.setattr(trip_resolver, "_resolver_instance", None)
+    monkeypatch.setattr(trip_cache, "_cache_instance", None)
+    monkeypatch.setattr(session_service, "_create_rpc_missing", False)
+    monkeypatch.setattr(session_service, "_participant_count_missing", False)
+    return fake
+
+
+def service_calls():
+    """One coroutine per data-access entry point used by handlers and the agent."""
+    db = SupabaseDB()
+    return [
+        session_service.create_trip("u1", "Cusco", date(2026, 1, 1), date(2026, 1, 5)),
+        session_service.get_trip_by_id(1),
+        session_service.get_trip_by_code("abc123"),
+        session_service.get_user_trips("u1"),
+        session_service.get_participant_count(1),
+        session_service.is_participant(1, "u1"),
+        session_service.add_participant(1, "u2"),
+        session_service.update_trip(1, name="Lima"),
+        session_service.delete_trip(1),
+        db.insert_milestone(1, "Machu Picchu"),
+        db.insert_photo(1, 7, "https://x/y.jpg", "ABC123/y.jpg"),
+        db.get_trip_milestones(1),
+        db.get_milestone_photos(7),
+        db.get_trip_photos(1),
+        db.get_trip_id_from_session_code("ABC123"),
+    ]
+
+
+class TestAsyncRepository:
+    """Test that data access is non-blocking and returns the same shapes."""
+
+    @pytest.mark.asyncio
+    async def test_service_calls_return_records(self, fake_db):
+        """Results keep the shapes callers already rely on."""
+        trip, by_id, by_code, trips, count, member, *_ = await asyncio.gather(*service_calls())
+
+        assert trip["session_code"] == "ABC123"
+        assert by_id == TRIP and by_code == TRIP
+        assert trips == {"trips": [TRIP], "next_cursor": None, "total": None}
+        assert count == 1
+        assert member is True
+        assert await SupabaseDB().get_trip_id_from_session_code("ABC123") == 1
+        assert ("POST", "create_trip_with_creator", {}) in fake_db.requests
+
+    @pytest.mark.asyncio
+    async def test_create_trip_is_one_request(self, fake_db):
+        """Trip, code and creator membership come back from a single RPC."""
+        trip = await session_service.create_trip("u1", "Cusco", date(2026, 1, 1), date(2026, 1, 5))
+
+        assert trip == TRIP
+        assert fake_db.requests == [("POST", "create_trip_with_creator", {})]
+        # Warmed caches answer the follow-up reads without the database
+        assert await session_service.get_trip_by_id(1) == TRIP
+        assert await session_service.is_participant(1, "u1") is True
+        assert len(fake_db.requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_create_trip_without_rpc_falls_back(self, fake_db):
+        """Databases without migration 009 still create trips, and stop asking for the RPC."""
+        fake_db.missing_functions.add("create_trip_with_creator")
+
+        trip = await session_service.create_trip("u1", "Cusco", date(2026, 1, 1), date(2026, 1, 5))
+        await session_service.create_trip("u1", "Cusco", date(2026, 1, 1), date(2026, 1, 5))
+
+        assert trip == TRIP
+        tables = [table for _, table, _ in fake_db.requests]
+        assert tables.count("create_trip_with_creator") == 1
+        assert tables.count("generate_session_code") == 2
+        assert tables.count("trip_participants") == 2
+
+    @pytest.mark.asyncio
+    async def test_no_service_call_blocks_the_event_loop(self, fake_db):
+        """Every service call yields while waiting on the network."""
+        # Warm up imports and the connection pool outside the measurement
+        await asyncio.gather(*service_calls())
+
+        loop = asyncio.get_running_loop()
+        slow = SlowCallbacks()
+        asyncio_logger = logging.getLogger("asyncio")
+        asyncio_logger.addHandler(slow)
+        previous = (loop.get_debug(), loop.slow_callback_duration)
+        loop.set_debug(True)
+        loop.slow_callback_duration = BLOCKING_THRESHOLD
+        try:
+            start = time.perf_counter()
+            results = await asyncio.gather(*service_calls(), return_exceptions=True)
+            elapsed = time.perf_counter() - start
+        finally:
+            loop.set_debug(previous[0])
+            loop.slow_callback_duration = previous[1]
+            asyncio_logger.removeHandler(slow)
+
+        assert not [r for r in results if isinstance(r, Exception)]
+        assert slow.records == []
+        # Calls overlap instead of waiting on each other's round trips
+        assert elapsed < NETWORK_LATENCY * len(results) / 2
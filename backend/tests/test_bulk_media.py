@@ -0,0 +1,33 @@
+"""
+Tests for bulk photo inserts (SupabaseDB.insert_photos_bulk)
+"""
+import pytest
+
+from services.supabase_db import SupabaseDB, photo_row
+from tests.test_async_repository import fake_db, PHOTO  # noqa: F401 (fixture)
+
+
+def photos(n, **extra):
+    return [dict(PHOTO, id=10 + i, order_index=i, **extra) for i in range(n)]
+
+
+def rows(n, milestone_id=None):
+    return [photo_row(1, milestone_id, f"https://x/{i}.jpg", f"ABC123/{i}.jpg", order_index=i) for i in range(n)]
+
+
+class TestBulkInserts:
+    """Test that N rows are written in one request."""
+
+    @pytest.mark.asyncio
+    async def test_insert_photos_bulk_is_one_request(self, fake_db):
+        fake_db.tables["photos"] = photos(3)
+
+        records = await SupabaseDB().insert_photos_bulk(rows(3, milestone_id=7))
+
+        assert [r.id for r in records] == [10, 11, 12]
+        assert [(method, table) for method, table, _ in fake_db.requests] == [("POST", "photos")]
+        assert [b["photo_url"] for b in fake_db.bodies[0]] == [f"https://x/{i}.jpg" for i in range(3)]
+        assert await SupabaseDB().insert_photos_bulk([]) == []
+        assert len(fake_db.requests) == 1
+
+
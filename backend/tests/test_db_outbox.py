@@ -0,0 +1,307 @@
+"""
+Tests for the write-behind outbox (db_outbox.py)
+"""
+import asyncio
+
+import pytest
+from unittest.mock import MagicMock
+
+import db_outbox as outbox_module
+from db_outbox import DBOutbox, MILESTONE, PHOTO
+from tests.test_async_repository import fake_db, MILESTONE as MILESTONE_ROW, PHOTO as PHOTO_ROW  # noqa: F401 (fixture)
+
+
+class FakeWriter:
+    """Upserts by idempotency_key into dicts; can fail or lose responses."""
+
+    def __init__(self):
+        self.milestones = {}
+        self.photos = {}
+        self.calls = []
+        self.fail = 0
+        self.lose_response = False
+        self.next_id = 100
+
+    async def _upsert(self, table: dict, name: str, rows: list) -> list:
+        self.calls.append((name, len(rows)))
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("connection reset")
+        for row in rows:
+            existing = table.get(row["idempotency_key"])
+            row_id = existing["id"] if existing else self.next_id
+            self.next_id += 1
+            table[row["idempotency_key"]] = dict(row, id=row_id)
+        if self.lose_response:
+            self.lose_response = False
+            raise RuntimeError("timeout after commit")
+        return [table[row["idempotency_key"]] for row in rows]
+
+    async def upsert_milestones(self, rows):
+        return await self._upsert(self.milestones, "milestones", rows)
+
+    async def upsert_photos(self, rows):
+        return await self._upsert(self.photos, "photos", rows)
+
+    async def get_milestone_ids(self, keys):
+        self.calls.append(("lookup", len(keys)))
+        return {key: self.milestones[key]["id"] for key in keys if key in self.milestones}
+
+
+def milestone(key, name="Cusco"):
+    return (MILESTONE, key, {"trip_id": 1, "name": name})
+
+
+def photo(key, milestone_key=None, milestone_id=None):
+    row = {"trip_id": 1, "milestone_id": milestone_id, "photo_url": f"https://x/{key}.jpg"}
+    if milestone_key:
+        row["milestone_key"] = milestone_key
+    return (PHOTO, key, row)
+
+
+@pytest.fixture
+async def outbox(tmp_path):
+    box = DBOutbox(str(tmp_path / "outbox.sqlite"), writer=FakeWriter(), retry_base=0)
+    yield box
+    if box.conn is not None:
+        await box.conn.close()
+
+
+class TestOutbox:
+    """Test durability, batching, retries and idempotency."""
+
+    @pytest.mark.asyncio
+    async def test_pending_writes_survive_a_crash(self, tmp_path, outbox):
+        await outbox.enqueue([milestone("m1"), photo("p1", milestone_key="m1")])
+        # Process dies without draining
+        await outbox.conn.close()
+        outbox.conn = None
+
+        writer = FakeWriter()
+        reopened = DBOutbox(outbox.path, writer=writer)
+        await reopened.open()
+        assert reopened.get_stats()["pending"] == 2
+
+        assert await reopened.drain_once() == 2
+        assert writer.photos["p1"]["milestone_id"] == writer.milestones["m1"]["id"]
+        await reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_one_upsert_per_table_per_batch(self, outbox):
+        await outbox.enqueue([milestone(f"m{i}") for i in range(3)])
+        await outbox.enqueue([photo(f"p{i}", milestone_key=f"m{i % 3}") for i in range(5)]
+                             + [photo("old", milestone_id=42)])
+
+        assert await outbox.drain_once() == 9
+
+        writer = outbox.writer
+        assert writer.calls == [("milestones", 3), ("photos", 6)]
+        assert writer.photos["p4"]["milestone_id"] == writer.milestones["m1"]["id"]
+        assert writer.photos["old"]["milestone_id"] == 42
+        assert "milestone_key" not in writer.photos["p0"]
+        assert outbox.get_stats() == {
+            "pending": 0, "dead": 0, "enqueued": 9, "written": 9, "retries": 0, "batches": 1
+        }
+
+    @pytest.mark.asyncio
+    async def test_retry_after_lost_response_does_not_duplicate(self, outbox):
+        writer = outbox.writer
+        writer.lose_response = True
+        await outbox.enqueue([milestone("m1"), milestone("m2")])
+        # Same key enqueued twice (e.g. a replayed turn) is one write
+        await outbox.enqueue([milestone("m1")])
+
+        assert await outbox.drain_once() == 0
+        assert outbox.get_stats()["retries"] == 2
+        assert await outbox.drain_once() == 2
+
+        assert sorted(writer.milestones) == ["m1", "m2"]
+        assert writer.milestones["m1"]["id"] == 100
+        assert outbox.get_stats()["pending"] == 0
+
+    @pytest.mark.asyncio
+    async def test_backoff_then_dead_after_max_attempts(self, tmp_path):
+        writer = FakeWriter()
+        writer.fail = 10
+        box = DBOutbox(str(tmp_path / "o.sqlite"), writer=writer, max_attempts=3, retry_base=0)
+        await box.enqueue([milestone("m1")])
+
+        for _ in range(4):
+            await box.drain_once()
+
+        # Three attempts, then kept on disk as dead and not retried
+        assert writer.calls == [("milestones", 1)] * 3
+        assert box.get_stats()["dead"] == 1 and box.get_stats()["pending"] == 0
+        async with box.conn.execute("SELECT attempts, last_error FROM outbox") as cur:
+            assert await cur.fetchall() == [(3, "connection reset")]
+
+        slow = DBOutbox(str(tmp_path / "slow.sqlite"), writer=FakeWriter(), retry_base=60)
+        slow.writer.fail = 1
+        await slow.enqueue([milestone("m1")])
+        await slow.drain_once()
+        # Not due again for a minute
+        assert await slow.drain_once() == 0
+        assert slow.writer.calls == [("milestones", 1)]
+        await box.close()
+        await slow.close()
+
+    @pytest.mark.asyncio
+    async def test_photo_waits_for_its_milestone(self, tmp_path):
+        writer = FakeWriter()
+        box = DBOutbox(str(tmp_path / "o.sqlite"), writer=writer, max_attempts=2, retry_base=0)
+        # Milestone written by another worker: found in the database
+        writer.milestones["remote"] = {"id": 7, "idempotency_key": "remote"}
+        await box.enqueue([photo("p1", milestone_key="remote"), photo("p2", milestone_key="never")])
+
+        assert await box.drain_once() == 1
+        assert writer.photos["p1"]["milestone_id"] == 7
+
+        # Last attempt writes the photo unlinked rather than losing it
+        assert await box.drain_once() == 1
+        assert writer.photos["p2"]["milestone_id"] is None
+        await box.close()
+
+    @pytest.mark.asyncio
+    async def test_workers_sharing_the_file_never_write_an_op_twice(self, tmp_path):
+        path = str(tmp_path / "o.sqlite")
+        first, second = FakeWriter(), FakeWriter()
+        release = asyncio.Event()
+        upsert = first.upsert_milestones
+
+        async def slow_upsert(rows):
+            await release.wait()
+            return await upsert(rows)
+
+        first.upsert_milestones = slow_upsert
+        box_a = DBOutbox(path, writer=first, retry_base=0)
+        box_b = DBOutbox(path, writer=second, retry_base=0)
+        await box_a.enqueue([milestone("m1"), milestone("m2")])
+
+        drain_a = asyncio.create_task(box_a.drain_once())
+        await asyncio.sleep(0.01)
+        # A has claimed the batch and is still writing it
+        assert await box_b.drain_once() == 0
+        await box_b.enqueue([milestone("m3")])
+        assert await box_b.drain_once() == 1
+
+        release.set()
+        assert await drain_a == 2
+        assert sorted(first.milestones) == ["m1", "m2"] and sorted(second.milestones) == ["m3"]
+        assert box_a.get_stats()["pending"] == 0
+        await box_a.close()
+        await box_b.close()
+
+    @pytest.mark.asyncio
+    async def test_claims_of_a_dead_worker_expire(self, tmp_path):
+        path = str(tmp_path / "o.sqlite")
+        crashed = DBOutbox(path, writer=FakeWriter(), claim_timeout=0.05)
+        await crashed.enqueue([milestone("m1")])
+        # Claimed, then the process died before writing
+        assert len(await crashed._claim()) == 1
+        await crashed.conn.close()
+        crashed.conn = None
+
+        writer = FakeWriter()
+        box = DBOutbox(path, writer=writer)
+        assert await box.drain_once() == 0
+        await asyncio.sleep(0.1)
+        assert await box.drain_once() == 1
+        assert sorted(writer.milestones) == ["m1"]
+        await box.close()
+
+    @pytest.mark.asyncio
+    async def test_close_stops_worker_before_closing(self, tmp_path):
+        """close() waits for run() to exit; the database is not reopened afterwards."""
+        writer = FakeWriter()
+        box = DBOutbox(str(tmp_path / "o.sqlite"), writer=writer, retry_base=0)
+        worker = asyncio.create_task(box.run())
+        await box.enqueue([milestone("m1")])
+        await asyncio.sleep(0.01)
+
+        await box.close()
+
+        assert worker.done() and box.conn is None
+        assert "m1" in writer.milestones
+        with pytest.raises(RuntimeError):
+            await box.drain_once()
+        assert box.conn is None
+
+
+class TestToolPersistence:
+    """Test that agent turns queue their writes instead of awaiting Supabase."""
+
+    @pytest.mark.asyncio
+    async def test_turn_only_enqueues(self, fake_db, tmp_path, monkeypatch):
+        from graph import execute_tools
+
+        box = DBOutbox(str(tmp_path / "outbox.sqlite"), retry_base=0)
+        monkeypatch.setattr(outbox_module, "db_outbox", box)
+        message = MagicMock()
+        message.tool_calls = [
+            {"id": "t1", "name": "create_milestone", "args": {"name": "Machu Picchu"}},
+            {"id": "t2", "name": "register_photo", "args": {"description": "Vista"}},
+            {"id": "t3", "name": "register_photo", "args": {"description": "Grupo"}},
+        ]
+        state = {
+            "messages": [message],
+            "expenses": [], "payments": [], "balances": {}, "participants": [],
+            "milestones": [],
+            "photos": [],
+            "session_context": {
+                "trip_id": 1,
+                "current_user": "juan",
+                "pending_uploads": [{"url": f"https://x/{i}.jpg", "path": f"ABC123/{i}.jpg"} for i in range(2)]
+            }
+        }
+
+        result = await execute_tools(state)
+
+        assert fake_db.requests == []
+        assert box.get_stats()["pending"] == 3
+
+        key = result["milestones"][-1]["db_key"]
+        fake_db.tables["milestones"] = [dict(MILESTONE_ROW, idempotency_key=key)]
+        assert await box.drain_once() == 3
+
+        assert [(method, table) for method, table, _ in fake_db.requests] == [
+            ("POST", "milestones"), ("POST", "photos")
+        ]
+        assert fake_db.requests[0][2]["on_conflict"] == "idempotency_key"
+        milestones_body, photos_body = fake_db.bodies
+        assert "photo_count" not in milestones_body[0]
+        assert [(p["description"], p["milestone_id"]) for p in photos_body] == [
+            ("Vista", MILESTONE_ROW["id"]), ("Grupo", MILESTONE_ROW["id"])
+        ]
+        assert {p["idempotency_key"] for p in photos_body} == {p["db_key"] for p in result["photos"]}
+        await box.close()
+
+    @pytest.mark.asyncio
+    async def test_photo_in_legacy_milestone_keeps_its_db_id(self, fake_db, tmp_path, monkeypatch):
+        from graph import execute_tools
+
+        box = DBOutbox(str(tmp_path / "outbox.sqlite"), retry_base=0)
+        monkeypatch.setattr(outbox_module, "db_outbox", box)
+        message = MagicMock()
+        message.tool_calls = [
+            {"id": "t1", "name": "register_photo", "args": {"description": "Vista", "milestone_id": "milestone_1"}},
+        ]
+        state = {
+            "messages": [message],
+            "expenses": [], "payments": [], "balances": {}, "participants": [],
+            # Written before the outbox: a db_id but no db_key
+            "milestones": [{"id": "milestone_1", "name": "Cusco", "db_id": 42, "photo_count": 0, "cover_photo_id": None}],
+            "photos": [],
+            "session_context": {
+                "trip_id": 1,
+                "current_user": "juan",
+                "pending_uploads": [{"url": "https://x/0.jpg", "path": "ABC123/0.jpg"}]
+            }
+        }
+
+        await execute_tools(state)
+        assert await box.drain_once() == 1
+
+        assert [(method, table) for method, table, _ in fake_db.requests] == [("POST", "photos")]
+        assert fake_db.bodies[0][0]["milestone_id"] == 42
+        assert "milestone_key" not in fake_db.bodies[0][0]
+        await box.close()
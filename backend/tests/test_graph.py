@@ -1,6 +1,8 @@
 """
 Tests for the LangGraph agent (graph.py)
 """
+import asyncio
+import sqlite3
 import pytest
 import json
 from unittest.mock import patch, MagicMock, AsyncMock
@@ -156,6 +158,96 @@ class TestCheckpointer:
         except ImportError:
             pytest.fail("langgraph-checkpoint-postgres not installed")
 
+    def test_checkpointer_mode_selection(self, monkeypatch):
+        """Test auto-detection and explicit override of the checkpointer mode."""
+        import graph
+
+        monkeypatch.setattr(graph, "CHECKPOINTER", "")
+        monkeypatch.setattr(graph, "SUPABASE_DB_URL", None)
+        monkeypatch.setattr(graph, "CHECKPOINT_SQLITE_PATH", None)
+        assert graph.get_checkpointer_mode() == "memory"
+
+        monkeypatch.setattr(graph, "CHECKPOINT_SQLITE_PATH", "/tmp/journi.sqlite")
+        assert graph.get_checkpointer_mode() == "sqlite"
+
+        monkeypatch.setattr(graph, "SUPABASE_DB_URL", "postgresql://example")
+        assert graph.get_checkpointer_mode() == "postgres"
+
+        monkeypatch.setattr(graph, "CHECKPOINTER", "sqlite")
+        assert graph.get_checkpointer_mode() == "sqlite"
+
+    @pytest.mark.asyncio
+    async def test_sqlite_checkpointer_persists_across_reopen(self, tmp_path):
+        """Test that state written through the SQLite checkpointer survives a restart."""
+        from graph import build_graph_builder
+        from sqlite_checkpointer import create_sqlite_checkpointer
+
+        path = str(tmp_path / "checkpoints.sqlite")
+        config = {"configurable": {"thread_id": "ABC123"}}
+
+        saver = await create_sqlite_checkpointer(path, commit_interval_ms=1000)
+        agent = build_graph_builder().compile(checkpointer=saver)
+        await agent.aupdate_state(config, {"participants": ["meli", "andre"]})
+        await saver.aclose()
+
+        saver = await create_sqlite_checkpointer(path)
+        agent = build_graph_builder().compile(checkpointer=saver)
+        state = await agent.aget_state(config)
+        await saver.aclose()
+
+        assert state.values["participants"] == ["meli", "andre"]
+
+    @pytest.mark.asyncio
+    async def test_sqlite_checkpointer_batches_commits(self, tmp_path):
+        """Test that several checkpoint writes share one commit."""
+        from graph import build_graph_builder
+        from sqlite_checkpointer import create_sqlite_checkpointer
+
+        saver = await create_sqlite_checkpointer(str(tmp_path / "c.sqlite"), commit_interval_ms=1000)
+        agent = build_graph_builder().compile(checkpointer=saver)
+        flushed_before = saver.conn.commits_flushed
+
+        config = {"configurable": {"thread_id": "BATCH1"}}
+        for i in range(5):
+            await agent.aupdate_state(config, {"participants": [f"user{i}"]})
+
+        assert saver.conn.commits_requested >= 5
+        assert saver.conn.commits_flushed == flushed_before
+
+        await saver.flush()
+        assert saver.conn.commits_flushed == flushed_before + 1
+        await saver.aclose()
+
+    @pytest.mark.asyncio
+    async def test_sqlite_deferred_flush_waits_for_writes(self, tmp_path):
+        """Test that the timed flush never commits inside a checkpoint write, and keeps failed batches."""
+        from sqlite_checkpointer import create_sqlite_checkpointer
+
+        saver = await create_sqlite_checkpointer(str(tmp_path / "c.sqlite"), commit_interval_ms=10)
+        conn = saver.conn
+
+        async with saver.lock:
+            await conn.commit()
+            await asyncio.sleep(0.05)
+            # Due, but the write in progress holds the lock
+            assert conn._pending == 1
+        await asyncio.sleep(0.02)
+        assert conn._pending == 0
+
+        real_commit = conn._conn.commit
+
+        async def failing_commit():
+            raise sqlite3.OperationalError("disk I/O error")
+
+        conn._pending = 2
+        conn._conn.commit = failing_commit
+        with pytest.raises(sqlite3.OperationalError):
+            await saver.flush()
+        assert conn._pending == 2
+
+        conn._conn.commit = real_commit
+        await saver.aclose()
+
 
 class TestLLMFallback:
     """Test the LLM fallback chain."""
@@ -240,6 +332,35 @@ class TestExecuteTools:
         assert result["balances"]["meli"]["PEN"] == 50.0
         assert result["balances"]["andre"]["PEN"] == -50.0
 
+    @pytest.mark.asyncio
+    async def test_ids_are_not_reused_after_a_delete(self):
+        """A new expense gets an id past every existing one, not len + 1."""
+        from graph import execute_tools
+
+        mock_message = MagicMock()
+        mock_message.tool_calls = [{
+            "id": "test_id",
+            "name": "register_expense",
+            "args": {"amount": 30.0, "description": "taxi", "paid_by": "meli", "split_among": None}
+        }]
+
+        # exp_1 was deleted, so the list length points at exp_2 again
+        state = {
+            "messages": [mock_message],
+            "expenses": [{"id": "exp_2", "amount": 20.0, "currency": "PEN", "description": "cena",
+                          "paid_by": "andre", "split_among": ["meli", "andre"]}],
+            "payments": [],
+            "balances": {},
+            "participants": ["meli", "andre"],
+            "milestones": [],
+            "photos": [],
+            "session_context": {}
+        }
+
+        result = await execute_tools(state)
+
+        assert [e["id"] for e in result["expenses"]] == ["exp_2", "exp_3"]
+
     @pytest.mark.asyncio
     async def test_execute_register_payment(self):
         """Test executing register_payment tool."""
@@ -0,0 +1,202 @@
+"""
+Tests for the SQL ledger mirror (services/ledger_service.py)
+"""
+import pytest
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import db_outbox as outbox_module
+from db_outbox import DBOutbox, ledger_op
+from services import ledger_service
+from services.ledger_service import ledger_entries, split_equally
+from tests.test_async_repository import fake_db  # noqa: F401 (fixture)
+from tests.test_db_outbox import FakeWriter
+
+
+def expense(expense_id, amount, paid_by, split_among, split_amounts=None, currency="PEN"):
+    return {
+        "id": expense_id, "amount": amount, "currency": currency, "description": "Cena",
+        "paid_by": paid_by, "split_among": split_among, "split_amounts": split_amounts
+    }
+
+
+def sql_balances(entries: list) -> dict:
+    """What the trip_ledger_balances view computes from the mirrored rows."""
+    balances = {}
+    for entry in entries:
+        per_person = balances.setdefault(entry["currency"], {})
+        payer = entry["paid_by_name"]
+        per_person[payer] = per_person.get(payer, 0) + Decimal(entry["amount"])
+        for split in entry["splits"]:
+            person = split["person_name"]
+            per_person[person] = per_person.get(person, 0) - Decimal(split["amount"])
+    return balances
+
+
+class FakeLedgerWriter:
+    """Keeps the newest snapshot per trip, like sync_trip_ledger."""
+
+    def __init__(self):
+        self.calls = []
+        self.snapshots = {}
+        self.fail = 0
+
+    async def sync_trip_ledger(self, trip_id, version, entries):
+        self.calls.append((trip_id, version))
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("connection reset")
+        current = self.snapshots.get(trip_id)
+        if current and current[0] >= version:
+            return False
+        self.snapshots[trip_id] = (version, entries)
+        return True
+
+
+class TestLedgerEntries:
+    """Test how state expenses and payments become mirrored rows."""
+
+    def test_equal_split_adds_up_to_the_cent(self):
+        splits = split_equally(100, ["ana", "beto", "caro"])
+
+        assert [s["amount"] for s in splits] == ["33.34", "33.33", "33.33"]
+        assert sum(Decimal(s["amount"]) for s in splits) == Decimal("100.00")
+
+    def test_entries_match_agent_balances(self):
+        expenses = [
+            expense("exp_1", 90, "ana", ["ana", "beto", "caro"]),
+            expense("exp_2", 50, "beto", ["ana", "beto"], split_amounts={"ana": 30, "beto": 20}),
+            expense("exp_3", 20, "caro", ["caro"], currency="USD"),
+        ]
+        payments = [{"id": "pay_1", "from_user": "beto", "to_user": "ana", "amount": 10, "currency": "PEN"}]
+
+        entries = ledger_entries(expenses, payments)
+
+        assert [(e["ledger_id"], e["kind"]) for e in entries] == [
+            ("exp_1", "expense"), ("exp_2", "expense"), ("exp_3", "expense"), ("pay_1", "payment")
+        ]
+        assert entries[1]["splits"] == [
+            {"person_name": "ana", "amount": "30.00"}, {"person_name": "beto", "amount": "20.00"}
+        ]
+        # Same numbers the agent keeps in state (payer up, receiver down)
+        assert sql_balances(entries) == {
+            "PEN": {"ana": Decimal("20"), "beto": Decimal("10"), "caro": Decimal("-30")},
+            "USD": {"caro": Decimal("0")},
+        }
+
+    def test_skips_entries_the_schema_rejects(self):
+        expenses = [expense("exp_1", 0, "ana", ["ana"]), expense("exp_2", 10, "ana", [])]
+
+        assert ledger_entries(expenses, []) == []
+
+
+class TestLedgerSync:
+    """Test that ledger snapshots go through the outbox."""
+
+    @pytest.mark.asyncio
+    async def test_newest_snapshot_per_trip_wins(self, tmp_path):
+        ledger = FakeLedgerWriter()
+        box = DBOutbox(str(tmp_path / "o.sqlite"), writer=FakeWriter(), ledger_writer=ledger, retry_base=0)
+        first = ledger_op(1, [expense("exp_1", 10, "ana", ["ana"])], [])
+        second = ledger_op(1, [expense("exp_1", 10, "ana", ["ana"]), expense("exp_2", 5, "ana", ["ana"])], [])
+        other = ledger_op(2, [expense("exp_1", 7, "beto", ["beto"])], [])
+        await box.enqueue([first, other, second])
+
+        assert await box.drain_once() == 3
+
+        # One sync per trip; the superseded snapshot is never sent
+        assert sorted(ledger.calls) == [(1, second[2]["version"]), (2, other[2]["version"])]
+        assert len(ledger.snapshots[1][1]) == 2
+        assert box.get_stats()["pending"] == 0
+        await box.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_sync_is_retried(self, tmp_path):
+        ledger = FakeLedgerWriter()
+        ledger.fail = 1
+        box = DBOutbox(str(tmp_path / "o.sqlite"), writer=FakeWriter(), ledger_writer=ledger, retry_base=0)
+        await box.enqueue([ledger_op(1, [expense("exp_1", 10, "ana", ["ana"])], [])])
+
+        assert await box.drain_once() == 0
+        assert await box.drain_once() == 1
+        assert len(ledger.calls) == 2 and 1 in ledger.snapshots
+        await box.close()
+
+    @pytest.mark.asyncio
+    async def test_money_turn_enqueues_a_snapshot(self, fake_db, tmp_path, monkeypatch):
+        from graph import execute_tools
+
+        box = DBOutbox(str(tmp_path / "outbox.sqlite"), retry_base=0)
+        monkeypatch.setattr(outbox_module, "db_outbox", box)
+        message = MagicMock()
+        message.tool_calls = [
+            {"id": "t1", "name": "register_expense",
+             "args": {"amount": 60, "description": "Taxi", "paid_by": "ana", "split_among": ["ana", "beto"]}},
+            {"id": "t2", "name": "register_payment",
+             "args": {"from_user": "beto", "to_user": "ana", "amount": 30}},
+        ]
+        state = {
+            "messages": [message],
+            "expenses": [], "payments": [], "balances": {}, "participants": [],
+            "milestones": [], "photos": [],
+            "session_context": {"trip_id": 1, "current_user": "ana"}
+        }
+
+        await execute_tools(state)
+
+        assert fake_db.requests == []
+        assert box.get_stats()["pending"] == 1
+        fake_db.functions["sync_trip_ledger"] = lambda body: True
+        assert await box.drain_once() == 1
+
+        assert [(method, table) for method, table, _ in fake_db.requests] == [("POST", "sync_trip_ledger")]
+        body = fake_db.bodies[0]
+        assert body["p_trip_id"] == 1
+        assert [(e["ledger_id"], e["paid_by_name"]) for e in body["p_entries"]] == [
+            ("exp_1", "ana"), ("pay_1", "beto")
+        ]
+        await box.close()
+
+    @pytest.mark.asyncio
+    async def test_other_turns_do_not_sync(self, fake_db, tmp_path, monkeypatch):
+        from graph import execute_tools
+
+        box = DBOutbox(str(tmp_path / "outbox.sqlite"), retry_base=0)
+        monkeypatch.setattr(outbox_module, "db_outbox", box)
+        message = MagicMock()
+        message.tool_calls = [{"id": "t1", "name": "get_balance", "args": {}}]
+        state = {
+            "messages": [message],
+            "expenses": [], "payments": [], "balances": {}, "participants": [],
+            "milestones": [], "photos": [],
+            "session_context": {"trip_id": 1}
+        }
+
+        await execute_tools(state)
+
+        assert box.get_stats()["enqueued"] == 0
+        await box.close()
+
+
+class TestLedgerReads:
+    """Test reading the aggregate views."""
+
+    @pytest.mark.asyncio
+    async def test_balances_and_totals(self, fake_db):
+        fake_db.tables["trip_ledger_balances"] = [
+            {"person": "Ana", "currency": "PEN", "balance": "20.00"},
+            {"person": "Beto", "currency": "PEN", "balance": "-20.00"},
+            {"person": "Ana", "currency": "USD", "balance": "0.00"},
+        ]
+        fake_db.tables["trip_ledger_totals"] = [
+            {"currency": "PEN", "total_spent": "60.00", "expense_count": 1, "payment_count": 1},
+        ]
+
+        balances = await ledger_service.get_trip_balances(1)
+        totals = await ledger_service.get_trip_totals(1)
+
+        assert balances == {"Ana": {"PEN": 20.0, "USD": 0.0}, "Beto": {"PEN": -20.0}}
+        assert totals == {"PEN": {"total_spent": 60.0, "expense_count": 1, "payment_count": 1}}
+        assert [(table, params["trip_id"]) for _, table, params in fake_db.requests] == [
+            ("trip_ledger_balances", "eq.1"), ("trip_ledger_totals", "eq.1")
+        ]
@@ -0,0 +1,160 @@
+"""
+Tests for keyset pagination (services/pagination.py) and the trip listing
+"""
+import pytest
+
+from services import session_service
+from services.supabase_db import SupabaseDB, PHOTO_GRID_FIELDS
+from services.pagination import (
+    InvalidPageRequest, encode_cursor, decode_cursor, clamp_limit, page_of, select_columns,
+    MAX_PAGE_SIZE
+)
+from tests.test_async_repository import fake_db, TRIP, PHOTO  # noqa: F401 (fixture)
+
+
+def make_trips(n):
+    """n trips, newest first, two per created_at so ties need the id."""
+    return [
+        dict(TRIP, id=n - i, created_at=f"2026-01-{10 + (n - i) // 2:02d}T08:00:00.123+00:00")
+        for i in range(n)
+    ]
+
+
+class TestCursor:
+    """Test cursor encoding, page splitting and projections."""
+
+    def test_cursor_round_trip(self):
+        row = {"id": 42, "created_at": "2026-01-02T03:04:05.678+00:00"}
+
+        cursor = encode_cursor(row)
+
+        assert "=" not in cursor
+        assert decode_cursor(cursor) == ("2026-01-02T03:04:05.678+00:00", 42)
+
+    @pytest.mark.parametrize("cursor", ["garbage", "W10", encode_cursor({"id": "1", "created_at": "x"})])
+    def test_rejects_foreign_cursors(self, cursor):
+        with pytest.raises(InvalidPageRequest):
+            decode_cursor(cursor)
+
+    def test_page_of(self):
+        rows = make_trips(4)
+
+        page, cursor = page_of(rows, 3)
+        last, end = page_of(rows[3:], 3)
+
+        assert page == rows[:3]
+        assert decode_cursor(cursor) == (rows[2]["created_at"], rows[2]["id"])
+        assert last == rows[3:] and end is None
+        assert clamp_limit(None) > 0 and clamp_limit(0) == 1 and clamp_limit(10 ** 6) == MAX_PAGE_SIZE
+
+    def test_select_columns(self):
+        allowed = ("id", "name", "status", "created_at")
+
+        assert select_columns(None, allowed, "id,name") == "id,name"
+        # Keys the cursor needs are always selected, once
+        assert select_columns(["name", "id"], allowed, "id,name") == "id,created_at,name"
+        with pytest.raises(InvalidPageRequest):
+            select_columns(["name", "secret"], allowed, "id")
+
+
+class TestUserTrips:
+    """Test that the trip listing is one projected, keyset-paged query."""
+
+    @pytest.mark.asyncio
+    async def test_single_joined_query(self, fake_db):
+        fake_db.tables["trips"] = [dict(TRIP, trip_participants=[{"user_id": "u1"}])]
+
+        page = await session_service.get_user_trips("u1", status="active")
+
+        assert page == {"trips": [TRIP], "next_cursor": None, "total": None}
+        assert len(fake_db.requests) == 1
+        method, table, params = fake_db.requests[0]
+        assert (method, table) == ("GET", "trips")
+        assert params["select"].endswith("trip_participants!inner(user_id)")
+        assert "*" not in params["select"]
+        assert params["trip_participants.user_id"] == "eq.u1"
+        assert params["status"] == "eq.active"
+        assert params["order"] == "created_at.desc,id.desc"
+
+    @pytest.mark.asyncio
+    async def test_cursor_continues_after_last_row(self, fake_db):
+        trips = make_trips(5)
+        fake_db.tables["trips"] = trips[:3]
+
+        first = await session_service.get_user_trips("u1", limit=2, fields=["name"])
+        await session_service.get_user_trips("u1", limit=2, cursor=first["next_cursor"])
+
+        assert first["trips"] == trips[:2]
+        first_params, next_params = fake_db.requests[0][2], fake_db.requests[1][2]
+        assert first_params["limit"] == "3"
+        assert first_params["select"] == "id,created_at,name,trip_participants!inner(user_id)"
+        assert "or" not in first_params
+        created_at, row_id = trips[1]["created_at"], trips[1]["id"]
+        assert next_params["or"] == (
+            f'(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{row_id}))'
+        )
+
+    @pytest.mark.asyncio
+    async def test_total_counts_all_trips(self, fake_db):
+        fake_db.tables["trips"] = make_trips(3)
+
+        page = await session_service.get_user_trips("u1", limit=2, with_total=True)
+
+        assert len(page["trips"]) == 2
+        assert page["total"] == 3
+
+    @pytest.mark.asyncio
+    async def test_default_columns_cover_the_dashboard(self, fake_db):
+        fake_db.tables["trips"] = [TRIP]
+
+        await session_service.get_user_trips("u1")
+
+        columns = fake_db.requests[0][2]["select"].split(",")
+        for column in ("subtitle", "cover_image_url", "updated_at", "session_code", "status"):
+            assert column in columns
+
+    @pytest.mark.asyncio
+    async def test_bad_requests_make_no_query(self, fake_db):
+        with pytest.raises(InvalidPageRequest):
+            await session_service.get_user_trips("u1", cursor="not-a-cursor")
+        with pytest.raises(InvalidPageRequest):
+            await session_service.get_user_trips("u1", fields=["session_code", "password"])
+
+        assert fake_db.requests == []
+
+
+class TestPhotoListing:
+    """Test photo and milestone pages: projections, order and totals."""
+
+    @pytest.mark.asyncio
+    async def test_gallery_grid_projection_with_total(self, fake_db):
+        page = await SupabaseDB().get_trip_photos(1, fields=PHOTO_GRID_FIELDS, with_total=True)
+
+        assert page == {"photos": [PHOTO], "next_cursor": None, "total": 1}
+        params = fake_db.requests[0][2]
+        assert params["select"] == "id,created_at,photo_url,thumbnail_url"
+        assert params["trip_id"] == "eq.1"
+        assert params["order"] == "created_at.desc,id.desc"
+
+    @pytest.mark.asyncio
+    async def test_milestone_photos_page_in_upload_order(self, fake_db):
+        photos = [dict(PHOTO, id=i, created_at=f"2026-01-02T00:00:0{i}Z") for i in range(1, 4)]
+        fake_db.tables["photos"] = photos
+
+        first = await SupabaseDB().get_milestone_photos(7, limit=2)
+        await SupabaseDB().get_milestone_photos(7, limit=2, cursor=first["next_cursor"])
+
+        assert first["photos"] == photos[:2] and first["total"] is None
+        first_params, next_params = fake_db.requests[0][2], fake_db.requests[1][2]
+        assert first_params["select"] == "*"
+        assert first_params["order"] == "created_at.asc,id.asc"
+        assert next_params["or"] == (
+            '(created_at.gt."2026-01-02T00:00:02Z",and(created_at.eq."2026-01-02T00:00:02Z",id.gt.2))'
+        )
+
+    @pytest.mark.asyncio
+    async def test_unknown_milestone_field_is_rejected(self, fake_db):
+        with pytest.raises(InvalidPageRequest):
+            await SupabaseDB().get_trip_milestones(1, fields=["name", "photo_url"])
+
+        assert fake_db.requests == []
@@ -0,0 +1,441 @@
+"""
+Tests for WebSocket room management (room_manager.py)
+"""
+import asyncio
+import json
+import pytest
+
+from room_manager import RoomManager, Connection
+
+
+class FakeWebSocket:
+    """Minimal stand-in for a FastAPI WebSocket."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+
+class StalledWebSocket(FakeWebSocket):
+    """A client on a bad connection: sends block until released."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+        self.close_code = None
+
+    async def send_text(self, text):
+        await self.release.wait()
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+class TestRoomSnapshot:
+    """Test snapshot-on-join and history paging."""
+
+    @pytest.mark.asyncio
+    async def test_connect_returns_recent_page_only(self):
+        """Joining returns the tail of the history plus a cursor for older pages."""
+        rooms = RoomManager()
+        first = FakeWebSocket()
+        await rooms.connect("ABC123", "meli", first)
+        for i in range(120):
+            await rooms.broadcast("ABC123", {"type": "user_message", "user_id": "meli", "content": str(i)})
+
+        page = await rooms.connect("ABC123", "andre", FakeWebSocket(), history_limit=50)
+
+        assert [m["content"] for m in page["messages"]] == [str(i) for i in range(70, 120)]
+        assert page["before"] == 70
+        assert rooms.get_online_users("ABC123") == ["andre", "meli"]
+
+    @pytest.mark.asyncio
+    async def test_history_pages_walk_back_to_start(self):
+        """Following the cursor returns every message exactly once."""
+        rooms = RoomManager()
+        await rooms.connect("ABC123", "meli", FakeWebSocket())
+        for i in range(45):
+            await rooms.broadcast("ABC123", {"type": "user_message", "user_id": "meli", "content": str(i)})
+
+        page = rooms.get_history_page("ABC123", limit=20)
+        seen = page["messages"]
+        while page["before"] is not None:
+            page = rooms.get_history_page("ABC123", before=page["before"], limit=20)
+            seen = page["messages"] + seen
+
+        assert [m["content"] for m in seen] == [str(i) for i in range(45)]
+
+    def test_history_page_ignores_bad_client_values(self):
+        """Non-integer cursors/limits from clients fall back to defaults."""
+        rooms = RoomManager()
+        assert rooms.get_history_page("NOPE", before="x", limit="y") == {"messages": [], "before": None}
+
+    @pytest.mark.asyncio
+    async def test_disconnect_updates_presence(self):
+        """Users drop out of online_users once their last socket closes."""
+        rooms = RoomManager()
+        ws = FakeWebSocket()
+        await rooms.connect("ABC123", "meli", ws)
+        await rooms.disconnect("ABC123", "meli", ws)
+
+        assert rooms.get_online_users("ABC123") == []
+        # Still a participant, they may reconnect
+        assert rooms.get_participants("ABC123") == ["meli"]
+
+
+class TestSendQueues:
+    """Test per-connection send queues and slow-consumer policies."""
+
+    @pytest.mark.asyncio
+    async def test_slow_client_does_not_delay_others(self):
+        """A stalled socket doesn't hold up delivery to the rest of the room."""
+        rooms = RoomManager()
+        fast = FakeWebSocket()
+        slow = StalledWebSocket()
+        await rooms.connect("ABC123", "meli", fast)
+        await rooms.connect("ABC123", "andre", slow)
+
+        for i in range(5):
+            await rooms.broadcast("ABC123", {"type": "user_message", "content": str(i)})
+        await rooms.connections[fast].flush()
+
+        assert [m["content"] for m in fast.sent] == ["0", "1", "2", "3", "4"]
+        assert slow.sent == []
+        slow_stats = next(s for s in rooms.get_connection_stats("ABC123") if s["user_id"] == "andre")
+        assert slow_stats["queued"] >= 4
+
+        slow.release.set()
+        await rooms.connections[slow].flush()
+        assert [m["content"] for m in slow.sent] == ["0", "1", "2", "3", "4"]
+
+    @pytest.mark.asyncio
+    async def test_queued_chunks_are_coalesced(self):
+        """Chunks waiting behind a slow send are merged without losing text."""
+        ws = StalledWebSocket()
+        conn = Connection(ws, "andre", max_queue=10)
+        conn.start()
+
+        conn.enqueue({"type": "bot_typing", "active": True})
+        for token in ["Lis", "to, ", "regis", "tré"]:
+            conn.enqueue({"type": "bot_chunk", "content": token})
+
+        assert len(conn.queue) == 2
+        assert conn.coalesced == 3
+        ws.release.set()
+        await conn.flush()
+
+        assert ws.sent[1] == {"type": "bot_chunk", "content": "Listo, registré"}
+        assert conn.get_stats()["sent"] == 2
+        conn.close()
+
+    @pytest.mark.asyncio
+    async def test_full_queue_drops_chunks_then_closes(self):
+        """Chunks are dropped first; a client that can't keep up is closed."""
+        ws = StalledWebSocket()
+        dead = []
+        conn = Connection(ws, "andre", max_queue=3, on_dead=dead.append)
+        conn.start()
+        await asyncio.sleep(0)
+
+        conn.enqueue({"type": "user_message", "content": "a"})
+        conn.enqueue({"type": "bot_chunk", "content": "x"})
+        conn.enqueue({"type": "user_message", "content": "b"})
+        # Full: the queued chunk makes room for a regular message
+        assert conn.enqueue({"type": "user_message", "content": "c"})
+        assert conn.dropped == 1
+
+        # Still full with regular messages: connection is given up on
+        assert not conn.enqueue({"type": "user_message", "content": "d"})
+        await asyncio.sleep(0)
+        assert conn.closed
+        assert dead == [conn]
+        assert ws.close_code == 1013
+        conn.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_socket_is_removed_from_room(self):
+        """A socket whose send raises is dropped from the room by its writer."""
+        class BrokenWebSocket(FakeWebSocket):
+            async def send_text(self, text):
+                raise RuntimeError("connection reset")
+
+        rooms = RoomManager()
+        ws = BrokenWebSocket()
+        await rooms.connect("ABC123", "meli", ws)
+        await rooms.broadcast("ABC123", {"type": "user_message", "content": "hola"})
+        await asyncio.sleep(0.01)
+
+        assert rooms.get_connection_count("ABC123") == 0
+        assert ws not in rooms.connections
+
+
+class TestRoomLifecycle:
+    """Test the bounded history ring buffer and idle-room eviction."""
+
+    @pytest.mark.asyncio
+    async def test_history_is_bounded(self):
+        """Only the newest messages are kept and cursors stay absolute."""
+        rooms = RoomManager(history_size=10)
+        await rooms.connect("ABC123", "meli", FakeWebSocket())
+        for i in range(25):
+            await rooms.broadcast("ABC123", {"type": "user_message", "content": str(i)})
+
+        assert [m["content"] for m in rooms.get_history("ABC123")] == [str(i) for i in range(15, 25)]
+
+        page = rooms.get_history_page("ABC123", limit=4)
+        assert [m["content"] for m in page["messages"]] == ["21", "22", "23", "24"]
+        assert page["before"] == 21
+        page = rooms.get_history_page("ABC123", before=page["before"], limit=100)
+        assert [m["content"] for m in page["messages"]] == [str(i) for i in range(15, 21)]
+        assert page["before"] is None
+        # Cursor pointing at messages that already left the ring
+        assert rooms.get_history_page("ABC123", before=5)["messages"] == []
+
+    @pytest.mark.asyncio
+    async def test_history_bytes_gauge(self):
+        """The byte gauge tracks exactly what the ring buffers hold."""
+        from fast_json import dumps
+
+        rooms = RoomManager(history_size=5)
+        await rooms.connect("ABC123", "meli", FakeWebSocket())
+        for i in range(12):
+            await rooms.broadcast("ABC123", {"type": "user_message", "content": "x" * i})
+
+        expected = sum(len(dumps(m)) for m in rooms.get_history("ABC123"))
+        stats = rooms.get_stats()
+        assert stats["history_bytes"] == expected
+        assert stats["history_messages"] == 5
+        assert stats["rooms"] == 1
+
+    @pytest.mark.asyncio
+    async def test_idle_rooms_are_evicted(self):
+        """Empty rooms are dropped after the TTL; occupied ones are kept."""
+        rooms = RoomManager()
+        idle_ws = FakeWebSocket()
+        await rooms.connect("IDLE01", "meli", idle_ws)
+        await rooms.broadcast("IDLE01", {"type": "user_message", "content": "hola"})
+        await rooms.connect("BUSY01", "andre", FakeWebSocket())
+        await rooms.disconnect("IDLE01", "meli", idle_ws)
+
+        assert await rooms.evict_idle_rooms(ttl=60) == []
+        assert await rooms.evict_idle_rooms(ttl=0) == ["IDLE01"]
+
+        stats = rooms.get_stats()
+        assert stats["rooms"] == 1
+        assert stats["rooms_evicted"] == 1
+        assert stats["history_bytes"] == 0
+        assert rooms.get_participants("IDLE01") == []
+
+    @pytest.mark.asyncio
+    async def test_rejoin_cancels_eviction(self):
+        """A room that gets a connection again is no longer idle."""
+        rooms = RoomManager()
+        ws = FakeWebSocket()
+        await rooms.connect("ABC123", "meli", ws)
+        await rooms.disconnect("ABC123", "meli", ws)
+        await rooms.connect("ABC123", "meli", FakeWebSocket())
+
+        assert await rooms.evict_idle_rooms(ttl=0) == []
+
+
+class TestSerializeOnce:
+    """Test encode-once broadcast and the bot_complete frame cache."""
+
+    @pytest.mark.asyncio
+    async def test_broadcast_encodes_once(self, monkeypatch):
+        """A room broadcast is encoded once no matter how many sockets listen."""
+        import room_manager as rm
+
+        calls = []
+        real_dumps = rm.dumps
+
+        def counting_dumps(obj):
+            calls.append(obj)
+            return real_dumps(obj)
+
+        monkeypatch.setattr(rm, "dumps", counting_dumps)
+        rooms = RoomManager()
+        sockets = [FakeWebSocket() for _ in range(20)]
+        for i, ws in enumerate(sockets):
+            await rooms.connect("ABC123", f"user{i}", ws)
+
+        await rooms.broadcast("ABC123", {"type": "user_message", "content": "hola"})
+        for ws in sockets:
+            await rooms.connections[ws].flush()
+
+        assert len(calls) == 1
+        assert all(ws.sent == [sockets[0].sent[0]] for ws in sockets)
+
+    @pytest.mark.asyncio
+    async def test_latest_bot_complete_is_cached(self):
+        """The room keeps its latest bot_complete encoded, and only that."""
+        rooms = RoomManager()
+        await rooms.connect("ABC123", "meli", FakeWebSocket())
+        await rooms.broadcast("ABC123", {"type": "bot_complete", "content": "uno", "base_version": 0, "state_version": 1})
+        await rooms.broadcast("ABC123", {"type": "user_message", "content": "otro"})
+        await rooms.broadcast("ABC123", {"type": "bot_complete", "content": "dos", "base_version": 1, "state_version": 2})
+
+        message, encoded = rooms.get_cached_frame("ABC123")
+        assert message["content"] == "dos"
+        assert json.loads(encoded) == message
+
+        rooms_without_cache = RoomManager(frame_cache=False)
+        await rooms_without_cache.connect("ABC123", "meli", FakeWebSocket())
+        await rooms_without_cache.broadcast("ABC123", {"type": "bot_complete", "content": "uno"})
+        assert rooms_without_cache.get_cached_frame("ABC123") is None
+
+
+class TestRoomLocking:
+    """Test that rooms don't contend with each other."""
+
+    @pytest.mark.asyncio
+    async def test_broadcast_does_not_wait_on_other_rooms(self):
+        """A membership change holding one room's lock doesn't block another room."""
+        rooms = RoomManager()
+        ws = FakeWebSocket()
+        await rooms.connect("ROOM_B", "andre", ws)
+
+        async with rooms._room_lock("ROOM_A"):
+            await asyncio.wait_for(
+                rooms.broadcast("ROOM_B", {"type": "bot_chunk", "content": "hola"}),
+                timeout=0.5
+            )
+            await rooms.connections[ws].flush()
+
+        assert ws.sent[0]["content"] == "hola"
+
+    @pytest.mark.asyncio
+    async def test_join_during_fan_out_is_safe(self):
+        """Joining replaces the member set instead of mutating the one being iterated."""
+        rooms = RoomManager()
+        await rooms.connect("ABC123", "meli", FakeWebSocket())
+        members_before = rooms.active_connections["ABC123"]
+
+        await rooms.connect("ABC123", "andre", FakeWebSocket())
+
+        assert len(members_before) == 1
+        assert rooms.get_connection_count("ABC123") == 2
+
+
+class TestHeartbeat:
+    """Test heartbeat pings, dead-socket reaping and presence."""
+
+    @pytest.mark.asyncio
+    async def test_live_sockets_get_pinged(self):
+        """Responsive clients receive a ping and stay connected."""
+        rooms = RoomManager()
+        ws = FakeWebSocket()
+        await rooms.connect("ABC123", "meli", ws)
+
+        assert await rooms.heartbeat(timeout=60) == 0
+        await rooms.connections[ws].flush()
+
+        assert ws.sent == [{"type": "ping"}]
+        assert rooms.get_connection_count("ABC123") == 1
+
+    @pytest.mark.asyncio
+    async def test_silent_sockets_are_reaped(self):
+        """A socket that hasn't sent anything within the timeout is dropped and closed."""
+        rooms = RoomManager()
+        dead = StalledWebSocket()
+        alive = FakeWebSocket()
+        await rooms.connect("ABC123", "meli", dead)
+        await rooms.connect("ABC123", "andre", alive)
+
+        rooms.connections[dead].last_seen -= 120
+        rooms.touch(alive)
+        assert await rooms.heartbeat(timeout=60) == 1
+        await asyncio.sleep(0)
+
+        assert dead.close_code == 4000
+        assert dead not in rooms.connections
+        assert rooms.get_online_users("ABC123") == ["andre"]
+        assert rooms.get_stats()["sockets_reaped"] == 1
+
+        # Broadcasts no longer spend time on the dead socket
+        await rooms.broadcast("ABC123", {"type": "user_message", "content": "hola"})
+        assert len(rooms.active_connections["ABC123"]) == 1
+
+    @pytest.mark.asyncio
+    async def test_presence_has_last_seen(self):
+        """Offline users stay in presence with a last-seen time until the TTL."""
+        import room_manager as rm
+
+        rooms = RoomManager()
+        ws = FakeWebSocket()
+        await rooms.connect("ABC123", "meli", ws)
+        await rooms.connect("ABC123", "andre", FakeWebSocket())
+        await rooms.disconnect("ABC123", "meli", ws)
+
+        presence = {p["user_id"]: p for p in rooms.get_presence("ABC123")}
+        assert presence["andre"]["online"] is True
+        assert presence["meli"]["online"] is False
+        assert presence["meli"]["last_seen"]
+
+        # Long gone: dropped from presence on the next heartbeat
+        rooms.presence["ABC123"]["meli"] -= rm.PRESENCE_TTL + 1
+        await rooms.heartbeat()
+        assert rooms.get_participants("ABC123") == ["andre"]
+
+
+class TestResume:
+    """Test sequence numbers and resuming after a reconnect."""
+
+    @pytest.mark.asyncio
+    async def test_stored_frames_get_sequence_numbers(self):
+        """Room frames are numbered; streaming chunks are not."""
+        rooms = RoomManager()
+        ws = FakeWebSocket()
+        await rooms.connect("ABC123", "meli", ws)
+        await rooms.broadcast("ABC123", {"type": "user_message", "content": "hola"})
+        await rooms.broadcast("ABC123", {"type": "bot_chunk", "content": "Lis"})
+        await rooms.broadcast("ABC123", {"type": "bot_complete", "content": "Listo"})
+        await rooms.connections[ws].flush()
+
+        assert [m.get("seq") for m in ws.sent] == [1, None, 2]
+
+    @pytest.mark.asyncio
+    async def test_reconnect_gets_only_missed_frames(self):
+        """A client resuming from its last seq gets the gap, not a snapshot."""
+        rooms = RoomManager()
+        await rooms.connect("ABC123", "andre", FakeWebSocket())
+        ws = FakeWebSocket()
+        joined = await rooms.connect("ABC123", "meli", ws)
+        for i in range(3):
+            await rooms.broadcast("ABC123", {"type": "user_message", "content": str(i)})
+        await rooms.disconnect("ABC123", "meli", ws)
+
+        # Sent while meli was offline
+        await rooms.broadcast("ABC123", {"type": "user_message", "content": "3"})
+        await rooms.broadcast("ABC123", {"type": "bot_complete", "content": "4"})
+
+        page = await rooms.connect("ABC123", "meli", FakeWebSocket(), resume_seq=3, resume_epoch=joined["epoch"])
+
+        assert page["resumed"] is True
+        assert [m["content"] for m in page["messages"]] == ["3", "4"]
+        assert page["last_seq"] == 5
+
+    @pytest.mark.asyncio
+    async def test_resume_falls_back_to_snapshot(self):
+        """Unknown epochs and gaps past the ring buffer get a normal join page."""
+        rooms = RoomManager(history_size=5)
+        joined = await rooms.connect("ABC123", "meli", FakeWebSocket())
+        for i in range(10):
+            await rooms.broadcast("ABC123", {"type": "user_message", "content": str(i)})
+
+        too_old = await rooms.connect("ABC123", "andre", FakeWebSocket(), resume_seq=2, resume_epoch=joined["epoch"])
+        restarted = await rooms.connect("ABC123", "ana", FakeWebSocket(), resume_seq=9, resume_epoch="old")
+
+        for page in (too_old, restarted):
+            assert page["resumed"] is False
+            assert [m["content"] for m in page["messages"]] == ["5", "6", "7", "8", "9"]
+            assert page["last_seq"] == 10
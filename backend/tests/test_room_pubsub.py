@@ -0,0 +1,144 @@
+"""
+Tests for cross-process room fan-out (room_pubsub.py)
+"""
+import pytest
+
+from room_manager import RoomManager
+from room_pubsub import (
+    InProcessPubSub, PostgresPubSub, NotifyAssembler, encode_notify_parts, MAX_NOTIFY_PART
+)
+from tests.test_room_manager import FakeWebSocket
+
+
+class FakeBus:
+    """Stands in for Postgres: every subscriber gets every published message."""
+
+    def __init__(self):
+        self.subscribers = []
+
+    def backend(self):
+        bus = self
+
+        class BusPubSub(InProcessPubSub):
+            async def start(self, handler):
+                self.handler = handler
+                bus.subscribers.append(handler)
+
+            async def publish(self, thread_id, message):
+                for handler in bus.subscribers:
+                    await handler(thread_id, message)
+
+        return BusPubSub()
+
+
+class TestRoomPubSub:
+    """Test pluggable fan-out behind RoomManager.broadcast."""
+
+    @pytest.mark.asyncio
+    async def test_default_backend_is_in_process(self):
+        """Without configuration, broadcast delivers to local sockets."""
+        rooms = RoomManager()
+        ws = FakeWebSocket()
+        await rooms.connect("ABC123", "meli", ws)
+        await rooms.broadcast("ABC123", {"type": "user_message", "content": "hola"})
+        await rooms.connections[ws].flush()
+
+        assert ws.sent[0]["content"] == "hola"
+        assert rooms.get_stats()["pubsub"]["backend"] == "memory"
+
+    @pytest.mark.asyncio
+    async def test_broadcast_reaches_other_workers(self):
+        """A message published by one worker reaches sockets on another."""
+        bus = FakeBus()
+        worker_a, worker_b = RoomManager(), RoomManager()
+        await worker_a.use_pubsub(bus.backend())
+        await worker_b.use_pubsub(bus.backend())
+
+        web_client = FakeWebSocket()
+        await worker_a.connect("ABC123", "meli", web_client)
+
+        # WhatsApp webhook handled by worker B, which has no sockets for the room
+        await worker_b.broadcast("ABC123", {"type": "whatsapp_message", "content": "pagué 20"})
+        await worker_a.connections[web_client].flush()
+
+        assert web_client.sent[0]["content"] == "pagué 20"
+        assert "timestamp" in web_client.sent[0]
+        assert worker_a.get_history("ABC123")[0]["type"] == "whatsapp_message"
+        assert worker_b.get_history("ABC123") == []
+
+    @pytest.mark.asyncio
+    async def test_connection_counts_span_workers(self):
+        """A room is only empty when no worker holds a socket for it."""
+        bus = FakeBus()
+        worker_a, worker_b = RoomManager(), RoomManager()
+        await worker_a.use_pubsub(bus.backend())
+        await worker_b.use_pubsub(bus.backend())
+
+        phone, laptop = FakeWebSocket(), FakeWebSocket()
+        await worker_a.connect("ABC123", "meli", phone)
+        await worker_b.connect("ABC123", "andre", laptop)
+        assert worker_a.get_room_connection_count("ABC123") == 2
+
+        await worker_a.disconnect("ABC123", "meli", phone)
+        assert worker_a.get_connection_count("ABC123") == 0
+        assert worker_a.get_room_connection_count("ABC123") == 1
+
+        await worker_b.disconnect("ABC123", "andre", laptop)
+        assert worker_a.get_room_connection_count("ABC123") == 0
+        assert worker_a.remote_counts == {}
+
+    @pytest.mark.asyncio
+    async def test_counts_from_silent_workers_expire(self, monkeypatch):
+        """A worker that died without saying goodbye stops counting."""
+        import room_manager
+
+        rooms = RoomManager()
+        rooms._on_remote_count({"origin": "dead", "thread_id": "ABC123", "count": 3})
+        assert rooms.get_room_connection_count("ABC123") == 3
+
+        monkeypatch.setattr(room_manager, "REMOTE_COUNT_TTL", 0)
+        assert rooms.get_room_connection_count("ABC123") == 0
+        await rooms.heartbeat()
+        assert rooms.remote_counts == {}
+
+
+class TestNotifyEncoding:
+    """Test NOTIFY payload splitting and reassembly."""
+
+    def test_small_message_is_one_part(self):
+        parts = encode_notify_parts("node1", 0, "ABC123", {"type": "bot_chunk", "content": "Listo"})
+
+        assert len(parts) == 1
+        assert NotifyAssembler().feed(parts[0]) == ("node1", "ABC123", {"type": "bot_chunk", "content": "Listo"})
+
+    def test_large_message_is_split_and_reassembled(self):
+        """Payloads stay under the NOTIFY limit, including non-ASCII text."""
+        message = {"type": "bot_complete", "content": "ñandú pagó " * 3000}
+        parts = encode_notify_parts("node1", 7, "ABC123", message)
+
+        assert len(parts) > 1
+        assert all(len(p.encode("utf-8")) < 8000 for p in parts)
+        assert all(len(p) <= MAX_NOTIFY_PART + 40 for p in parts)
+
+        assembler = NotifyAssembler()
+        results = [assembler.feed(p) for p in reversed(parts)]
+        assert results[:-1] == [None] * (len(parts) - 1)
+        assert results[-1] == ("node1", "ABC123", message)
+        assert assembler.partials == {}
+
+    @pytest.mark.asyncio
+    async def test_own_notifications_are_ignored(self):
+        """A worker doesn't deliver its own messages twice."""
+        delivered = []
+
+        async def handler(thread_id, message):
+            delivered.append(message["content"])
+
+        pubsub = PostgresPubSub("postgresql://unused")
+        pubsub.handler = handler
+
+        await pubsub._on_notify(encode_notify_parts(pubsub.origin, 0, "ABC123", {"content": "mine"})[0])
+        await pubsub._on_notify(encode_notify_parts("other", 0, "ABC123", {"content": "theirs"})[0])
+
+        assert delivered == ["theirs"]
+        assert pubsub.get_stats()["received"] == 1
@@ -0,0 +1,153 @@
+"""
+Tests for versioned ledger sync (state_sync.py)
+"""
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from state_sync import compute_state_delta, apply_state_delta, diff_collection, get_ledger_version
+
+
+def expense(id, amount, description="taxi"):
+    return {"id": id, "amount": amount, "currency": "PEN", "description": description,
+            "paid_by": "meli", "split_among": ["meli", "andre"]}
+
+
+class TestStateDelta:
+    """Test delta computation and application."""
+
+    def test_diff_collection(self):
+        """Added, changed and removed records are detected by id."""
+        old = [expense("exp_1", 10), expense("exp_2", 20)]
+        new = [expense("exp_1", 15), expense("exp_3", 30)]
+
+        diff = diff_collection(old, new)
+
+        assert diff["added"] == [expense("exp_3", 30)]
+        assert diff["changed"] == [expense("exp_1", 15)]
+        assert diff["removed"] == ["exp_2"]
+        assert diff_collection(old, list(old)) == {}
+
+    def test_delta_roundtrip(self):
+        """Applying the delta to the old state reproduces the new state."""
+        old = {
+            "expenses": [expense("exp_1", 10), expense("exp_2", 20)],
+            "payments": [],
+            "ledger_version": 3,
+        }
+        new = {
+            "expenses": [expense("exp_2", 20), expense("exp_3", 30)],
+            "payments": [{"id": "pay_1", "from_user": "andre", "to_user": "meli", "amount": 5}],
+            "ledger_version": 4,
+        }
+
+        delta = compute_state_delta(old, new)
+
+        # Unchanged collections are left out entirely
+        assert set(delta) == {"expenses", "payments"}
+        result = apply_state_delta(old, delta)
+        assert result["expenses"] == new["expenses"]
+        assert result["payments"] == new["payments"]
+
+    def test_duplicate_ids_fall_back_to_snapshot(self):
+        """A change to a collection with a reused id can't travel as a delta."""
+        from main import build_state_update
+
+        old = {"expenses": [expense("exp_1", 10), expense("exp_2", 20)], "ledger_version": 3}
+        new = {"expenses": old["expenses"] + [expense("exp_2", 30)], "ledger_version": 4}
+
+        assert compute_state_delta(old, new) is None
+        update = build_state_update(old, new)
+        assert update["base_version"] is None
+        assert update["state_version"] == 4
+        assert update["state_delta"] == {}
+
+    def test_ledger_version_defaults_to_zero(self):
+        """Checkpoints created before versioning read as version 0."""
+        assert get_ledger_version({}) == 0
+        assert get_ledger_version({"ledger_version": None}) == 0
+        assert get_ledger_version({"ledger_version": 7}) == 7
+
+
+class TestLedgerVersion:
+    """Test that the graph bumps the ledger version on writes."""
+
+    @pytest.mark.asyncio
+    async def test_mutating_tool_bumps_version(self):
+        """register_expense increments ledger_version; queries don't."""
+        from graph import execute_tools
+
+        state = {
+            "expenses": [],
+            "payments": [],
+            "balances": {},
+            "participants": ["meli", "andre"],
+            "milestones": [],
+            "photos": [],
+            "ledger_version": 2,
+            "session_context": {}
+        }
+
+        write = MagicMock()
+        write.tool_calls = [{
+            "id": "t1",
+            "name": "register_expense",
+            "args": {"amount": 50.0, "description": "taxi", "paid_by": "meli", "split_among": None}
+        }]
+        result = await execute_tools({**state, "messages": [write]})
+        assert result["ledger_version"] == 3
+
+        read = MagicMock()
+        read.tool_calls = [{"id": "t2", "name": "get_balance", "args": {}}]
+        result = await execute_tools({**state, "messages": [read]})
+        assert result["ledger_version"] == 2
+
+    def test_build_state_update(self):
+        """bot_complete carries the delta and whole balances/debts."""
+        from main import build_state_update
+
+        old = {"expenses": [], "balances": {}, "participants": ["meli"], "ledger_version": 0}
+        new = {
+            "expenses": [expense("exp_1", 100)],
+            "balances": {"meli": {"PEN": 50.0}, "andre": {"PEN": -50.0}},
+            "participants": ["meli", "andre"],
+            "ledger_version": 1,
+        }
+
+        update = build_state_update(old, new)
+
+        assert update["base_version"] == 0
+        assert update["state_version"] == 1
+        assert update["state_delta"] == {"expenses": {"added": [expense("exp_1", 100)], "changed": [], "removed": []}}
+        assert "expenses" not in update
+        assert update["debts"]["PEN"][0]["from"] == "andre"
+
+    @pytest.mark.asyncio
+    async def test_failed_whatsapp_run_reports_real_versions(self, monkeypatch):
+        """A run that fails after saving tool results still sends a correct delta."""
+        import main
+
+        class FailingGraph:
+            def __init__(self):
+                self.values = {"expenses": [], "ledger_version": 3}
+
+            async def aget_state(self, config):
+                return MagicMock(values=self.values)
+
+            async def ainvoke(self, *args, **kwargs):
+                # Tools saved a new expense, then the LLM call failed
+                self.values = {"expenses": [expense("exp_1", 10)], "ledger_version": 4}
+                raise RuntimeError("LLM timeout")
+
+        async def get_graph():
+            return FailingGraph()
+
+        resolver = MagicMock()
+        resolver.resolve = AsyncMock(return_value=None)
+        monkeypatch.setattr(main, "get_graph", get_graph)
+        monkeypatch.setattr(main, "get_trip_resolver", lambda: resolver)
+
+        result = await main.process_message_complete("WSP001", "meli", "taxi 10")
+
+        assert result["error"] is True
+        assert (result["base_version"], result["state_version"]) == (3, 4)
+        assert list(result["state_delta"]) == ["expenses"]
@@ -0,0 +1,70 @@
+"""
+Tests for streamed chunk coalescing (stream_aggregator.py)
+"""
+import asyncio
+import pytest
+
+from stream_aggregator import ChunkAggregator
+
+
+class TestChunkAggregator:
+    """Test time/size windowed flushing of streamed text."""
+
+    @pytest.mark.asyncio
+    async def test_tokens_are_batched_by_time(self):
+        """Tokens within one window go out as a single frame."""
+        frames = []
+
+        async def on_flush(text):
+            frames.append(text)
+
+        chunks = ChunkAggregator(on_flush, interval_ms=30, max_chars=1000)
+        for token in ["Hola", " a", " todos", ",", " listo"]:
+            await chunks.add(token)
+
+        # First token goes out right away, the rest waits for the window
+        assert frames == ["Hola"]
+        await asyncio.sleep(0.06)
+        assert frames == ["Hola", " a todos, listo"]
+
+        await chunks.close()
+        assert chunks.pieces_in == 5
+        assert chunks.frames_out == 2
+
+    @pytest.mark.asyncio
+    async def test_size_limit_flushes_early(self):
+        """A full buffer is sent without waiting for the timer."""
+        frames = []
+
+        async def on_flush(text):
+            frames.append(text)
+
+        chunks = ChunkAggregator(on_flush, interval_ms=10_000, max_chars=10)
+        for token in ["a", "bcde", "fghij", "klm", "n"]:
+            await chunks.add(token)
+
+        assert frames == ["a", "bcdefghijklm"]
+        await chunks.close()
+        assert frames == ["a", "bcdefghijklm", "n"]
+
+    @pytest.mark.asyncio
+    async def test_flush_keeps_order_with_other_frames(self):
+        """Explicit flushes deliver buffered text before the next room frame."""
+        room = []
+
+        async def on_flush(text):
+            room.append(("bot_chunk", text))
+
+        chunks = ChunkAggregator(on_flush, interval_ms=10_000)
+        await chunks.add("Voy a ")
+        await chunks.add("registrar ")
+        await chunks.add("el gasto")
+        await chunks.flush()
+        room.append(("thinking_step", "register_expense"))
+        await chunks.close()
+
+        assert room == [
+            ("bot_chunk", "Voy a "),
+            ("bot_chunk", "registrar el gasto"),
+            ("thinking_step", "register_expense"),
+        ]
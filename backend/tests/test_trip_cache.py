@@ -0,0 +1,186 @@
+"""
+Tests for the trip and membership cache (services/trip_cache.py)
+"""
+import asyncio
+
+import pytest
+
+from room_manager import RoomManager
+from services import session_service
+from services.trip_cache import TripCache, MISSING, TRIP_CACHE_CHANNEL, get_trip_cache
+from tests.test_async_repository import fake_db, TRIP  # noqa: F401 (fixture)
+
+
+def trip_reads(fake):
+    return [r for r in fake.requests if r[0] == "GET" and r[1] == "trips"]
+
+
+def member_reads(fake):
+    return [r for r in fake.requests if r[0] == "GET" and r[1] == "trip_participants"]
+
+
+class TestTripCache:
+    """Test cache entries, expiry and hit rates."""
+
+    def test_returns_copies(self):
+        cache = TripCache()
+        cache.put_trip(dict(TRIP))
+
+        cache.get_trip(1)["name"] = "mutated"
+
+        assert cache.get_trip(1)["name"] == "Cusco"
+        assert cache.get_trip(2) is MISSING
+        assert cache.get_stats()["trip_hit_rate"] == round(2 / 3, 3)
+
+    def test_non_membership_expires_quickly(self):
+        cache = TripCache(ttl=300, negative_ttl=0)
+        cache.put_member(1, "meli", True)
+        cache.put_member(1, "andre", False)
+
+        assert cache.get_member(1, "meli") is True
+        assert cache.get_member(1, "andre") is MISSING
+
+    def test_invalidate_drops_trip_and_members(self):
+        cache = TripCache()
+        cache.put_trip(dict(TRIP))
+        cache.put_member(1, "meli", True)
+        cache.put_member(2, "meli", True)
+
+        cache.invalidate_trip(1)
+
+        assert cache.get_trip(1) is MISSING
+        assert cache.get_member(1, "meli") is MISSING
+        assert cache.get_member(2, "meli") is True
+
+    def test_cards_cache_unknown_codes_briefly(self):
+        cache = TripCache(negative_ttl=0)
+        cache.put_card("ABC123", {"id": 1, "participant_count": 3})
+        cache.put_card("NOPE00", None)
+
+        assert cache.get_card("ABC123")["participant_count"] == 3
+        assert cache.get_card("NOPE00") is MISSING
+
+        cache.invalidate_card(1)
+        assert cache.get_card("ABC123") is MISSING
+
+
+class TestWriteThrough:
+    """Test that session_service reads hit the cache and writes keep it fresh."""
+
+    @pytest.mark.asyncio
+    async def test_repeat_trip_reads_hit_cache(self, fake_db):
+        for _ in range(3):
+            assert (await session_service.get_trip_by_id(1))["name"] == "Cusco"
+
+        assert len(trip_reads(fake_db)) == 1
+        assert get_trip_cache().get_stats()["trip_hits"] == 2
+
+    @pytest.mark.asyncio
+    async def test_update_and_delete_refresh_cache(self, fake_db):
+        await session_service.get_trip_by_id(1)
+
+        # The fake echoes TRIP back; the cache takes the returned record
+        get_trip_cache().trips.clear()
+        await session_service.update_trip(1, status="completed")
+        assert (await session_service.get_trip_by_id(1)) == TRIP
+        assert len(trip_reads(fake_db)) == 1
+
+        await session_service.delete_trip(1)
+        await session_service.get_trip_by_id(1)
+        assert len(trip_reads(fake_db)) == 2
+
+    @pytest.mark.asyncio
+    async def test_fresh_read_skips_cache(self, fake_db):
+        """Another worker finalized the trip: a fresh read sees it and refreshes the cache."""
+        await session_service.get_trip_by_id(1)
+        fake_db.tables["trips"] = [dict(TRIP, status="completed")]
+
+        assert (await session_service.get_trip_by_id(1))["status"] == "active"
+        assert (await session_service.get_trip_by_id(1, fresh=True))["status"] == "completed"
+        assert (await session_service.get_trip_by_id(1))["status"] == "completed"
+        assert len(trip_reads(fake_db)) == 2
+
+    @pytest.mark.asyncio
+    async def test_add_participant_marks_member(self, fake_db):
+        get_trip_cache().put_member(1, "andre", False)
+        assert await session_service.is_participant(1, "andre") is False
+
+        await session_service.add_participant(1, "andre")
+        reads = len(member_reads(fake_db))
+
+        assert await session_service.is_participant(1, "andre") is True
+        assert len(member_reads(fake_db)) == reads
+
+
+class TestPublicCard:
+    """Test the join page's trip card."""
+
+    @pytest.mark.asyncio
+    async def test_burst_costs_one_query(self, fake_db):
+        cards = await asyncio.gather(*[session_service.get_public_trip_card("abc123") for _ in range(20)])
+        await session_service.get_public_trip_card("ABC123")
+
+        assert all(card["participant_count"] == 1 for card in cards)
+        assert fake_db.requests == [
+            ("GET", "trips", {"select": session_service.PUBLIC_CARD_COLUMNS, "session_code": "eq.ABC123"})
+        ]
+
+    @pytest.mark.asyncio
+    async def test_trip_update_drops_card(self, fake_db):
+        await session_service.get_public_trip_card("ABC123")
+        await session_service.update_trip(1, status="completed")
+        await session_service.get_public_trip_card("ABC123")
+
+        assert len([r for r in trip_reads(fake_db) if "session_code" in r[2]]) == 2
+
+    @pytest.mark.asyncio
+    async def test_without_count_column_falls_back(self, fake_db):
+        """Databases without migration 014 count participants, and stop asking for the column."""
+        fake_db.missing_columns.add("participant_count")
+
+        card = await session_service.get_public_trip_card("ABC123")
+        get_trip_cache().cards.clear()
+        await session_service.get_public_trip_card("ABC123")
+
+        assert card["participant_count"] == 1 and card["name"] == "Cusco"
+        selects = [params["select"] for _, _, params in fake_db.requests]
+        assert selects.count(session_service.PUBLIC_CARD_COLUMNS) == 1
+        assert len(member_reads(fake_db)) == 2
+
+
+class TestCrossWorker:
+    """Test that trip changes reach the caches of other workers."""
+
+    @pytest.mark.asyncio
+    async def test_announced_change_drops_other_copies(self):
+        here, there = TripCache(), TripCache()
+        bus = RoomManager()
+        # The in-process pub/sub hands every message to both "workers"
+        bus.subscribe(TRIP_CACHE_CHANNEL, lambda message: (here.apply_remote(message), there.apply_remote(message)))
+        here.set_publisher(lambda message: bus.publish(TRIP_CACHE_CHANNEL, message))
+        for cache in (here, there):
+            cache.put_trip(dict(TRIP))
+            cache.put_member(1, "meli", True)
+            cache.put_card("ABC123", {"id": 1, "participant_count": 1})
+
+        await here.announce(1)
+
+        # The announcing worker already applied its own write
+        assert here.get_trip(1) is not MISSING
+        assert there.get_trip(1) is MISSING
+        assert there.get_member(1, "meli") is MISSING
+        assert there.get_card("ABC123") is MISSING
+        assert there.get_stats()["remote_invalidations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_updates_and_deletes_are_announced(self, fake_db):
+        announced = []
+
+        async def publisher(message):
+            announced.append(message["trip_id"])
+
+        get_trip_cache().set_publisher(publisher)
+        await session_service.update_trip(1, status="completed")
+        await session_service.delete_trip(1)
+
+        assert announced == [1, 1]
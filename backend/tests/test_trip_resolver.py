@@ -0,0 +1,130 @@
+"""
+Tests for cached session_code -> trip_id resolution (services/trip_resolver.py)
+"""
+import asyncio
+import pytest
+
+from services.single_flight import SingleFlight
+from services.trip_resolver import TripResolver
+
+
+class FakeTrips:
+    """Lookup function that counts queries."""
+
+    def __init__(self, trips=None, delay=0.0):
+        self.trips = dict(trips or {})
+        self.delay = delay
+        self.queries = 0
+        self.fail = False
+
+    async def __call__(self, session_code):
+        self.queries += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("supabase down")
+        return self.trips.get(session_code)
+
+
+class TestTripResolver:
+    """Test caching, negative caching and warming."""
+
+    @pytest.mark.asyncio
+    async def test_repeat_lookups_hit_the_cache(self):
+        trips = FakeTrips({"ABC123": 7})
+        resolver = TripResolver(trips)
+
+        assert [await resolver.resolve("ABC123") for _ in range(5)] == [7] * 5
+        assert trips.queries == 1
+        assert resolver.get_stats()["hits"] == 4
+
+    @pytest.mark.asyncio
+    async def test_missing_trip_is_cached_briefly(self):
+        """Rooms without a trip don't query on every message, but not forever."""
+        trips = FakeTrips()
+        resolver = TripResolver(trips, negative_ttl=0.05)
+
+        assert await resolver.resolve("CHAT01") is None
+        assert await resolver.resolve("CHAT01") is None
+        assert trips.queries == 1
+
+        trips.trips["CHAT01"] = 9
+        await asyncio.sleep(0.06)
+        assert await resolver.resolve("CHAT01") == 9
+
+    @pytest.mark.asyncio
+    async def test_created_trip_overrides_negative_entry(self):
+        trips = FakeTrips()
+        resolver = TripResolver(trips)
+        assert await resolver.resolve("ABC123") is None
+
+        resolver.remember("ABC123", 7)
+
+        assert await resolver.resolve("ABC123") == 7
+        assert trips.queries == 1
+
+    @pytest.mark.asyncio
+    async def test_concurrent_lookups_share_one_query(self):
+        trips = FakeTrips({"ABC123": 7}, delay=0.02)
+        resolver = TripResolver(trips)
+
+        results = await asyncio.gather(*(resolver.resolve("ABC123") for _ in range(10)))
+
+        assert results == [7] * 10
+        assert trips.queries == 1
+
+    @pytest.mark.asyncio
+    async def test_errors_are_not_cached(self):
+        trips = FakeTrips({"ABC123": 7})
+        trips.fail = True
+        resolver = TripResolver(trips)
+
+        with pytest.raises(ConnectionError):
+            await resolver.resolve("ABC123")
+
+        trips.fail = False
+        assert await resolver.resolve("ABC123") == 7
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction_and_forget(self):
+        resolver = TripResolver(FakeTrips(), max_size=2)
+        resolver.remember("A", 1)
+        resolver.remember("B", 2)
+        await resolver.resolve("A")
+        resolver.remember("C", 3)
+
+        assert list(resolver.cache) == ["A", "C"]
+        resolver.forget("A")
+        assert list(resolver.cache) == ["C"]
+
+
+class TestSingleFlight:
+    """Test sharing of concurrent calls for a key."""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_callers_share_one_call(self):
+        trips = FakeTrips({"ABC123": {"id": 7}}, delay=0.01)
+        flights = SingleFlight()
+
+        results = await asyncio.gather(*[
+            flights.do("ABC123", lambda: trips("ABC123")) for _ in range(10)
+        ])
+
+        assert trips.queries == 1
+        assert all(result is results[0] for result in results)
+        assert "ABC123" not in flights
+
+    @pytest.mark.asyncio
+    async def test_errors_reach_every_caller_and_are_not_kept(self):
+        trips = FakeTrips({"ABC123": 7}, delay=0.01)
+        trips.fail = True
+        flights = SingleFlight()
+
+        results = await asyncio.gather(*[
+            flights.do("ABC123", lambda: trips("ABC123")) for _ in range(3)
+        ], return_exceptions=True)
+
+        assert all(isinstance(result, ConnectionError) for result in results)
+        assert trips.queries == 1
+        trips.fail = False
+        assert await flights.do("ABC123", lambda: trips("ABC123")) == 7
+        assert trips.queries == 2
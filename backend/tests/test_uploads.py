@@ -0,0 +1,220 @@
+"""
+Tests for pre-uploaded chat images (uploads.py)
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from uploads import (
+    UploadRegistry, UploadRateLimiter, PendingUpload, UploadTooLarge, limit_size, upload_key, check_upload_key
+)
+
+
+def make_upload(thread_id="ABC123"):
+    return PendingUpload(
+        thread_id=thread_id,
+        url=f"https://storage.test/{thread_id}/a.jpg",
+        path=f"{thread_id}/a.jpg",
+        media_type="image/jpeg",
+        size=3
+    )
+
+
+class FakeStorage:
+    """Collects streamed uploads instead of sending them to Supabase."""
+
+    def __init__(self):
+        self.objects = {}
+
+    async def upload_stream(self, chunks, session_id, content_type="image/jpeg", extension="jpg"):
+        from services.supabase_storage import UploadResult
+
+        path = f"{session_id}/{len(self.objects)}.{extension}"
+        self.objects[path] = b"".join([chunk async for chunk in chunks])
+        return UploadResult(success=True, url=f"https://storage.test/{path}", path=path)
+
+    async def delete(self, path):
+        from services.supabase_storage import DeleteResult
+
+        self.objects.pop(path, None)
+        return DeleteResult(success=True)
+
+
+class FakeUploadStore:
+    """pending_uploads table: claims and prunes delete the rows they return."""
+
+    def __init__(self):
+        self.rows = {}
+
+    async def insert_pending_upload(self, row):
+        self.rows[row["upload_id"]] = dict(row, created_at=datetime.now(timezone.utc).isoformat())
+
+    async def take_pending_upload(self, upload_id, thread_id, created_after):
+        row = self.rows.get(upload_id)
+        if row is None or row["thread_id"] != thread_id or row["created_at"] <= created_after:
+            return None
+        return self.rows.pop(upload_id)
+
+    async def take_expired_uploads(self, created_before):
+        expired = [key for key, row in self.rows.items() if row["created_at"] < created_before]
+        return [self.rows.pop(key) for key in expired]
+
+    def age(self, upload_id, seconds):
+        created = datetime.fromisoformat(self.rows[upload_id]["created_at"]) - timedelta(seconds=seconds)
+        self.rows[upload_id]["created_at"] = created.isoformat()
+
+
+class TestUploadRegistry:
+    """Test single-use, room-scoped upload tokens."""
+
+    @pytest.mark.asyncio
+    async def test_claim_is_single_use_across_workers(self):
+        store = FakeUploadStore()
+        # Upload POST and chat message handled by different workers
+        worker_a = UploadRegistry(store=store, storage=FakeStorage())
+        worker_b = UploadRegistry(store=store, storage=FakeStorage())
+        upload_id = await worker_a.register(make_upload())
+
+        assert (await worker_b.claim(upload_id, "ABC123")).path == "ABC123/a.jpg"
+        assert await worker_a.claim(upload_id, "ABC123") is None
+
+    @pytest.mark.asyncio
+    async def test_claim_checks_room_and_expiry(self):
+        store = FakeUploadStore()
+        registry = UploadRegistry(ttl=60, store=store, storage=FakeStorage())
+        other_room = await registry.register(make_upload("XYZ789"))
+        expired = await registry.register(make_upload())
+        store.age(expired, 61)
+
+        assert await registry.claim(other_room, "ABC123") is None
+        assert await registry.claim(expired, "ABC123") is None
+        assert await registry.claim(None, "ABC123") is None
+
+    @pytest.mark.asyncio
+    async def test_prune_deletes_unclaimed_images(self):
+        store = FakeUploadStore()
+        storage = FakeStorage()
+        storage.objects = {"ABC123/a.jpg": b"old", "XYZ789/a.jpg": b"new"}
+        registry = UploadRegistry(ttl=60, store=store, storage=storage)
+        expired = await registry.register(make_upload())
+        fresh = await registry.register(make_upload("XYZ789"))
+        store.age(expired, 61)
+
+        assert await registry.prune() == 1
+
+        assert storage.objects == {"XYZ789/a.jpg": b"new"}
+        assert list(store.rows) == [fresh]
+        assert registry.get_stats()["expired"] == 1
+
+    @pytest.mark.asyncio
+    async def test_limit_size_stops_large_streams(self):
+        async def body():
+            for _ in range(4):
+                yield b"x" * 10
+
+        assert [c async for c in limit_size(body(), max_bytes=40)] == [b"x" * 10] * 4
+        with pytest.raises(UploadTooLarge):
+            [c async for c in limit_size(body(), max_bytes=25)]
+
+
+class TestUploadEndpoint:
+    """Test POST /api/sessions/{thread_id}/uploads."""
+
+    def test_raw_body_streams_to_storage(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        import main
+
+        storage = FakeStorage()
+        store = FakeUploadStore()
+        monkeypatch.setattr(main, "get_storage", lambda: storage)
+        monkeypatch.setattr(main.upload_registry, "_store", store)
+        client = TestClient(main.app)
+
+        response = client.post(
+            "/api/sessions/ABC123/uploads?user_id=meli",
+            content=b"\xff\xd8\xff fake jpeg",
+            headers={"Content-Type": "image/jpeg", "X-Upload-Key": upload_key("ABC123", "meli")}
+        )
+
+        assert response.status_code == 200
+        body = response.json()
+        assert storage.objects == {"ABC123/0.jpg": b"\xff\xd8\xff fake jpeg"}
+        row = store.rows[body["upload_id"]]
+        assert (row["thread_id"], row["url"], row["size"]) == ("ABC123", body["url"], 13)
+
+    def test_rejects_non_images(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        import main
+
+        monkeypatch.setattr(main, "get_storage", lambda: FakeStorage())
+        client = TestClient(main.app)
+
+        response = client.post(
+            "/api/sessions/ABC123/uploads?user_id=meli",
+            content=b"hola",
+            headers={"Content-Type": "text/plain", "X-Upload-Key": upload_key("ABC123", "meli")}
+        )
+
+        assert response.status_code == 415
+
+    def test_requires_the_room_upload_key(self, monkeypatch):
+        """Knowing the session code isn't enough: the key comes from joining."""
+        from fastapi.testclient import TestClient
+        import main
+
+        storage = FakeStorage()
+        monkeypatch.setattr(main, "get_storage", lambda: storage)
+        client = TestClient(main.app)
+
+        for query, key in (("", None), ("?user_id=meli", None), ("?user_id=meli", "guess"),
+                           ("?user_id=meli", upload_key("OTHER1", "meli")),
+                           ("?user_id=andre", upload_key("ABC123", "meli"))):
+            headers = {"Content-Type": "image/jpeg"}
+            if key:
+                headers["X-Upload-Key"] = key
+            response = client.post(f"/api/sessions/ABC123/uploads{query}", content=b"\xff\xd8", headers=headers)
+            assert response.status_code == 403
+
+        assert storage.objects == {}
+
+    def test_uploads_are_rate_limited_per_user(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        import main
+
+        monkeypatch.setattr(main, "get_storage", lambda: FakeStorage())
+        monkeypatch.setattr(main.upload_registry, "_store", FakeUploadStore())
+        monkeypatch.setattr(main, "upload_limiter", UploadRateLimiter(limit=2))
+        client = TestClient(main.app)
+
+        def upload(user):
+            return client.post(
+                f"/api/sessions/ABC123/uploads?user_id={user}",
+                content=b"\xff\xd8",
+                headers={"Content-Type": "image/jpeg", "X-Upload-Key": upload_key("ABC123", user)}
+            ).status_code
+
+        assert [upload("meli") for _ in range(3)] == [200, 200, 429]
+        assert upload("andre") == 200
+
+    def test_upload_keys_and_rate_window(self):
+        assert check_upload_key("ABC123", "meli", upload_key("ABC123", "meli"))
+        assert not check_upload_key("ABC123", "meli", upload_key("ABC123", "meli", secret="other"))
+        assert not check_upload_key("ABC123", "meli", None)
+
+        limiter = UploadRateLimiter(limit=1)
+        assert limiter.allow("ABC123", "meli")
+        assert not limiter.allow("ABC123", "meli")
+        # A minute later the upload has left the window
+        limiter.recent[("ABC123", "meli")][0] -= 61
+        assert limiter.allow("ABC123", "meli")
+        assert limiter.get_stats() == {"users": 1, "limited": 1}
+
+    def test_turn_content_references_uploaded_image(self):
+        """The agent gets the Storage URL, not inline base64."""
+        from main import build_turn_content, IMAGE_ATTACHED_NOTE
+        from turn_queue import QueuedTurn
+
+        content = build_turn_content([QueuedTurn(user_id="meli", content="recibo", upload=make_upload())])
+
+        assert content[0]["text"] == f"[meli]: recibo{IMAGE_ATTACHED_NOTE}"
+        assert content[1] == {"type": "image_url", "image_url": {"url": "https://storage.test/ABC123/a.jpg"}}
@@ -0,0 +1,117 @@
+"""
+Cross-Worker Thread Locks
+
+TurnQueue serializes graph runs per thread_id inside one process. With
+several workers (ROOM_PUBSUB=postgres), a WhatsApp turn on one worker and a
+web turn on another could still write the same LangGraph checkpoint at
+once, so every run also holds a Postgres advisory lock keyed on its
+thread_id (see TurnQueue.set_shared_lock).
+
+Advisory locks belong to the session that took them, so each held lock
+pins one pooled connection until the run ends (at most MAX_CONCURRENT_RUNS
+per worker). Like LISTEN, this needs a direct (session) connection; the
+transaction pooler on port 6543 would hand the lock to other clients.
+"""
+
+from contextlib import asynccontextmanager
+from typing import Optional
+import asyncio
+
+from room_pubsub import ROOM_PUBSUB, SUPABASE_DB_URL
+from turn_queue import MAX_CONCURRENT_RUNS
+
+# First key of every advisory lock taken here (the second is hashtext(thread_id)),
+# so they never collide with locks taken by other code on the same database
+LOCK_NAMESPACE = 0x4A52  # "JR"
+# Seconds between attempts while another worker holds a thread's lock (doubles up to the max)
+LOCK_POLL_INTERVAL = 0.05
+LOCK_POLL_MAX = 1.0
+
+
+class PostgresThreadLock:
+    """Per-thread mutual exclusion across processes with pg advisory locks."""
+
+    def __init__(self, dsn: str, max_size: int = MAX_CONCURRENT_RUNS):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.pool = None
+        # Stats
+        self.acquired = 0
+        self.contended = 0
+
+    async def start(self):
+        """Open the connection pool (raises if the database can't be reached)."""
+        from psycopg_pool import AsyncConnectionPool
+
+        self.pool = AsyncConnectionPool(
+            conninfo=self.dsn,
+            min_size=1,
+            max_size=self.max_size,
+            open=False,
+            kwargs={"autocommit": True, "prepare_threshold": None}
+        )
+        await self.pool.open(wait=True, timeout=30)
+        print(f"🔒 Cross-worker thread locks ready (pool of {self.max_size})")
+
+    @asynccontextmanager
+    async def hold(self, thread_id: str):
+        """Hold the thread's lock, waiting while another worker has it."""
+        async with self.pool.connection() as conn:
+            try:
+                await self._acquire(conn, thread_id)
+            except BaseException:
+                # Cancelled mid-query: the lock may be held; closing the
+                # session is the only sure way to release it
+                await conn.close()
+                raise
+            try:
+                yield
+            finally:
+                try:
+                    await conn.execute(
+                        "SELECT pg_advisory_unlock(%s, hashtext(%s))", (LOCK_NAMESPACE, thread_id)
+                    )
+                except BaseException:
+                    # Never return a connection to the pool with the lock still held
+                    await conn.close()
+                    raise
+
+    async def _acquire(self, conn, thread_id: str):
+        delay = LOCK_POLL_INTERVAL
+        while True:
+            cursor = await conn.execute(
+                "SELECT pg_try_advisory_lock(%s, hashtext(%s))", (LOCK_NAMESPACE, thread_id)
+            )
+            if (await cursor.fetchone())[0]:
+                self.acquired += 1
+                return
+            if delay == LOCK_POLL_INTERVAL:
+                self.contended += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LOCK_POLL_MAX)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def get_stats(self) -> dict:
+        return {
+            "backend": "postgres",
+            "acquired": self.acquired,
+            "contended": self.contended,
+        }
+
+
+def create_thread_lock() -> Optional[PostgresThreadLock]:
+    """
+    Create the cross-worker lock when rooms are shared across workers.
+
+    Returns:
+        A PostgresThreadLock with ROOM_PUBSUB=postgres, else None (the
+        turn queue's in-process lock is enough for a single worker).
+    """
+    # Without SUPABASE_DB_URL the room pub/sub stays in-process as well
+    if ROOM_PUBSUB != "postgres" or not SUPABASE_DB_URL:
+        return None
+    return PostgresThreadLock(SUPABASE_DB_URL)
@@ -0,0 +1,352 @@
+"""
+Per-Thread Turn Queue
+
+Serializes agent turns per thread_id so concurrent messages in a room
+never race on the same LangGraph checkpoint. Messages that arrive while
+a turn is running are coalesced into the next turn, so a burst of group
+messages costs one LLM round instead of one per message.
+
+Across threads, at most `max_running` turns run at once; the rest wait
+for a slot. Each turn has a deadline and can be cancelled (client sent
+"cancel", or everyone left the room). The handler sees cancellation as
+`asyncio.CancelledError` and `get_cancel_reason()` says why; a batch
+cancelled before it started is passed to the `on_cancelled` callback
+instead, so its senders still get an answer.
+
+Graph runs from outside the queue (the WhatsApp webhook) go through
+`run_exclusive()`, which applies the same lock, slot and deadline. Only
+the deadline stops them: cancel() is for the room's own web turns, and a
+WhatsApp user still gets an answer when the last browser tab closes.
+
+The per-thread lock only covers this process. With several workers, a
+shared lock (thread_locks.py) is also held for every run; waiting for it
+counts against the run's deadline and can be cancelled like the run.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+import asyncio
+import os
+import time
+
+# Graph runs allowed at once across all threads
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", "32"))
+# Seconds a single turn may run before it is cancelled
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE", "120"))
+
+CANCEL_DEADLINE = "deadline"
+
+
+@dataclass
+class QueuedTurn:
+    """A user message waiting to be processed by the agent."""
+    user_id: str
+    content: str
+    image: Optional[str] = None  # Base64 encoded image
+    upload: Optional[Any] = None  # Pre-uploaded image (uploads.PendingUpload)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class ActiveRun:
+    """A graph call running on a thread."""
+    task: asyncio.Task
+    exclusive: bool  # Started by run_exclusive(), not a queued batch
+    reason: Optional[str] = None  # Why it is being cancelled
+
+
+TurnHandler = Callable[[str, List[QueuedTurn]], Awaitable[None]]
+# Has hold(thread_id): an async context manager held across processes (thread_locks.py)
+SharedLock = Any
+# (thread_id, batch, reason) for a batch cancelled before it ran
+CancelHandler = Callable[[str, List[QueuedTurn], str], Awaitable[None]]
+
+
+class TurnCancelled(Exception):
+    """A run_exclusive() call was cancelled or passed its deadline."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class TurnQueue:
+    """Runs queued turns one batch at a time per thread."""
+
+    def __init__(
+        self,
+        handler: Optional[TurnHandler] = None,
+        on_cancelled: Optional[CancelHandler] = None,
+        max_batch: int = 10,
+        max_running: int = MAX_CONCURRENT_RUNS,
+        deadline: float = TURN_DEADLINE
+    ):
+        self.handler = handler
+        self.on_cancelled = on_cancelled
+        # Max messages merged into a single agent turn
+        self.max_batch = max_batch
+        self.max_running = max_running
+        self.deadline = deadline
+        # Admission control: one slot per running turn
+        self.slots = asyncio.Semaphore(max_running)
+        # thread_id -> graph call running on that thread
+        self.running: Dict[str, ActiveRun] = {}
+        # thread_id -> why its next queued batch is cancelled (before it starts)
+        self.cancel_reasons: Dict[str, str] = {}
+        # Batches waiting for a slot
+        self.waiting = 0
+        # thread_id -> turns waiting for the next batch
+        self.pending: Dict[str, List[QueuedTurn]] = {}
+        # thread_id -> task draining that thread's queue
+        self.workers: Dict[str, asyncio.Task] = {}
+        # thread_id -> lock held while a turn runs on that thread
+        self.locks: Dict[str, asyncio.Lock] = {}
+        # thread_id -> callers holding or waiting for its lock (dropped at 0)
+        self.lock_users: Dict[str, int] = {}
+        # Also held around every run when workers share threads (None: one process)
+        self.shared_lock: Optional[SharedLock] = None
+        # Stats
+        self.turns_submitted = 0
+        self.batches_run = 0
+        self.exclusive_runs = 0
+        self.runs_timed_out = 0
+        self.runs_cancelled = 0
+
+    def set_handler(self, handler: TurnHandler, on_cancelled: Optional[CancelHandler] = None):
+        """
+        Set the coroutine that processes a batch of turns.
+
+        Args:
+            handler: Runs one batch
+            on_cancelled: Called with a batch cancelled while it waited for a
+                slot, so its already-broadcast messages don't go unanswered
+        """
+        self.handler = handler
+        self.on_cancelled = on_cancelled
+
+    def set_shared_lock(self, shared_lock: Optional[SharedLock]):
+        """Serialize runs on a thread across worker processes too."""
+        self.shared_lock = shared_lock
+
+    @asynccontextmanager
+    async def _locked(self, thread_id: str):
+        """
+        Hold the lock that serializes graph runs on a thread.
+
+        The lock only exists while someone holds or waits for it, so idle
+        threads don't keep one around. Other entry points that run the graph
+        outside the queue should use run_exclusive(), which holds it.
+        """
+        if thread_id not in self.locks:
+            self.locks[thread_id] = asyncio.Lock()
+            self.lock_users[thread_id] = 0
+        lock = self.locks[thread_id]
+        self.lock_users[thread_id] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.lock_users[thread_id] -= 1
+            if not self.lock_users[thread_id]:
+                del self.locks[thread_id]
+                del self.lock_users[thread_id]
+
+    def submit(self, thread_id: str, turn: QueuedTurn):
+        """
+        Queue a turn without waiting for it to be processed.
+
+        Starts a worker for the thread if none is running. A running worker
+        picks up the new turn, together with anything else queued, as soon
+        as its current batch finishes.
+        """
+        self.pending.setdefault(thread_id, []).append(turn)
+        self.turns_submitted += 1
+
+        worker = self.workers.get(thread_id)
+        if worker is None or worker.done():
+            self.workers[thread_id] = asyncio.create_task(self._drain(thread_id))
+
+    async def _drain(self, thread_id: str):
+        """Process batches for a thread until its queue is empty."""
+        try:
+            while self.pending.get(thread_id):
+                queue = self.pending[thread_id]
+                batch = queue[:self.max_batch]
+                del queue[:len(batch)]
+
+                async with self._locked(thread_id):
+                    await self._acquire_slot()
+                    # Cancelled while waiting for the lock or a slot
+                    reason = self.cancel_reasons.pop(thread_id, None)
+                    if reason:
+                        self.slots.release()
+                        await self._skip(thread_id, batch, reason)
+                        continue
+                    try:
+                        self.batches_run += 1
+                        run, _ = await self._run(thread_id, lambda: self.handler(thread_id, batch), exclusive=False)
+                        if not run.cancelled() and run.exception():
+                            print(f"❌ [{thread_id}] Turn handler failed: {run.exception()}")
+                    finally:
+                        self.slots.release()
+        finally:
+            if not self.pending.get(thread_id):
+                self.pending.pop(thread_id, None)
+            if self.workers.get(thread_id) is asyncio.current_task():
+                del self.workers[thread_id]
+                # A cancel that arrived after the last batch must not hit the next one
+                self.cancel_reasons.pop(thread_id, None)
+
+    async def run_exclusive(self, thread_id: str, run_fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run a graph call from outside the queue (e.g. the WhatsApp webhook).
+
+        Takes the thread's lock and a global slot like a queued batch and
+        runs under the same deadline. cancel() leaves it alone: its caller
+        is not in the room and still waits for the answer.
+
+        Args:
+            thread_id: Thread the call runs on
+            run_fn: Creates the coroutine to run
+
+        Returns:
+            What run_fn's coroutine returned.
+
+        Raises:
+            TurnCancelled: The run passed the deadline
+        """
+        async with self._locked(thread_id):
+            await self._acquire_slot()
+            try:
+                self.exclusive_runs += 1
+                run, reason = await self._run(thread_id, run_fn, exclusive=True)
+            finally:
+                self.slots.release()
+        if run.cancelled():
+            raise TurnCancelled(reason or "cancelled")
+        return run.result()
+
+    async def _acquire_slot(self):
+        """Wait for a global run slot."""
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+
+    async def _skip(self, thread_id: str, batch: List[QueuedTurn], reason: str):
+        """Report a batch that was cancelled before it ran."""
+        self.runs_cancelled += 1
+        print(f"🛑 [{thread_id}] {len(batch)} queued message(s) cancelled before running ({reason})")
+        if self.on_cancelled is None:
+            return
+        try:
+            await self.on_cancelled(thread_id, batch, reason)
+        except Exception as e:
+            print(f"❌ [{thread_id}] Cancel handler failed: {e}")
+
+    async def _run(
+        self,
+        thread_id: str,
+        run_fn: Callable[[], Awaitable[Any]],
+        exclusive: bool
+    ) -> Tuple[asyncio.Task, Optional[str]]:
+        """
+        Run one graph call under the deadline.
+
+        Returns:
+            The finished task and, if it was cancelled, why.
+        """
+        run = asyncio.create_task(self._call(thread_id, run_fn))
+        active = self.running[thread_id] = ActiveRun(run, exclusive)
+        try:
+            done, _ = await asyncio.wait({run}, timeout=self.deadline)
+            if not done:
+                print(f"⏱️ [{thread_id}] Turn exceeded {self.deadline:.0f}s, cancelling")
+                active.reason = CANCEL_DEADLINE
+                self.runs_timed_out += 1
+                run.cancel()
+                await asyncio.wait({run})
+
+            reason = None
+            if run.cancelled():
+                reason = active.reason
+                if reason != CANCEL_DEADLINE:
+                    self.runs_cancelled += 1
+            return run, reason
+        finally:
+            del self.running[thread_id]
+
+    async def _call(self, thread_id: str, run_fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run run_fn() holding the shared lock, if there is one."""
+        if self.shared_lock is None:
+            return await run_fn()
+        async with self.shared_lock.hold(thread_id):
+            return await run_fn()
+
+    def cancel(self, thread_id: str, reason: str = "cancelled", drop_pending: bool = False) -> bool:
+        """
+        Cancel the queued turn running (or waiting for a slot) on a thread.
+
+        run_exclusive() calls (WhatsApp) are not affected.
+
+        Args:
+            thread_id: Thread whose turn to stop
+            reason: Reported to the handler via get_cancel_reason()
+            drop_pending: Also discard messages queued for later turns
+
+        Returns:
+            True if there was something to cancel.
+        """
+        dropped = self.pending.pop(thread_id, []) if drop_pending else []
+        active = self.running.get(thread_id)
+        if active is not None and not active.exclusive:
+            active.reason = reason
+            active.task.cancel()
+        else:
+            worker = self.workers.get(thread_id)
+            if worker is None or worker.done():
+                return bool(dropped)
+            # Waiting for the lock (maybe behind a WhatsApp run) or a slot
+            self.cancel_reasons[thread_id] = reason
+        print(f"🛑 [{thread_id}] Turn cancelled ({reason}), {len(dropped)} queued message(s) dropped")
+        return True
+
+    def get_cancel_reason(self, thread_id: str) -> Optional[str]:
+        """Why the thread's current turn is being cancelled, if it is."""
+        active = self.running.get(thread_id)
+        if active is not None and active.reason:
+            return active.reason
+        return self.cancel_reasons.get(thread_id)
+
+    def get_pending_count(self, thread_id: str) -> int:
+        """Get number of turns waiting on a thread."""
+        return len(self.pending.get(thread_id, []))
+
+    def is_busy(self, thread_id: str) -> bool:
+        """Check if a turn is queued or running on a thread."""
+        if thread_id in self.running:
+            return True
+        worker = self.workers.get(thread_id)
+        return worker is not None and not worker.done()
+
+    def get_stats(self) -> dict:
+        """Queue counters for monitoring and autoscaling."""
+        return {
+            "active_threads": len(self.workers),
+            "running": len(self.running),
+            "queued": self.waiting,
+            "max_running": self.max_running,
+            "pending_turns": sum(len(q) for q in self.pending.values()),
+            "turns_submitted": self.turns_submitted,
+            "batches_run": self.batches_run,
+            "exclusive_runs": self.exclusive_runs,
+            "runs_timed_out": self.runs_timed_out,
+            "runs_cancelled": self.runs_cancelled,
+            "shared_lock": self.shared_lock.get_stats() if self.shared_lock else None,
+        }
+
+
+# Global instance
+turn_queue = TurnQueue()
@@ -0,0 +1,244 @@
+"""
+Pre-uploaded Chat Images
+
+Images used to travel inside WebSocket text frames as base64: a third
+larger, parsed with `json.loads` in one piece and decoded again before
+going to Storage. Now the client POSTs the raw bytes to
+`/api/sessions/{thread_id}/uploads`, which streams them to Storage and
+returns a short-lived, single-use `upload_id`. The chat message carries
+only that id.
+
+Tokens are stored in Supabase (`pending_uploads`, migration 015), not in
+process memory: the upload POST and the WebSocket message may be handled
+by different uvicorn workers. Claiming deletes the row, so a token works
+once across all workers. Images never claimed before the TTL are deleted
+from Storage by the pruner loop.
+
+Only room members may upload. On join, every client gets an `upload_key`
+(an HMAC of the room and its user_id) and sends it with each upload, so
+the endpoint needs no session lookup and the key works on any worker that
+shares UPLOAD_KEY_SECRET. Each user may upload UPLOAD_RATE_LIMIT images
+per minute per room (counted per worker).
+"""
+
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+from collections import deque
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+
+# Largest accepted image
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# Seconds an upload_id stays valid before it must be sent in a message
+UPLOAD_TOKEN_TTL = float(os.getenv("UPLOAD_TOKEN_TTL", "600"))
+# Seconds between sweeps for expired, unclaimed uploads
+UPLOAD_PRUNE_INTERVAL = float(os.getenv("UPLOAD_PRUNE_INTERVAL", "60"))
+# Signs upload keys; every worker must use the same one (random: single process only)
+UPLOAD_KEY_SECRET = os.getenv("UPLOAD_KEY_SECRET") or os.getenv("SUPABASE_JWT_SECRET") or secrets.token_hex(32)
+# Uploads a user may make per room per minute
+UPLOAD_RATE_LIMIT = int(os.getenv("UPLOAD_RATE_LIMIT", "20"))
+
+ALLOWED_IMAGE_TYPES = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+    "image/heic": "heic",
+}
+
+
+class UploadTooLarge(Exception):
+    """The request body went over MAX_UPLOAD_BYTES."""
+
+
+@dataclass
+class PendingUpload:
+    """An image already in Storage, waiting to be referenced by a message."""
+    thread_id: str
+    url: str
+    path: str
+    media_type: str
+    size: int
+
+
+async def limit_size(chunks: AsyncIterator[bytes], max_bytes: int = MAX_UPLOAD_BYTES) -> AsyncIterator[bytes]:
+    """Pass a byte stream through, raising UploadTooLarge past `max_bytes`."""
+    total = 0
+    async for chunk in chunks:
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(f"Image larger than {max_bytes} bytes")
+        yield chunk
+
+
+def upload_key(thread_id: str, user_id: str, secret: str = UPLOAD_KEY_SECRET) -> str:
+    """Key that lets user_id upload images for thread_id (sent to the client on join)."""
+    digest = hmac.new(secret.encode(), f"{thread_id}\n{user_id}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+
+def check_upload_key(thread_id: str, user_id: str, key: Optional[str], secret: str = UPLOAD_KEY_SECRET) -> bool:
+    """Whether key was issued to user_id in thread_id."""
+    return bool(key) and hmac.compare_digest(key, upload_key(thread_id, user_id, secret))
+
+
+class UploadRateLimiter:
+    """Sliding one-minute window of uploads per (thread_id, user_id)."""
+
+    def __init__(self, limit: int = UPLOAD_RATE_LIMIT, window: float = 60.0):
+        self.limit = limit
+        self.window = window
+        # (thread_id, user_id) -> monotonic times of recent uploads
+        self.recent: Dict[Tuple[str, str], Deque[float]] = {}
+        # Stats
+        self.limited = 0
+
+    def allow(self, thread_id: str, user_id: str) -> bool:
+        """Count an upload, or return False if the user is over the limit."""
+        now = time.monotonic()
+        # Forget users with nothing left in their window, so the dict stays small
+        for key, times in list(self.recent.items()):
+            while times and now - times[0] > self.window:
+                times.popleft()
+            if not times:
+                del self.recent[key]
+
+        times = self.recent.setdefault((thread_id, user_id), deque())
+        if len(times) >= self.limit:
+            self.limited += 1
+            return False
+        times.append(now)
+        return True
+
+    def get_stats(self) -> dict:
+        return {"users": len(self.recent), "limited": self.limited}
+
+
+class UploadRegistry:
+    """Single-use upload tokens, scoped to the room they were uploaded for."""
+
+    def __init__(
+        self,
+        ttl: float = UPLOAD_TOKEN_TTL,
+        store=None,
+        storage=None,
+        prune_interval: float = UPLOAD_PRUNE_INTERVAL
+    ):
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        # Object with insert_pending_upload/take_pending_upload/take_expired_uploads (default: SupabaseDB)
+        self._store = store
+        # Object with delete(path) (default: SupabaseStorage)
+        self._storage = storage
+        self._closed = False
+        # Stats
+        self.registered = 0
+        self.claimed = 0
+        self.rejected = 0
+        self.expired = 0
+
+    @property
+    def store(self):
+        if self._store is None:
+            from services import get_db
+            self._store = get_db()
+        return self._store
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            from services import get_storage
+            self._storage = get_storage()
+        return self._storage
+
+    def _cutoff(self) -> str:
+        return (datetime.now(timezone.utc) - timedelta(seconds=self.ttl)).isoformat()
+
+    async def register(self, upload: PendingUpload) -> str:
+        """
+        Store an uploaded image and return its token.
+
+        Returns:
+            The upload_id clients send with their chat message.
+        """
+        upload_id = secrets.token_urlsafe(16)
+        await self.store.insert_pending_upload(dict(asdict(upload), upload_id=upload_id))
+        self.registered += 1
+        return upload_id
+
+    async def claim(self, upload_id: Optional[str], thread_id: str) -> Optional[PendingUpload]:
+        """
+        Take an upload for a message in `thread_id`.
+
+        Returns:
+            The upload, or None if the id is unknown, expired, already used
+            or belongs to another room.
+        """
+        if not upload_id:
+            return None
+        try:
+            row = await self.store.take_pending_upload(upload_id, thread_id, self._cutoff())
+        except Exception as e:
+            print(f"⚠️ Could not claim upload {upload_id}: {e}")
+            row = None
+        if row is None:
+            self.rejected += 1
+            return None
+        self.claimed += 1
+        return PendingUpload(
+            thread_id=row["thread_id"],
+            url=row["url"],
+            path=row["path"],
+            media_type=row["media_type"],
+            size=row["size"]
+        )
+
+    async def prune(self) -> int:
+        """
+        Drop expired, unclaimed uploads and delete their images from Storage.
+
+        Returns:
+            Number of uploads dropped
+        """
+        rows = await self.store.take_expired_uploads(self._cutoff())
+        for row in rows:
+            result = await self.storage.delete(row["path"])
+            if not result.success:
+                print(f"⚠️ Could not delete unclaimed upload {row['path']}: {result.error}")
+        self.expired += len(rows)
+        if rows:
+            print(f"🧹 Dropped {len(rows)} unclaimed upload(s)")
+        return len(rows)
+
+    async def run_pruner(self):
+        """Prune every prune_interval seconds until close()."""
+        while not self._closed:
+            await asyncio.sleep(self.prune_interval)
+            try:
+                await self.prune()
+            except Exception as e:
+                print(f"⚠️ Upload prune failed: {e}")
+
+    def close(self):
+        """Stop the pruner loop."""
+        self._closed = True
+
+    def get_stats(self) -> dict:
+        """Upload token counters for this process."""
+        return {
+            "registered": self.registered,
+            "claimed": self.claimed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
+
+
+# Global registry (the pruner is started by main.py on startup)
+upload_registry = UploadRegistry()
+upload_limiter = UploadRateLimiter()
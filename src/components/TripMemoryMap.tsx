@@ -3,36 +3,61 @@
 import { Card } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
 import { MapPin, Camera, Loader2, Navigation } from "lucide-react";
-import { useState, useEffect, useRef } from "react";
-import { getTripPhotos, type Photo } from "@/lib/api/photos";
+import { Button } from "@/components/ui/button";
+import { useState, useRef, useMemo, useLayoutEffect } from "react";
+import { PHOTO_GALLERY_FIELDS } from "@/lib/api/photos";
+import { useTripPhotos } from "@/hooks/useTripPhotos";
 
 interface TripMemoryMapProps {
   tripId?: number;
 }
 
+// Horizontal space between photos on the timeline
+const PHOTO_SPACING = 350;
+
 const TripMemoryMap = ({ tripId = 1 }: TripMemoryMapProps) => {
   const [selectedMemory, setSelectedMemory] = useState<number | null>(null);
-  const [photos, setPhotos] = useState<Photo[]>([]);
-  const [loading, setLoading] = useState(true);
   const scrollContainerRef = useRef<HTMLDivElement>(null);
+  const shownCountRef = useRef(0);
+
+  const {
+    photos: loadedPhotos,
+    total,
+    hasMore,
+    loading,
+    loadingMore,
+    loadMore,
+  } = useTripPhotos(tripId, PHOTO_GALLERY_FIELDS);
+
+  // Pages arrive newest first; the timeline runs by creation date
+  const photos = useMemo(
+    () =>
+      [...loadedPhotos].sort(
+        (a, b) => new Date(a.created_at).getTime() - new Date(b.created_at).getTime()
+      ),
+    [loadedPhotos]
+  );
 
-  useEffect(() => {
-    loadPhotos();
-  }, [tripId]);
+  // Start at the most recent photos; older pages are added on the left,
+  // so shift the scroll by what was added to keep the view in place
+  useLayoutEffect(() => {
+    const previous = shownCountRef.current;
+    shownCountRef.current = photos.length;
+    const container = scrollContainerRef.current;
+    if (!container || photos.length === 0) return;
+
+    if (previous === 0 || photos.length < previous) {
+      container.scrollLeft = container.scrollWidth;
+    } else {
+      container.scrollLeft += (photos.length - previous) * PHOTO_SPACING;
+    }
+  }, [photos.length]);
 
-  const loadPhotos = async () => {
-    setLoading(true);
-    try {
-      const data = await getTripPhotos(tripId);
-      // Sort by creation date
-      const sorted = data.sort((a, b) =>
-        new Date(a.created_at).getTime() - new Date(b.created_at).getTime()
-      );
-      setPhotos(sorted);
-    } catch (error) {
-      console.error("Failed to load photos:", error);
-    } finally {
-      setLoading(false);
+  // Load older photos when the left end of the timeline comes into view
+  const handleScroll = () => {
+    const container = scrollContainerRef.current;
+    if (container && hasMore && container.scrollLeft < PHOTO_SPACING) {
+      loadMore();
     }
   };
 
@@ -82,12 +107,11 @@ const TripMemoryMap = ({ tripId = 1 }: TripMemoryMapProps) => {
   const calculatePhotoPositions = () => {
     if (photos.length === 0) return [];
 
-    const spacing = 350; // Space between photos
     const baseY = 250; // Center Y position
 
     return photos.map((photo, index) => ({
       photo,
-      x: 200 + index * spacing,
+      x: 200 + index * PHOTO_SPACING,
       y: baseY + (index % 2 === 0 ? -50 : 50), // Alternate up and down
     }));
   };
@@ -129,9 +153,28 @@ const TripMemoryMap = ({ tripId = 1 }: TripMemoryMapProps) => {
             Tu viaje en una línea de tiempo · Desplázate horizontalmente
           </p>
         </div>
-        {/* Compass decoration */}
-        <div className="hidden md:block">
-          <Navigation className="h-12 w-12 text-primary/30" style={{ transform: 'rotate(45deg)' }} />
+        <div className="flex items-center gap-4">
+          {hasMore && (
+            <Button
+              variant="outline"
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="rounded-full"
+            >
+              {loadingMore ? (
+                <>
+                  <Loader2 className="h-4 w-4 mr-2 animate-spin" />
+                  Cargando...
+                </>
+              ) : (
+                `Recuerdos anteriores (${photos.length} de ${total})`
+              )}
+            </Button>
+          )}
+          {/* Compass decoration */}
+          <div className="hidden md:block">
+            <Navigation className="h-12 w-12 text-primary/30" style={{ transform: 'rotate(45deg)' }} />
+          </div>
         </div>
       </div>
 
@@ -152,6 +195,7 @@ const TripMemoryMap = ({ tripId = 1 }: TripMemoryMapProps) => {
         {/* Scrollable map */}
         <div
           ref={scrollContainerRef}
+          onScroll={handleScroll}
           className="overflow-x-auto overflow-y-hidden scrollbar-thin scrollbar-thumb-primary/30 scrollbar-track-transparent"
           style={{
             background: 'linear-gradient(135deg, #F5E6D3 0%, #E8D4B8 50%, #F0E2CE 100%)',
@@ -240,7 +284,7 @@ const TripMemoryMap = ({ tripId = 1 }: TripMemoryMapProps) => {
 
                   {/* Actual photo */}
                   <image
-                    href={pos.photo.photo_url}
+                    href={pos.photo.thumbnail_url || pos.photo.photo_url}
                     x={pos.x - 55}
                     y={pos.y < 250 ? 35 : 375}
                     width="110"
@@ -266,7 +310,8 @@ const TripMemoryMap = ({ tripId = 1 }: TripMemoryMapProps) => {
                     fontSize="14"
                     fontWeight="bold"
                   >
-                    {index + 1}
+                    {/* Numbered from the trip's first photo, even before older pages load */}
+                    {total - photos.length + index + 1}
                   </text>
                 </g>
 
@@ -6,7 +6,8 @@ import { Badge } from "@/components/ui/badge";
 import { Camera, Plus, Download, Loader2, Upload, X, Image as ImageIcon } from "lucide-react";
 import { useState, useEffect, useRef, useCallback } from "react";
 import { useRouter } from "next/navigation";
-import { getTripPhotos, uploadPhotos, type Photo } from "@/lib/api/photos";
+import { uploadPhotos, PHOTO_GALLERY_FIELDS } from "@/lib/api/photos";
+import { useTripPhotos } from "@/hooks/useTripPhotos";
 import { useAuth } from "@/contexts/AuthContext";
 
 interface TripMomentsProps {
@@ -17,16 +18,35 @@ const TripMoments = ({ tripId }: TripMomentsProps) => {
   const router = useRouter();
   const { session } = useAuth();
   const fileInputRef = useRef<HTMLInputElement>(null);
-
-  const [allPhotos, setAllPhotos] = useState<Photo[]>([]);
-  const [loading, setLoading] = useState(true);
+  const loadMoreRef = useRef<HTMLDivElement>(null);
+
+  const {
+    photos: allPhotos,
+    total,
+    hasMore,
+    loading,
+    loadingMore,
+    loadMore,
+    reload,
+  } = useTripPhotos(tripId, PHOTO_GALLERY_FIELDS);
   const [uploading, setUploading] = useState(false);
   const [selectedFiles, setSelectedFiles] = useState<File[]>([]);
   const [previewUrls, setPreviewUrls] = useState<string[]>([]);
 
+  // Load the next page as the end of the gallery scrolls into view
   useEffect(() => {
-    loadPhotos();
-  }, [tripId]);
+    const sentinel = loadMoreRef.current;
+    if (!sentinel || !hasMore) return;
+
+    const observer = new IntersectionObserver(
+      (entries) => {
+        if (entries[0].isIntersecting) loadMore();
+      },
+      { rootMargin: "400px" }
+    );
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [hasMore, loadMore, loading]);
 
   // Handle paste event for images
   useEffect(() => {
@@ -54,18 +74,6 @@ const TripMoments = ({ tripId }: TripMomentsProps) => {
     return () => window.removeEventListener("paste", handlePaste);
   }, [selectedFiles]);
 
-  const loadPhotos = async () => {
-    setLoading(true);
-    try {
-      const photos = await getTripPhotos(tripId);
-      setAllPhotos(photos);
-    } catch (error) {
-      console.error("Failed to load photos:", error);
-    } finally {
-      setLoading(false);
-    }
-  };
-
   const handleFilesSelected = useCallback((files: File[]) => {
     const newFiles = [...selectedFiles, ...files];
     setSelectedFiles(newFiles);
@@ -109,7 +117,7 @@ const TripMoments = ({ tripId }: TripMomentsProps) => {
       setPreviewUrls([]);
 
       // Reload photos
-      await loadPhotos();
+      await reload();
     } catch (error) {
       console.error("Failed to upload photos:", error);
       alert("Error al subir las fotos. Por favor intenta de nuevo.");
@@ -250,7 +258,7 @@ const TripMoments = ({ tripId }: TripMomentsProps) => {
             <div>
               <p className="text-sm text-muted-foreground">Total de Fotos</p>
               <p className="text-3xl font-black text-primary">
-                {allPhotos.length}
+                {total}
               </p>
             </div>
           </div>
@@ -313,8 +321,9 @@ const TripMoments = ({ tripId }: TripMomentsProps) => {
               >
                 <div className="relative aspect-square">
                   <img
-                    src={photo.photo_url}
+                    src={photo.thumbnail_url || photo.photo_url}
                     alt={photo.description || "Foto"}
+                    loading="lazy"
                     className="w-full h-full object-cover"
                   />
                   {photo.location_name && (
@@ -328,6 +337,27 @@ const TripMoments = ({ tripId }: TripMomentsProps) => {
               </Card>
             ))}
           </div>
+
+          {/* Next page: loads on scroll, or on click */}
+          {hasMore && (
+            <div ref={loadMoreRef} className="flex justify-center mt-6">
+              <Button
+                variant="outline"
+                onClick={loadMore}
+                disabled={loadingMore}
+                className="rounded-full"
+              >
+                {loadingMore ? (
+                  <>
+                    <Loader2 className="h-4 w-4 mr-2 animate-spin" />
+                    Cargando...
+                  </>
+                ) : (
+                  `Cargar más fotos (${allPhotos.length} de ${total})`
+                )}
+              </Button>
+            </div>
+          )}
         </div>
       )}
 
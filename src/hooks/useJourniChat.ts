@@ -56,6 +56,58 @@ export interface SessionState {
   debts: Record<string, Debt[]>;
 }
 
+// Versioned ledger delta sent with bot_complete / whatsapp_message
+interface CollectionDelta<T> {
+  added?: T[];
+  changed?: T[];
+  removed?: string[];
+}
+
+interface StateDelta {
+  expenses?: CollectionDelta<Expense>;
+  payments?: CollectionDelta<Payment>;
+}
+
+function applyCollectionDelta<T extends { id: string }>(items: T[], delta?: CollectionDelta<T>): T[] {
+  if (!delta) return items;
+  const changed = new Map((delta.changed || []).map((item) => [item.id, item]));
+  const removed = new Set(delta.removed || []);
+  return [
+    ...items.filter((item) => !removed.has(item.id)).map((item) => changed.get(item.id) || item),
+    ...(delta.added || []),
+  ];
+}
+
+// Convert stored room frames (room_snapshot / history_page) to chat messages
+function framesToMessages(frames: Record<string, unknown>[]): ChatMessage[] {
+  const result: ChatMessage[] = [];
+  frames.forEach((frame, idx) => {
+    const timestamp = (frame.timestamp as string) || new Date().toISOString();
+    const id = `room_${idx}_${timestamp}`;
+    switch (frame.type) {
+      case "user_message":
+        result.push({ id, type: "user", content: frame.content as string, userId: frame.user_id as string, timestamp, hasImage: frame.has_image as boolean });
+        break;
+      case "whatsapp_message":
+        result.push({ id, type: "user", content: frame.content as string, userId: frame.user_id as string, timestamp, source: "whatsapp" });
+        if (frame.response) {
+          result.push({ id: `${id}_bot`, type: "bot", content: frame.response as string, timestamp });
+        }
+        break;
+      case "bot_complete":
+        result.push({ id, type: "bot", content: frame.content as string, timestamp });
+        break;
+      case "user_joined":
+        result.push({ id, type: "system", content: `${frame.user_id} se unió`, timestamp });
+        break;
+      case "user_left":
+        result.push({ id, type: "system", content: `${frame.user_id} se desconectó`, timestamp });
+        break;
+    }
+  });
+  return result;
+}
+
 export type ConnectionStatus = "disconnected" | "connecting" | "connected" | "error";
 
 interface UseJourniChatOptions {
@@ -73,12 +125,17 @@ interface UseJourniChatReturn {
   // Messages
   messages: ChatMessage[];
   sendMessage: (content: string, image?: string) => void;
+  cancelResponse: () => void;
 
   // Streaming state
   isTyping: boolean;
   streamingContent: string;
   thinkingSteps: ThinkingStep[];
 
+  // Older room history (paged on demand)
+  hasOlderMessages: boolean;
+  loadOlderMessages: () => void;
+
   // Session state
   sessionState: SessionState;
   participants: string[];
@@ -91,6 +148,7 @@ const BACKEND_URL = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:800
 async function fetchSessionHistory(sessionId: string): Promise<{
   messages: ChatMessage[];
   state: SessionState;
+  stateVersion: number;
 } | null> {
   try {
     const response = await fetch(`${BACKEND_URL}/api/sessions/${sessionId}/history`);
@@ -114,6 +172,7 @@ async function fetchSessionHistory(sessionId: string): Promise<{
 
     return {
       messages,
+      stateVersion: data.state_version || 0,
       state: {
         expenses: data.state.expenses || [],
         payments: data.state.payments || [],
@@ -128,6 +187,29 @@ async function fetchSessionHistory(sessionId: string): Promise<{
   }
 }
 
+// Upload a chat image as raw bytes ahead of the message; returns its upload_id.
+// uploadKey comes from the room_snapshot/resumed frame and proves we joined.
+async function uploadImage(sessionId: string, userId: string, uploadKey: string, dataUrl: string): Promise<string | null> {
+  try {
+    const blob = await (await fetch(dataUrl)).blob();
+    const url = `${BACKEND_URL}/api/sessions/${sessionId}/uploads?user_id=${encodeURIComponent(userId)}`;
+    const response = await fetch(url, {
+      method: "POST",
+      headers: { "Content-Type": blob.type || "image/jpeg", "X-Upload-Key": uploadKey },
+      body: blob,
+    });
+    if (!response.ok) {
+      console.error("[Upload] Failed:", response.status);
+      return null;
+    }
+    const data = await response.json();
+    return data.upload_id as string;
+  } catch (err) {
+    console.error("[Upload] Error:", err);
+    return null;
+  }
+}
+
 export function useJourniChat({
   sessionId,
   userId,
@@ -148,9 +230,22 @@ export function useJourniChat({
   });
   const [onlineUsers, setOnlineUsers] = useState<string[]>([]);
   const [historyLoaded, setHistoryLoaded] = useState(false);
+  // Ledger version of sessionState; deltas only apply on top of this version
+  const stateVersionRef = useRef(0);
+  // Cursor for the next older page of room history (null = nothing older)
+  const [historyBefore, setHistoryBefore] = useState<number | null>(null);
+  const historyLoadedRef = useRef(false);
 
   const wsRef = useRef<WebSocket | null>(null);
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
+  // Last room frame seen; sent on reconnect to get only the missed frames
+  const resumeRef = useRef<{ seq: number; epoch: string } | null>(null);
+  // Sent with image uploads (handed out by the server on join)
+  const uploadKeyRef = useRef<string | null>(null);
+  const reconnectAttemptsRef = useRef(0);
+  const manualCloseRef = useRef(false);
+  const connectRef = useRef<(() => Promise<void>) | null>(null);
+  const sendChainRef = useRef<Promise<void>>(Promise.resolve());
 
   const connect = useCallback(async () => {
     if (wsRef.current?.readyState === WebSocket.OPEN) {
@@ -163,6 +258,7 @@ export function useJourniChat({
       return;
     }
 
+    manualCloseRef.current = false;
     setStatus("connecting");
 
     // Load history before connecting (only once per session)
@@ -173,6 +269,8 @@ export function useJourniChat({
         console.log(`[History] Loaded ${history.messages.length} messages`);
         setMessages(history.messages);
         setSessionState(history.state);
+        stateVersionRef.current = history.stateVersion;
+        historyLoadedRef.current = true;
         setHistoryLoaded(true);
       }
     }
@@ -180,7 +278,11 @@ export function useJourniChat({
     const wsUrl = BACKEND_URL.replace(/^http/, "ws");
     // Encode userId to handle spaces and special characters in names
     const encodedUserId = encodeURIComponent(userId);
-    const fullUrl = `${wsUrl}/ws/${sessionId}/${encodedUserId}`;
+    let fullUrl = `${wsUrl}/ws/${sessionId}/${encodedUserId}`;
+    if (resumeRef.current) {
+      const { seq, epoch } = resumeRef.current;
+      fullUrl += `?resume_seq=${seq}&epoch=${encodeURIComponent(epoch)}`;
+    }
     console.log("[WS] Connecting to:", fullUrl);
 
     const ws = new WebSocket(fullUrl);
@@ -188,6 +290,7 @@ export function useJourniChat({
 
     ws.onopen = () => {
       console.log("[WS] Connected successfully");
+      reconnectAttemptsRef.current = 0;
       setStatus("connected");
       setOnlineUsers((prev) => [...new Set([...prev, userId])]);
     };
@@ -196,6 +299,9 @@ export function useJourniChat({
       try {
         const data = JSON.parse(event.data);
         console.log("[WS] Message received:", data.type);
+        if (typeof data.seq === "number" && resumeRef.current) {
+          resumeRef.current.seq = data.seq;
+        }
         handleMessage(data);
       } catch (err) {
         console.error("[WS] Failed to parse message:", err);
@@ -212,10 +318,21 @@ export function useJourniChat({
       console.log("[WS] Connection closed:", event.code, event.reason);
       setStatus("disconnected");
       wsRef.current = null;
+
+      // Dropped, not closed by us: reconnect with backoff and resume
+      if (!manualCloseRef.current) {
+        const delay = Math.min(1000 * 2 ** reconnectAttemptsRef.current, 15000);
+        reconnectAttemptsRef.current += 1;
+        console.log(`[WS] Reconnecting in ${delay}ms`);
+        reconnectTimeoutRef.current = setTimeout(() => connectRef.current?.(), delay);
+      }
     };
   }, [sessionId, userId, onError, historyLoaded]);
 
+  connectRef.current = connect;
+
   const disconnect = useCallback(() => {
+    manualCloseRef.current = true;
     if (reconnectTimeoutRef.current) {
       clearTimeout(reconnectTimeoutRef.current);
     }
@@ -224,11 +341,108 @@ export function useJourniChat({
     setStatus("disconnected");
   }, []);
 
+  const requestSync = useCallback(() => {
+    if (wsRef.current?.readyState === WebSocket.OPEN) {
+      wsRef.current.send(JSON.stringify({ type: "sync", version: stateVersionRef.current }));
+    }
+  }, []);
+
+  // Apply ledger fields from bot_complete / whatsapp_message
+  const applyLedgerUpdate = useCallback((data: Record<string, unknown>) => {
+    if (data.state_version === undefined) return;
+    const baseVersion = data.base_version as number;
+    const stateVersion = data.state_version as number;
+    const stateDelta = (data.state_delta as StateDelta) || {};
+
+    // Older than what we have (e.g. history replayed after the join snapshot)
+    if (stateVersion < stateVersionRef.current) return;
+
+    // Ledger deltas: only on top of the exact version they were computed from
+    if (stateVersion !== baseVersion) {
+      if (stateVersion === stateVersionRef.current) return;
+      if (baseVersion !== stateVersionRef.current) {
+        console.log(`[Sync] Version mismatch (have ${stateVersionRef.current}, delta from ${baseVersion})`);
+        requestSync();
+        return;
+      }
+      stateVersionRef.current = stateVersion;
+    }
+
+    setSessionState((prev) => ({
+      ...prev,
+      expenses: applyCollectionDelta(prev.expenses, stateDelta.expenses),
+      payments: applyCollectionDelta(prev.payments, stateDelta.payments),
+      balances: (data.balances as Record<string, Record<string, number>>) || prev.balances,
+      participants: (data.participants as string[]) || prev.participants,
+      debts: (data.debts as Record<string, Debt[]>) || prev.debts,
+    }));
+  }, [requestSync]);
+
   const handleMessage = useCallback((data: Record<string, unknown>) => {
     const type = data.type as string;
     const timestamp = (data.timestamp as string) || new Date().toISOString();
 
     switch (type) {
+      case "room_snapshot": {
+        // Single frame on join: recent history, presence and full ledger
+        const state = data.state as SessionState;
+        stateVersionRef.current = data.state_version as number;
+        resumeRef.current = { seq: data.last_seq as number, epoch: data.epoch as string };
+        uploadKeyRef.current = data.upload_key as string;
+        setSessionState({
+          expenses: state.expenses || [],
+          payments: state.payments || [],
+          balances: state.balances || {},
+          participants: state.participants || [],
+          debts: state.debts || {},
+        });
+        setOnlineUsers(data.online_users as string[]);
+        // Full conversation already loaded over HTTP; room history is only
+        // needed when that failed
+        if (!historyLoadedRef.current) {
+          setMessages(framesToMessages(data.messages as Record<string, unknown>[]));
+          setHistoryBefore(data.history_before as number | null);
+        }
+        break;
+      }
+
+      case "resumed": {
+        // Reconnected: replay only the frames missed while offline
+        for (const frame of data.messages as Record<string, unknown>[]) {
+          handleMessage(frame);
+        }
+        resumeRef.current = { seq: data.last_seq as number, epoch: data.epoch as string };
+        uploadKeyRef.current = data.upload_key as string;
+        setOnlineUsers(data.online_users as string[]);
+        break;
+      }
+
+      case "presence": {
+        setOnlineUsers(data.online_users as string[]);
+        break;
+      }
+
+      case "history_page": {
+        const older = framesToMessages(data.messages as Record<string, unknown>[]);
+        setMessages((prev) => [...older, ...prev]);
+        setHistoryBefore(data.before as number | null);
+        break;
+      }
+
+      case "state_snapshot": {
+        // Full ledger (on join and after a sync request)
+        const state = data.state as SessionState;
+        stateVersionRef.current = data.state_version as number;
+        setSessionState({
+          expenses: state.expenses || [],
+          payments: state.payments || [],
+          balances: state.balances || {},
+          participants: state.participants || [],
+          debts: state.debts || {},
+        });
+        break;
+      }
+
       case "user_message": {
         const newMessage: ChatMessage = {
           id: `msg_${Date.now()}_${Math.random().toString(36).slice(2)}`,
@@ -268,17 +482,7 @@ export function useJourniChat({
           setMessages((prev) => [...prev, whatsappBotMsg]);
         }
 
-        // Update session state if provided
-        if (data.expenses || data.balances || data.participants || data.debts) {
-          setSessionState((prev) => ({
-            ...prev,
-            expenses: (data.expenses as Expense[]) || prev.expenses,
-            payments: (data.payments as Payment[]) || prev.payments,
-            balances: (data.balances as Record<string, Record<string, number>>) || prev.balances,
-            participants: (data.participants as string[]) || prev.participants,
-            debts: (data.debts as Record<string, Debt[]>) || prev.debts,
-          }));
-        }
+        applyLedgerUpdate(data);
         break;
       }
 
@@ -333,17 +537,7 @@ export function useJourniChat({
         thinkingStepsRef.current = [];
         setThinkingSteps([]);
 
-        // Update session state
-        if (data.expenses || data.balances || data.participants || data.debts) {
-          setSessionState((prev) => ({
-            ...prev,
-            expenses: (data.expenses as Expense[]) || prev.expenses,
-            payments: (data.payments as Payment[]) || prev.payments,
-            balances: (data.balances as Record<string, Record<string, number>>) || prev.balances,
-            participants: (data.participants as string[]) || prev.participants,
-            debts: (data.debts as Record<string, Debt[]>) || prev.debts,
-          }));
-        }
+        applyLedgerUpdate(data);
         break;
       }
 
@@ -355,9 +549,21 @@ export function useJourniChat({
         break;
       }
 
+      case "ping": {
+        // Server heartbeat: answer or the socket is reaped as dead
+        if (wsRef.current?.readyState === WebSocket.OPEN) {
+          wsRef.current.send(JSON.stringify({ type: "pong" }));
+        }
+        break;
+      }
+
       case "user_joined": {
         const joinedUser = data.user_id as string;
-        setOnlineUsers((prev) => [...new Set([...prev, joinedUser])]);
+        if (data.online_users) {
+          setOnlineUsers(data.online_users as string[]);
+        } else {
+          setOnlineUsers((prev) => [...new Set([...prev, joinedUser])]);
+        }
         if (data.participants) {
           setSessionState((prev) => ({
             ...prev,
@@ -384,7 +590,12 @@ export function useJourniChat({
 
       case "user_left": {
         const leftUser = data.user_id as string;
-        setOnlineUsers((prev) => prev.filter((u) => u !== leftUser));
+        // online_users stays accurate when the same user has several tabs open
+        if (data.online_users) {
+          setOnlineUsers(data.online_users as string[]);
+        } else {
+          setOnlineUsers((prev) => prev.filter((u) => u !== leftUser));
+        }
 
         const leftContent = `${leftUser} se desconectó`;
         setMessages((prev) => {
@@ -406,7 +617,7 @@ export function useJourniChat({
       default:
         console.log("Unknown message type:", type, data);
     }
-  }, []);
+  }, [applyLedgerUpdate]);
 
   const sendMessage = useCallback((content: string, image?: string) => {
     if (!wsRef.current || wsRef.current.readyState !== WebSocket.OPEN) {
@@ -414,14 +625,35 @@ export function useJourniChat({
       return;
     }
 
-    const message: { content: string; image?: string } = { content };
-    if (image) {
-      message.image = image;
-    }
+    // Chained so a message with an image can't be overtaken by the next one
+    sendChainRef.current = sendChainRef.current.then(async () => {
+      const message: { content: string; image?: string; upload_id?: string } = { content };
+      if (image) {
+        // Raw bytes go to Storage over HTTP; the chat frame carries only the id
+        const uploadKey = uploadKeyRef.current;
+        const uploadId = uploadKey ? await uploadImage(sessionId, userId, uploadKey, image) : null;
+        if (uploadId) {
+          message.upload_id = uploadId;
+        } else {
+          message.image = image;
+        }
+      }
+      wsRef.current?.send(JSON.stringify(message));
+    });
+  }, [sessionId, userId]);
 
-    wsRef.current.send(JSON.stringify(message));
+  // Stop the agent's current answer (for everyone in the room)
+  const cancelResponse = useCallback(() => {
+    if (wsRef.current?.readyState === WebSocket.OPEN) {
+      wsRef.current.send(JSON.stringify({ type: "cancel" }));
+    }
   }, []);
 
+  const loadOlderMessages = useCallback(() => {
+    if (historyBefore === null || wsRef.current?.readyState !== WebSocket.OPEN) return;
+    wsRef.current.send(JSON.stringify({ type: "load_history", before: historyBefore }));
+  }, [historyBefore]);
+
   // Cleanup on unmount
   useEffect(() => {
     return () => {
@@ -435,9 +667,12 @@ export function useJourniChat({
     disconnect,
     messages,
     sendMessage,
+    cancelResponse,
     isTyping,
     streamingContent,
     thinkingSteps,
+    hasOlderMessages: historyBefore !== null,
+    loadOlderMessages,
     sessionState,
     participants: sessionState.participants,
     onlineUsers,
@@ -0,0 +1,73 @@
+"use client";
+
+import { useState, useEffect, useCallback, useRef } from "react";
+import { getTripPhotosPage, type Photo } from "@/lib/api/photos";
+
+/**
+ * Page through a trip's photos, newest first, one request per page.
+ *
+ * The first page loads on mount (and when tripId changes); call loadMore()
+ * from a scroll handler or a "load more" button for the next one. Pass a
+ * module-level fields array (e.g. PHOTO_GRID_FIELDS) so it keeps its identity.
+ */
+export function useTripPhotos(tripId: number, fields?: string[]) {
+  const [photos, setPhotos] = useState<Photo[]>([]);
+  const [total, setTotal] = useState<number | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  // Bumped on every reload so pages for a previous trip (or a stale
+  // listing) are dropped when they arrive
+  const generationRef = useRef(0);
+  const loadingMoreRef = useRef(false);
+
+  const reload = useCallback(async () => {
+    const generation = ++generationRef.current;
+    setLoading(true);
+    try {
+      const page = await getTripPhotosPage(tripId, { fields });
+      if (generation !== generationRef.current) return;
+      setPhotos(page.items);
+      setTotal(page.total);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error("Failed to load photos:", error);
+    } finally {
+      if (generation === generationRef.current) setLoading(false);
+    }
+  }, [tripId, fields]);
+
+  const loadMore = useCallback(async () => {
+    if (!nextCursor || loadingMoreRef.current) return;
+    const generation = generationRef.current;
+    loadingMoreRef.current = true;
+    setLoadingMore(true);
+    try {
+      const page = await getTripPhotosPage(tripId, { cursor: nextCursor, fields });
+      if (generation !== generationRef.current) return;
+      setPhotos((prev) => [...prev, ...page.items]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error("Failed to load more photos:", error);
+    } finally {
+      loadingMoreRef.current = false;
+      setLoadingMore(false);
+    }
+  }, [tripId, fields, nextCursor]);
+
+  useEffect(() => {
+    reload();
+  }, [reload]);
+
+  return {
+    photos,
+    // All the trip's photos (from the first page), or what is loaded so far
+    total: total ?? photos.length,
+    hasMore: nextCursor !== null,
+    loading,
+    loadingMore,
+    loadMore,
+    reload,
+  };
+}
@@ -37,70 +37,95 @@ export interface Photo {
   created_at: string;
 }
 
+export interface PageOptions {
+  limit?: number;
+  cursor?: string;
+  fields?: string[];
+}
+
+export interface Page<T> {
+  items: T[];
+  nextCursor: string | null;
+  total: number | null;
+}
+
+// Columns the gallery grid needs
+export const PHOTO_GRID_FIELDS = ["id", "photo_url", "thumbnail_url"];
+// Grid plus the captions shown by the Moments gallery and the memory map
+export const PHOTO_GALLERY_FIELDS = [...PHOTO_GRID_FIELDS, "description", "location_name"];
+
 // ============== API FUNCTIONS ==============
 
 /**
- * Get all milestones for a trip.
- *
- * @param tripId - The trip ID
- * @returns Array of milestones
+ * Fetch one page of a keyset-paginated listing.
  */
-export async function getTripMilestones(tripId: number): Promise<Milestone[]> {
-  try {
-    const res = await fetch(`${API_URL}/api/trips/${tripId}/milestones`);
+async function fetchPage<T>(path: string, key: string, options: PageOptions): Promise<Page<T>> {
+  const params = new URLSearchParams();
+  if (options.limit) params.set("limit", String(options.limit));
+  if (options.cursor) params.set("cursor", options.cursor);
+  if (options.fields?.length) params.set("fields", options.fields.join(","));
+  const query = params.toString();
+
+  const res = await fetch(`${API_URL}${path}${query ? `?${query}` : ""}`);
+  if (!res.ok) {
+    throw new Error(`Failed to fetch ${key}: ${res.statusText}`);
+  }
 
-    if (!res.ok) {
-      throw new Error(`Failed to fetch milestones: ${res.statusText}`);
-    }
+  const data = await res.json();
+  return { items: data[key] || [], nextCursor: data.next_cursor ?? null, total: data.total ?? null };
+}
 
-    const data = await res.json();
-    return data.milestones || [];
-  } catch (error) {
-    console.error("Error fetching milestones:", error);
-    return [];
-  }
+/**
+ * Follow next_cursor until the listing is exhausted.
+ * Only for small listings that are used whole; page photos instead.
+ */
+async function fetchAll<T>(path: string, key: string, fields?: string[]): Promise<T[]> {
+  const items: T[] = [];
+  let cursor: string | undefined;
+  do {
+    const page = await fetchPage<T>(path, key, { cursor, fields, limit: 200 });
+    items.push(...page.items);
+    cursor = page.nextCursor ?? undefined;
+  } while (cursor);
+  return items;
 }
 
 /**
- * Get all photos in a specific milestone.
- *
- * @param milestoneId - The milestone ID
- * @returns Array of photos
+ * Get one page of a trip's milestones, newest first.
  */
-export async function getMilestonePhotos(milestoneId: number): Promise<Photo[]> {
-  try {
-    const res = await fetch(`${API_URL}/api/milestones/${milestoneId}/photos`);
+export function getTripMilestonesPage(tripId: number, options: PageOptions = {}): Promise<Page<Milestone>> {
+  return fetchPage<Milestone>(`/api/trips/${tripId}/milestones`, "milestones", options);
+}
 
-    if (!res.ok) {
-      throw new Error(`Failed to fetch milestone photos: ${res.statusText}`);
-    }
+/**
+ * Get one page of a milestone's photos, in upload order.
+ */
+export function getMilestonePhotosPage(milestoneId: number, options: PageOptions = {}): Promise<Page<Photo>> {
+  return fetchPage<Photo>(`/api/milestones/${milestoneId}/photos`, "photos", options);
+}
 
-    const data = await res.json();
-    return data.photos || [];
-  } catch (error) {
-    console.error("Error fetching milestone photos:", error);
-    return [];
-  }
+/**
+ * Get one page of a trip's photos, newest first.
+ * Pass fields: PHOTO_GRID_FIELDS for thumbnails only.
+ */
+export function getTripPhotosPage(tripId: number, options: PageOptions = {}): Promise<Page<Photo>> {
+  return fetchPage<Photo>(`/api/trips/${tripId}/photos`, "photos", options);
 }
 
 /**
- * Get all photos for a trip (across all milestones).
+ * Get all milestones for a trip.
+ *
+ * A trip has a handful of milestones and pickers need all of them, so this
+ * follows every page; use getTripMilestonesPage for long listings.
  *
  * @param tripId - The trip ID
- * @returns Array of photos
+ * @returns Array of milestones
  */
-export async function getTripPhotos(tripId: number): Promise<Photo[]> {
+export async function getTripMilestones(tripId: number): Promise<Milestone[]> {
   try {
-    const res = await fetch(`${API_URL}/api/trips/${tripId}/photos`);
-
-    if (!res.ok) {
-      throw new Error(`Failed to fetch trip photos: ${res.statusText}`);
-    }
-
-    const data = await res.json();
-    return data.photos || [];
+    return await fetchAll<Milestone>(`/api/trips/${tripId}/milestones`, "milestones");
   } catch (error) {
-    console.error("Error fetching trip photos:", error);
+    console.error("Error fetching milestones:", error);
     return [];
   }
 }
@@ -25,6 +25,8 @@ export interface TripResponse {
   creator_id: string;
   created_at: string;
   updated_at?: string;
+  subtitle?: string | null;
+  cover_image_url?: string | null;
 }
 
 export interface TripPublicInfo {
@@ -116,12 +118,22 @@ export async function getTripById(
 }
 
 /**
- * List user's trips. Requires authentication.
+ * List user's trips, newest first. Requires authentication.
+ * Pass the returned next_cursor to get the following page (null on the last one).
+ * total counts all the user's trips and is only set on the first page.
  */
 export async function listTrips(
-  accessToken: string
-): Promise<{ trips: TripResponse[]; total: number }> {
-  const response = await fetch(`${BACKEND_URL}/api/trips`, {
+  accessToken: string,
+  options: { limit?: number; cursor?: string; status?: string; fields?: string[] } = {}
+): Promise<{ trips: TripResponse[]; total: number | null; next_cursor: string | null }> {
+  const params = new URLSearchParams();
+  if (options.limit) params.set("limit", String(options.limit));
+  if (options.cursor) params.set("cursor", options.cursor);
+  if (options.status) params.set("status", options.status);
+  if (options.fields?.length) params.set("fields", options.fields.join(","));
+  const query = params.toString();
+
+  const response = await fetch(`${BACKEND_URL}/api/trips${query ? `?${query}` : ""}`, {
     headers: {
       Authorization: `Bearer ${accessToken}`,
     },
@@ -0,0 +1,50 @@
+-- ============================================
+-- JOURNI - Single-round-trip trip creation
+-- ============================================
+-- Creating a trip used to take three requests from the backend
+-- (generate_session_code, insert trip, insert creator as participant),
+-- not atomic and ~3 network latencies. This function does all of it in
+-- one transaction and returns the trip and the creator's membership.
+-- ============================================
+
+CREATE OR REPLACE FUNCTION create_trip_with_creator(
+  p_creator_id UUID,
+  p_name TEXT,
+  p_start_date DATE,
+  p_end_date DATE,
+  p_location TEXT DEFAULT NULL
+)
+RETURNS JSONB AS $$
+DECLARE
+  new_trip public.trips;
+  membership public.trip_participants;
+  attempt INTEGER := 0;
+BEGIN
+  -- generate_session_code() checks for collisions, but two concurrent
+  -- creations can still pick the same code: retry on unique violation
+  LOOP
+    BEGIN
+      INSERT INTO public.trips (creator_id, name, session_code, start_date, end_date, location, status)
+      VALUES (p_creator_id, p_name, generate_session_code(), p_start_date, p_end_date, p_location, 'active')
+      RETURNING * INTO new_trip;
+      EXIT;
+    EXCEPTION WHEN unique_violation THEN
+      attempt := attempt + 1;
+      IF attempt >= 5 THEN
+        RAISE;
+      END IF;
+    END;
+  END LOOP;
+
+  INSERT INTO public.trip_participants (trip_id, user_id, role)
+  VALUES (new_trip.id, p_creator_id, 'admin')
+  RETURNING * INTO membership;
+
+  RETURN jsonb_build_object(
+    'trip', to_jsonb(new_trip),
+    'membership', to_jsonb(membership)
+  );
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION create_trip_with_creator IS 'Create a trip and its admin participant in one transaction';
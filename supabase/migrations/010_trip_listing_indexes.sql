@@ -0,0 +1,16 @@
+-- ============================================
+-- JOURNI - Indexes for paginated trip listing
+-- ============================================
+-- GET /api/trips is one query: trips inner-joined with the user's
+-- trip_participants rows, ordered by (created_at, id) and paged by keyset.
+-- ============================================
+
+-- Membership lookup for the join, covering trip_id
+CREATE INDEX IF NOT EXISTS idx_trip_participants_user_trip
+  ON public.trip_participants(user_id, trip_id);
+
+-- Keyset order (created_at DESC, id DESC), optionally filtered by status
+CREATE INDEX IF NOT EXISTS idx_trips_created_at_id
+  ON public.trips(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_trips_status_created_at_id
+  ON public.trips(status, created_at DESC, id DESC);
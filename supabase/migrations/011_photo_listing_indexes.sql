@@ -0,0 +1,17 @@
+-- ============================================
+-- JOURNI - Indexes for paginated photo and milestone listing
+-- ============================================
+-- Photo and milestone listings are keyset-paged by (created_at, id) within
+-- a trip or milestone. These indexes serve both the page query and the
+-- first page's exact count (an index-only scan on the leading column).
+-- ============================================
+
+CREATE INDEX IF NOT EXISTS idx_photos_trip_created_id
+  ON public.photos(trip_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_photos_milestone_created_id
+  ON public.photos(milestone_id, created_at, id)
+  WHERE milestone_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_milestones_trip_created_id
+  ON public.milestones(trip_id, created_at DESC, id DESC);
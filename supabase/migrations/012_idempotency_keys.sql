@@ -0,0 +1,22 @@
+-- ============================================
+-- JOURNI - Idempotency keys for agent-side writes
+-- ============================================
+-- Milestones and photos created by the agent are written by the backend's
+-- outbox worker, which retries failed batches. Each row carries the key
+-- it was enqueued with; upserts on it make a retry after a lost response
+-- a no-op instead of a duplicate. Rows written elsewhere leave it NULL.
+-- ============================================
+
+ALTER TABLE public.milestones
+  ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+ALTER TABLE public.photos
+  ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+
+-- Unique (NULLs allowed) so PostgREST can upsert with on_conflict=idempotency_key
+CREATE UNIQUE INDEX IF NOT EXISTS idx_milestones_idempotency_key
+  ON public.milestones(idempotency_key);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_photos_idempotency_key
+  ON public.photos(idempotency_key);
+
+COMMENT ON COLUMN public.milestones.idempotency_key IS 'Outbox key of the agent write that created this row';
+COMMENT ON COLUMN public.photos.idempotency_key IS 'Outbox key of the agent write that created this row';
@@ -0,0 +1,193 @@
+-- ============================================
+-- JOURNI - Ledger mirror in expenses / expense_splits
+-- ============================================
+-- The agent's ledger (expenses and payments) lives in LangGraph state.
+-- The backend mirrors each trip's ledger into expenses/expense_splits
+-- with sync_trip_ledger(), and reports read per-trip, per-currency,
+-- per-person aggregates from the views below instead of checkpoints.
+--
+-- Ledger participants are names typed in chat, not accounts, so mirrored
+-- rows use paid_by_name / person_name and leave the user_id columns NULL.
+-- Payments are rows with kind = 'payment': paid by the sender and split
+-- entirely to the receiver.
+-- ============================================
+
+ALTER TABLE public.expenses
+  ALTER COLUMN paid_by_user_id DROP NOT NULL,
+  ADD COLUMN IF NOT EXISTS ledger_id TEXT,
+  ADD COLUMN IF NOT EXISTS kind TEXT NOT NULL DEFAULT 'expense' CHECK (kind IN ('expense', 'payment')),
+  ADD COLUMN IF NOT EXISTS paid_by_name TEXT;
+
+-- The agent accepts any ISO currency code
+ALTER TABLE public.expenses DROP CONSTRAINT IF EXISTS expenses_currency_check;
+
+ALTER TABLE public.expense_splits
+  ALTER COLUMN user_id DROP NOT NULL,
+  ADD COLUMN IF NOT EXISTS person_name TEXT;
+
+COMMENT ON COLUMN public.expenses.ledger_id IS 'Id in the agent ledger (exp_N / pay_N); NULL for rows not mirrored from it';
+COMMENT ON COLUMN public.expenses.paid_by_name IS 'Ledger name of the payer';
+COMMENT ON COLUMN public.expense_splits.person_name IS 'Ledger name of the person who owes this share';
+
+-- Mirrored rows carry their own splits: don't add equal splits for them
+CREATE OR REPLACE FUNCTION auto_create_expense_splits()
+RETURNS TRIGGER AS $$
+DECLARE
+  participant RECORD;
+  split_amount DECIMAL(10, 2);
+  participant_count INTEGER;
+BEGIN
+  IF NEW.ledger_id IS NOT NULL THEN
+    RETURN NEW;
+  END IF;
+
+  SELECT COUNT(*) INTO participant_count
+  FROM trip_participants
+  WHERE trip_id = NEW.trip_id;
+
+  split_amount := NEW.amount / participant_count;
+
+  FOR participant IN
+    SELECT user_id FROM trip_participants WHERE trip_id = NEW.trip_id
+  LOOP
+    INSERT INTO expense_splits (expense_id, user_id, amount)
+    VALUES (NEW.id, participant.user_id, split_amount);
+  END LOOP;
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ============================================
+-- Indexes for the aggregates
+-- ============================================
+CREATE INDEX IF NOT EXISTS idx_expenses_ledger_trip_currency
+  ON public.expenses(trip_id, currency) INCLUDE (paid_by_name, amount, kind)
+  WHERE ledger_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_expense_splits_expense_person
+  ON public.expense_splits(expense_id) INCLUDE (person_name, amount);
+
+-- ============================================
+-- Last snapshot applied per trip
+-- ============================================
+CREATE TABLE IF NOT EXISTS public.trip_ledger_sync (
+  trip_id BIGINT PRIMARY KEY REFERENCES public.trips(id) ON DELETE CASCADE,
+  version BIGINT NOT NULL,
+  synced_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE public.trip_ledger_sync ENABLE ROW LEVEL SECURITY;
+
+-- ============================================
+-- FUNCTION: sync_trip_ledger
+-- ============================================
+-- Replaces a trip's mirrored rows with a ledger snapshot in one
+-- transaction. Snapshots are ordered by p_version (enqueue time); an
+-- older one arriving late (retries, several workers) is ignored.
+--
+-- p_entries: [{ledger_id, kind, description, amount, currency,
+--              paid_by_name, splits: [{person_name, amount}]}]
+
+CREATE OR REPLACE FUNCTION sync_trip_ledger(
+  p_trip_id BIGINT,
+  p_version BIGINT,
+  p_entries JSONB
+)
+RETURNS BOOLEAN AS $$
+DECLARE
+  current_version BIGINT;
+  entry JSONB;
+  new_expense_id BIGINT;
+BEGIN
+  INSERT INTO public.trip_ledger_sync (trip_id, version)
+  VALUES (p_trip_id, -1)
+  ON CONFLICT (trip_id) DO NOTHING;
+
+  -- Row lock serializes concurrent syncs of the same trip
+  SELECT version INTO current_version
+  FROM public.trip_ledger_sync
+  WHERE trip_id = p_trip_id
+  FOR UPDATE;
+
+  IF p_version <= current_version THEN
+    RETURN FALSE;
+  END IF;
+
+  -- Splits go with their expenses (ON DELETE CASCADE)
+  DELETE FROM public.expenses
+  WHERE trip_id = p_trip_id AND ledger_id IS NOT NULL;
+
+  FOR entry IN SELECT value FROM jsonb_array_elements(p_entries)
+  LOOP
+    INSERT INTO public.expenses (trip_id, ledger_id, kind, description, amount, currency, paid_by_name)
+    VALUES (
+      p_trip_id,
+      entry->>'ledger_id',
+      COALESCE(entry->>'kind', 'expense'),
+      entry->>'description',
+      (entry->>'amount')::NUMERIC,
+      entry->>'currency',
+      entry->>'paid_by_name'
+    )
+    RETURNING id INTO new_expense_id;
+
+    INSERT INTO public.expense_splits (expense_id, person_name, amount)
+    SELECT new_expense_id, split->>'person_name', (split->>'amount')::NUMERIC
+    FROM jsonb_array_elements(entry->'splits') AS split;
+  END LOOP;
+
+  UPDATE public.trip_ledger_sync
+  SET version = p_version, synced_at = NOW()
+  WHERE trip_id = p_trip_id;
+
+  RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION sync_trip_ledger IS 'Replace a trip''s mirrored ledger with a newer snapshot';
+
+-- ============================================
+-- VIEW: trip_ledger_balances
+-- ============================================
+-- Balance per trip, currency and person.
+-- Positive balance = owed money, negative = owes money.
+
+CREATE OR REPLACE VIEW trip_ledger_balances AS
+SELECT
+  trip_id,
+  currency,
+  person,
+  SUM(paid) AS paid,
+  SUM(owed) AS owed,
+  SUM(paid) - SUM(owed) AS balance
+FROM (
+  SELECT e.trip_id, e.currency, e.paid_by_name AS person, e.amount AS paid, 0::NUMERIC AS owed
+  FROM public.expenses e
+  WHERE e.ledger_id IS NOT NULL
+  UNION ALL
+  SELECT e.trip_id, e.currency, s.person_name AS person, 0::NUMERIC AS paid, s.amount AS owed
+  FROM public.expense_splits s
+  JOIN public.expenses e ON e.id = s.expense_id
+  WHERE e.ledger_id IS NOT NULL
+) AS entries
+GROUP BY trip_id, currency, person;
+
+COMMENT ON VIEW trip_ledger_balances IS 'Ledger balance per trip, currency and person';
+
+-- ============================================
+-- VIEW: trip_ledger_totals
+-- ============================================
+-- Spending per trip and currency (payments settle debts, they are not spending)
+
+CREATE OR REPLACE VIEW trip_ledger_totals AS
+SELECT
+  trip_id,
+  currency,
+  COALESCE(SUM(amount) FILTER (WHERE kind = 'expense'), 0) AS total_spent,
+  COUNT(*) FILTER (WHERE kind = 'expense') AS expense_count,
+  COUNT(*) FILTER (WHERE kind = 'payment') AS payment_count
+FROM public.expenses
+WHERE ledger_id IS NOT NULL
+GROUP BY trip_id, currency;
+
+COMMENT ON VIEW trip_ledger_totals IS 'Ledger spending per trip and currency';
@@ -0,0 +1,107 @@
+-- ============================================
+-- JOURNI - Maintained participant count on trips
+-- ============================================
+-- The public join page (GET /api/trips/code/{code}) showed the number of
+-- participants with a count(*) over trip_participants on every view. The
+-- count is now a column on trips, kept up to date by triggers in the same
+-- transaction as each participant insert/delete (like milestones.photo_count),
+-- so the page is a single-row read.
+-- ============================================
+
+ALTER TABLE public.trips
+  ADD COLUMN IF NOT EXISTS participant_count INTEGER NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN public.trips.participant_count IS 'Number of trip_participants rows (maintained by triggers)';
+
+-- Backfill existing trips
+UPDATE public.trips t
+SET participant_count = c.total
+FROM (
+  SELECT trip_id, COUNT(*) AS total
+  FROM public.trip_participants
+  GROUP BY trip_id
+) AS c
+WHERE c.trip_id = t.id AND t.participant_count <> c.total;
+
+-- Trigger to update trip participant count on insert
+CREATE OR REPLACE FUNCTION update_trip_participant_count_on_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE public.trips
+  SET participant_count = participant_count + 1
+  WHERE id = NEW.trip_id;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS participant_insert_update_trip_count ON public.trip_participants;
+CREATE TRIGGER participant_insert_update_trip_count
+  AFTER INSERT ON public.trip_participants
+  FOR EACH ROW
+  EXECUTE FUNCTION update_trip_participant_count_on_insert();
+
+-- Trigger to update trip participant count on delete
+CREATE OR REPLACE FUNCTION update_trip_participant_count_on_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE public.trips
+  SET participant_count = GREATEST(participant_count - 1, 0)
+  WHERE id = OLD.trip_id;
+  RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS participant_delete_update_trip_count ON public.trip_participants;
+CREATE TRIGGER participant_delete_update_trip_count
+  AFTER DELETE ON public.trip_participants
+  FOR EACH ROW
+  EXECUTE FUNCTION update_trip_participant_count_on_delete();
+
+-- ============================================
+-- create_trip_with_creator: return the trip with its count
+-- ============================================
+-- Same as migration 009, but reads the trip back after inserting the
+-- creator so the returned (and cached) record has participant_count = 1.
+
+CREATE OR REPLACE FUNCTION create_trip_with_creator(
+  p_creator_id UUID,
+  p_name TEXT,
+  p_start_date DATE,
+  p_end_date DATE,
+  p_location TEXT DEFAULT NULL
+)
+RETURNS JSONB AS $$
+DECLARE
+  new_trip public.trips;
+  membership public.trip_participants;
+  attempt INTEGER := 0;
+BEGIN
+  -- generate_session_code() checks for collisions, but two concurrent
+  -- creations can still pick the same code: retry on unique violation
+  LOOP
+    BEGIN
+      INSERT INTO public.trips (creator_id, name, session_code, start_date, end_date, location, status)
+      VALUES (p_creator_id, p_name, generate_session_code(), p_start_date, p_end_date, p_location, 'active')
+      RETURNING * INTO new_trip;
+      EXIT;
+    EXCEPTION WHEN unique_violation THEN
+      attempt := attempt + 1;
+      IF attempt >= 5 THEN
+        RAISE;
+      END IF;
+    END;
+  END LOOP;
+
+  INSERT INTO public.trip_participants (trip_id, user_id, role)
+  VALUES (new_trip.id, p_creator_id, 'admin')
+  RETURNING * INTO membership;
+
+  -- participant_count was bumped by the insert trigger above
+  SELECT * INTO new_trip FROM public.trips WHERE id = new_trip.id;
+
+  RETURN jsonb_build_object(
+    'trip', to_jsonb(new_trip),
+    'membership', to_jsonb(membership)
+  );
+END;
+$$ LANGUAGE plpgsql;
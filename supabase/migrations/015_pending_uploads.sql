@@ -0,0 +1,26 @@
+-- ============================================
+-- JOURNI - Pre-uploaded chat images, shared by all workers
+-- ============================================
+-- POST /api/sessions/{code}/uploads streams an image to Storage and returns
+-- an upload_id; the chat message that uses it can arrive on another
+-- uvicorn worker. Tokens live here so any worker can claim them. A claim
+-- deletes the row (single use); rows older than UPLOAD_TOKEN_TTL are
+-- taken by the backend's pruner, which also deletes the Storage object.
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS public.pending_uploads (
+  upload_id TEXT PRIMARY KEY,
+  thread_id TEXT NOT NULL,
+  url TEXT NOT NULL,
+  path TEXT NOT NULL,
+  media_type TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+COMMENT ON TABLE public.pending_uploads IS 'Uploaded chat images waiting to be referenced by a message';
+
+CREATE INDEX IF NOT EXISTS idx_pending_uploads_created_at ON public.pending_uploads(created_at);
+
+-- Backend only (service key)
+ALTER TABLE public.pending_uploads ENABLE ROW LEVEL SECURITY;